@@ -1,63 +1,444 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from run import main
+from engine import columnar, metrics, serialization
+from engine.engine import get_engine
+from engine.jobs import JobQueue
+from engine.profiling import profile_analysis
+from engine.session import SessionRegistry
+from engine.stream import analyze_stream
 import pandas as pd 
 import io  
+import queue
+import time
 
 app = Flask(__name__)
 CORS(app)
 
+# The engine keeps the models loaded between requests
+# the languages listed in the config are loaded at startup, the others on their first request
+engine = get_engine()
+engine.warm_up(engine.param_conf['preload_languages'])
+sessions = SessionRegistry(engine, engine.param_conf['max_sessions'], engine.param_conf['session_ttl'])
+# The long VDs are analyzed by a pool of workers, the requests of the jobs return at once
+jobs = JobQueue(engine, engine.param_conf['job_workers'], engine.param_conf['job_queue_size'],
+                engine.param_conf['job_ttl'])
+metrics.register_engine(engine, jobs, sessions)
+
+# Values of the parameters missing in the payload
+# (the parameters of the features that are not enabled can be omitted)
+DEFAULT_PARAMETERS = {
+    "maxCorefLength": 5,
+    "maxLength": 40,
+    "seuilDuplication": 2,
+    "windowDuplication": 2,
+    "temps": "strict",
+    "postTagRepetition": ["ADV", "VERB", "ADJ"],
+    "vocCinema": "",
+    "vocOffensant": "",
+}
+
+
+@app.before_request
+def start_request():
+    g.start_time = time.perf_counter()
+    # details of the request added to its log by the endpoints
+    g.log_fields = {}
+    metrics.REQUESTS.labels(request.endpoint).inc()
+
+
+@app.after_request
+def log_request(response):
+    """
+    Count the errors and log a sample of the requests, without their text
+    """
+    if response.status_code >= 400:
+        metrics.ERRORS.labels(request.endpoint, str(response.status_code)).inc()
+    metrics.log_request(request.endpoint, engine.param_conf['log_sample_rate'], error=response.status_code >= 400,
+                        status=response.status_code, duration=round(time.perf_counter() - g.start_time, 4),
+                        request_bytes=request.content_length, response_bytes=response.content_length,
+                        **g.get("log_fields", {}))
+    return response
+
+
+# Representations of the outputs by media type of the Accept header: records (JSON of the documents and their
+# features), columnar JSON and Arrow IPC (see engine.columnar)
+OUTPUT_FORMATS = {"application/json": "json", columnar.COLUMNAR_MIMETYPE: "columnar", columnar.ARROW_MIMETYPE: "arrow"}
+
+
+def output_format() -> str:
+    """
+    Representation of the output asked by the Accept header of the request, records by default
+    """
+    return OUTPUT_FORMATS[request.accept_mimetypes.best_match(list(OUTPUT_FORMATS), "application/json")]
+
+
+def serialize(output, etag: str = None, representation: str = "json") -> Response:
+    """
+    Response of an output, compressed with the best encoding of the Accept-Encoding header of the request
+    The durations of the serialization and of the compression and the sizes are recorded in the metrics
+    :param etag: ETag of the output, suffixed by the representation and the encoding of the response
+    :param representation: json, columnar or arrow (see OUTPUT_FORMATS)
+    """
+    start_time = time.perf_counter()
+    if representation == "arrow":
+        body = columnar.to_arrow(output)
+    else:
+        body = serialization.dumps(columnar.to_columnar(output) if representation == "columnar" else output)
+    metrics.observe("serialization", time.perf_counter() - start_time)
+    metrics.SERIALIZED_BYTES.inc(len(body))
+
+    encoding = None
+    if len(body) >= serialization.MIN_COMPRESSED_SIZE:
+        encoding = request.accept_encodings.best_match(serialization.ENCODINGS)
+    if encoding is not None:
+        start_time = time.perf_counter()
+        body = serialization.compress(body, encoding)
+        metrics.observe("compression", time.perf_counter() - start_time)
+    metrics.RESPONSE_BYTES.labels(encoding if encoding else "identity").observe(len(body))
+
+    mimetypes = {value: mimetype for mimetype, value in OUTPUT_FORMATS.items()}
+    response = Response(body, mimetype=mimetypes[representation])
+    response.vary.update(("Accept", "Accept-Encoding"))
+    if encoding is not None:
+        response.content_encoding = encoding
+    if etag is not None:
+        response.set_etag(etag_of(etag, representation, encoding))
+    return response
+
+
+def etag_of(key: str, representation: str = "json", encoding: str = None) -> str:
+    """
+    ETag of a result in a representation and an encoding
+    :param key: address of the result in the result cache
+    :param representation: json, columnar or arrow
+    :param encoding: encoding of the response, None if not compressed
+    """
+    return "-".join([key] + ([representation] if representation != "json" else []) + ([encoding] if encoding else []))
+
+
+def read_lexicon(content: str, lexicons: dict = None):
+    """
+    Read a personal lexicon sent in a request
+    :param content: TSV content of the lexicon, empty for the lexicon of the config
+    :param lexicons: lexicons already read by content, shared by the items of a batch
+    :return: dataframe of the lexicon, None if empty
+    """
+    if not str(content):
+        return None
+    if lexicons is None:
+        return pd.read_csv(io.StringIO(content), sep="\t")
+    if content not in lexicons:
+        lexicons[content] = pd.read_csv(io.StringIO(content), sep="\t")
+    return lexicons[content]
+
+
+def lexicon_parameter(data: dict, name: str, lexicons: dict = None):
+    """
+    Personal lexicon of a request, given by its TSV content (vocCinema) or by the id of a lexicon
+    registered with /lexicons (vocCinemaId)
+    :param data: payload of the request
+    :param name: vocCinema or vocOffensant
+    :param lexicons: lexicons already read by content (see read_lexicon)
+    :return: dataframe of the lexicon, None for the lexicon of the config
+    :raise KeyError: if the id is unknown
+    """
+    lexicon_id = data.get(name + "Id")
+    if not lexicon_id:
+        return read_lexicon(data[name], lexicons)
+    if str(data[name]):
+        raise ValueError("%s and %sId can not be given together" % (name, name))
+    return engine.lexicons.get(lexicon_id)
+
+
+def personal_lexicons(data: dict, lexicons: dict = None) -> dict:
+    """
+    Other personal lexicons of a request, each one is a feature of the output named after it
+    ("lexicons": {"jargon": "<TSV content>", "marques": {"id": "<id of a lexicon registered with /lexicons>"}})
+    :param data: payload of the request
+    :param lexicons: lexicons already read by content (see read_lexicon)
+    :return: dataframe of each lexicon by name, None if there is none
+    :raise KeyError: if an id is unknown
+    """
+    personal = {}
+    for name, value in dict(data.get("lexicons") or {}).items():
+        personal[name] = engine.lexicons.get(value["id"]) if isinstance(value, dict) else read_lexicon(value, lexicons)
+        if personal[name] is None:
+            raise ValueError("The lexicon %s is empty" % name)
+    return personal or None
+
+
+def parse_parameters(data: dict, lexicons: dict = None) -> dict:
+    """
+    Convert the payload of a request into the arguments of Engine.analyze
+    :param data: payload of the request
+    :param lexicons: lexicons already read by content (see read_lexicon)
+    :return: dictionary of arguments
+    """
+    data = dict(DEFAULT_PARAMETERS, **data)
+
+    return {
+        "text": data['text'],
+        "max_coref_length": int(data['maxCorefLength']),
+        "max_length": int(data['maxLength']),
+        "seuil_duplication": int(data['seuilDuplication']),
+        "strict_mode": True if data['temps'] == "strict" else False,
+        "window_duplication": int(data["windowDuplication"]),
+        "postag_repetition": data['postTagRepetition'],
+        "lemmatizing": True,
+        "voc_cinema_df": lexicon_parameter(data, 'vocCinema', lexicons),
+        "voc_offensant_df": lexicon_parameter(data, 'vocOffensant', lexicons),
+        "lexicons": personal_lexicons(data, lexicons),
+        "with_emotion": True,
+        # list of the features to compute, all of them if absent
+        "features": data.get('features'),
+    }
+
+
 @app.route('/predict', methods = ['GET', 'POST'])
 def predict():
 
     try :
-        data = request.json
-
-        text                = data['text'] 
-        max_coref_length    = int(data['maxCorefLength'])
-        max_length          = int(data['maxLength'])
-        seuil_duplication   = int(data['seuilDuplication'])
-        strict_mode         = True if data['temps'] == "strict" else False
-        window_duplication  = int(data["windowDuplication"])
-        postag_repetition   = data['postTagRepetition']
-        voc_cinema_df       = None if not str(data['vocCinema']) else pd.read_csv(io.StringIO(data['vocCinema']), sep="\t")
-        voc_offensant_df    = None if not str(data['vocOffensant']) else pd.read_csv(io.StringIO(data['vocOffensant']), sep="\t")
-        with_emotion        = True
-    except: 
-        print("ERROR")
-    
-    print("Text", text, type(text))
-    print("max_length", max_length, type(max_length))
-    print("seuil_duplication", seuil_duplication, type(seuil_duplication))
-    print("strict_mode", strict_mode, type(strict_mode))
-    print("window_duplication", window_duplication, type(window_duplication))
-    print("postag_repetition", postag_repetition, type(postag_repetition))
-    print("max_coref_length", max_coref_length, type(max_coref_length))
-    print("with_emotion", with_emotion, type(with_emotion))
-    print("voc_cinema_df", voc_cinema_df, type(voc_cinema_df))
-    print("voc_offensant_df", voc_offensant_df, type(voc_offensant_df))
-
-    output =  main(
-                text                = text,
-                max_length          = max_length,
-                seuil_duplication   = seuil_duplication,
-                window_duplication  = window_duplication,
-                postag_repetition   = postag_repetition, 
-                lemmatizing         = True, 
-                strict_mode         = strict_mode,
-                max_coref_length    = max_coref_length,
-                with_emotion        = with_emotion,
-                voc_cinema_df       = voc_cinema_df,
-                voc_offensant_df    = voc_offensant_df
-            )
-
-
-    print(output)
-
-    response = jsonify(output)
-            
-    return (response)
+        parameters = parse_parameters(request.json)
+        # the ETag of a result is its address in the result cache
+        key = engine.result_key(**parameters)
+    except (KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
+
+    representation = output_format()
+    if representation == "arrow":
+        try :
+            columnar.check_arrow()
+        except ImportError as error:
+            return jsonify({"error": str(error)}), 406
+
+    # profiling on demand: "profile": true (sampling) or the mode ("sampling" or "deterministic")
+    # the output then holds the profile of the request, which is never taken from the result cache
+    profile_mode = request.json.get("profile")
+    if profile_mode:
+        try :
+            output, profile = profile_analysis(engine, "sampling" if profile_mode is True else str(profile_mode),
+                                               **parameters)
+        except ValueError as error:
+            g.log_fields["message"] = str(error)
+            return jsonify({"error": "Invalid parameters: %s" % error}), 400
+        output["profile"] = profile
+        g.log_fields = {"num_chars": len(parameters["text"]), "profile": profile["profile_id"]}
+        return serialize(output, representation=representation)
+
+    # the client already has this result, in one of the encodings
+    for encoding in (None,) + serialization.ENCODINGS:
+        if etag_of(key, representation, encoding) in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag_of(key, representation, encoding))
+            response.vary.update(("Accept", "Accept-Encoding"))
+            return response
+
+    output = engine.analyze(**parameters)
+    g.log_fields = {"num_chars": len(parameters["text"]), "num_lines": len(output["documents"]),
+                    "features": parameters["features"], "key": key}
+
+    # only the complete results are kept (not those without emotions because of the emotion service)
+    cached = engine.result_cache is not None and engine.result_cache.contains(key)
+
+    return serialize(output, key if cached else None, representation)
+
+
+@app.route('/predict_stream', methods = ['POST'])
+def predict_stream():
+    """
+    Analyze a long VD by chunks of lines, the payload is the one of /predict
+    (with optional chunkSize: number of lines analyzed together and corefContext: number of lines
+    before a chunk on which its coreference is computed)
+    The response is NDJSON, one document of /predict by line, sent as soon as the line is analyzed
+    """
+    try :
+        parameters = parse_parameters(request.json)
+        parameters["chunk_size"] = int(request.json.get("chunkSize", engine.param_conf['stream_chunk_size']))
+        parameters["coref_context"] = int(request.json.get("corefContext", 10))
+        documents = analyze_stream(engine, **parameters)
+    except (KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
+
+    return Response(stream_with_context(serialization.dumps(document) + b"\n" for document in documents),
+                    mimetype="application/x-ndjson")
+
+
+@app.route('/predict_batch', methods = ['POST'])
+def predict_batch():
+    """
+    Analyze many VDs at once, the payload holds the VDs in "items" (each one with the fields of /predict)
+    and the fields shared by the items at the top level, an item overrides the shared fields
+    The results are in the order of the items, an invalid item gets an error without failing the others
+    """
+    try :
+        shared = {name: value for name, value in request.json.items() if name != "items"}
+        items = list(request.json["items"])
+    except (AttributeError, KeyError, TypeError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
+
+    # the personal lexicons shared by the items are read and indexed once
+    lexicons = {}
+    batch = []
+    results = [None] * len(items)
+    for i, item in enumerate(items):
+        try :
+            batch.append(parse_parameters(dict(shared, **item), lexicons))
+        except (KeyError, TypeError, ValueError) as error:
+            results[i] = {"error": "Invalid parameters: %s" % error}
+    g.log_fields = {"num_items": len(items), "num_invalid": len(items) - len(batch)}
+
+    outputs = iter(engine.analyze_batch(batch))
+    results = [result if result is not None else next(outputs) for result in results]
+
+    return serialize({"results": results})
+
+
+@app.route('/session', methods = ['POST'])
+def open_session():
+    """
+    Open an editing session on a VD, the payload is the one of /predict
+    (with an optional corefContext: number of lines around the edits on which the coreference is computed again)
+    """
+    try :
+        parameters = parse_parameters(request.json)
+        parameters["coref_context"] = int(request.json.get("corefContext", 10))
+        session = sessions.open(**parameters)
+    except (KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
+
+    return jsonify(session.output())
+
+
+@app.route('/session/<session_id>/edit', methods = ['POST'])
+def edit_session(session_id):
+    """
+    Apply edits to the VD of a session and return the results of the lines which changed
+    payload: {"edits": [{"action": "insert" | "replace" | "delete", "line": 3, "text": "..."}, ...]}
+    """
+    try :
+        session = sessions.get(session_id)
+    except KeyError:
+        return jsonify({"error": "Unknown session %s" % session_id}), 404
+
+    try :
+        output = session.edit(request.json["edits"])
+    except (KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid edits: %s" % error}), 400
+
+    return jsonify(output)
+
+
+@app.route('/session/<session_id>', methods = ['GET', 'DELETE'])
+def session_output(session_id):
+    """
+    Results of the whole VD of a session (GET) or close the session (DELETE)
+    """
+    if request.method == 'DELETE':
+        sessions.close(session_id)
+        return jsonify({"session_id": session_id, "closed": True})
+
+    try :
+        session = sessions.get(session_id)
+    except KeyError:
+        return jsonify({"error": "Unknown session %s" % session_id}), 404
+
+    return jsonify(session.output())
+
+
+@app.route('/jobs', methods = ['POST'])
+def submit_job():
+    """
+    Queue the analysis of a VD, the payload is the one of /predict
+    The response holds the id of the job, its status is then given by /jobs/<job_id>
+    """
+    try :
+        job = jobs.submit(**parse_parameters(request.json))
+    except (KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
+    except queue.Full as error:
+        return jsonify({"error": "Too many jobs: %s" % error}), 503
+
+    return jsonify(job.status()), 202
+
+
+@app.route('/jobs/<job_id>', methods = ['GET'])
+def job_status(job_id):
+    """
+    Status of a job and progress of each stage of its analysis
+    """
+    try :
+        job = jobs.get(job_id)
+    except KeyError:
+        return jsonify({"error": "Unknown job %s" % job_id}), 404
+
+    return jsonify(job.status())
+
+
+@app.route('/jobs/<job_id>/result', methods = ['GET'])
+def job_result(job_id):
+    """
+    Output of the analysis of a job, in the format of /predict (409 while the job is not done)
+    """
+    try :
+        job = jobs.get(job_id)
+    except KeyError:
+        return jsonify({"error": "Unknown job %s" % job_id}), 404
+
+    if job.state != "done":
+        return jsonify(job.status()), 409
+
+    return serialize(job.result, representation=output_format())
+
+
+@app.route('/jobs/<job_id>/cancel', methods = ['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a job, a running analysis stops at its next step
+    """
+    try :
+        job = jobs.cancel(job_id)
+    except KeyError:
+        return jsonify({"error": "Unknown job %s" % job_id}), 404
+
+    return jsonify(job.status())
+
+
+@app.route('/lexicons', methods = ['GET', 'POST'])
+def lexicons():
+    """
+    Register a personal lexicon (POST) or list the registered lexicons (GET)
+    payload: {"lexicon": "<TSV content with a column TERM_FR/FR and/or TERM_EN/EN>", "name": "optional name"}
+    The id returned is then given in vocCinemaId or vocOffensantId (or {"id": ...} in lexicons) instead of the
+    content of the lexicon, the lexicon is lemmatized and indexed only on its first use. The lexicons of the config
+    are registered at startup (names voc_cinema and voc_offensant)
+    """
+    if request.method == 'GET':
+        return jsonify({"lexicons": engine.lexicons.lexicons()})
+
+    try :
+        name = request.json.get("name")
+        lexicon_id = engine.lexicons.register_content(request.json["lexicon"], name)
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        g.log_fields["message"] = str(error)
+        return jsonify({"error": "Invalid lexicon: %s" % error}), 400
+
+    return jsonify({"id": lexicon_id, "name": name}), 201
+
 
+@app.route('/metrics', methods = ['GET'])
+def prometheus_metrics():
+    """
+    Metrics in the text format of Prometheus: durations of the stages, lines, tokens, errors,
+    models loaded, jobs waiting and caches
+    """
+    body, content_type = metrics.metrics_response()
+    return Response(body, content_type=content_type)
 
 
 @app.route('/status', methods = ['GET', 'POST'])
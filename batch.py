@@ -0,0 +1,373 @@
+"""
+Analysis of a catalog of VD files from the command line.
+The files (directories, globs or paths) are analyzed by a pool of processes, each worker loads its models once
+and analyzes many files. The results are written as they come, one record by file, in a JSONL file or in
+Parquet files (one part by group of records, pyarrow needed). A checkpoint manifest lists the files done, a file
+is listed once its record is on disk: an interrupted run started again with the same manifest only analyzes the
+files not done yet, without losing or duplicating records.
+A file which can not be read or analyzed is recorded with its error and does not stop the run. When a worker dies
+(ex: out of memory), the pool is started again and the files it was analyzing are analyzed again one at a time:
+only the file which killed its worker is recorded with an error
+
+Usage: python batch.py catalog/ "other/*.tsv" --output results.jsonl --workers 4
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, List
+
+from engine.columnar import to_columnar
+from engine.engine import Engine, FEATURES
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+# Parameters of the analyses, those of the web service by default
+DEFAULT_PARAMETERS = {
+    "max_length": 40,
+    "seuil_duplication": 2,
+    "window_duplication": 2,
+    "postag_repetition": ["ADV", "VERB", "ADJ"],
+    "lemmatizing": True,
+    "strict_mode": True,
+    "max_coref_length": 5,
+    "with_emotion": False,
+}
+
+# Engine of a worker process, created by _init_worker
+_worker_engine = None
+
+
+def collect_files(inputs: Iterable[str], extensions: Iterable[str] = (".txt", ".tsv")) -> List[str]:
+    """
+    VD files to analyze
+    :param inputs: files, directories (searched recursively) or glob patterns
+    :param extensions: extensions of the files taken in the directories
+    :return: sorted paths, without duplicates
+    """
+    paths = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                paths.update(os.path.join(root, name) for name in files if name.endswith(tuple(extensions)))
+        elif os.path.isfile(path):
+            paths.add(path)
+        else:
+            paths.update(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+
+    return sorted(os.path.abspath(path) for path in paths)
+
+
+def file_signature(path: str) -> Dict[str, Any]:
+    """
+    Size and modification time of a file, a file done is analyzed again if it changed
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class Manifest:
+    """
+    Checkpoint of a run: one JSON line by file done (path, status, signature), appended as the files are done
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: file of the manifest, the records of a previous run are read if it exists
+        """
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted run
+                        continue
+                    self.records[record["path"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str, retry_failed: bool = True) -> bool:
+        """
+        :param path: path of a VD file
+        :param retry_failed: the files which failed are not done
+        :return: True if the file was done by a previous run and did not change
+        """
+        record = self.records.get(path)
+        if record is None or (retry_failed and record["status"] != "ok"):
+            return False
+        try:
+            return file_signature(path) == record["signature"]
+        except OSError:
+            return False
+
+    def add(self, path: str, status: str, signature: Dict[str, Any]) -> None:
+        record = {"path": path, "status": status, "signature": signature}
+        self.records[path] = record
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlWriter:
+    """
+    Records appended to a JSONL file, one line by file
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """
+        :return: True, a record is on disk once written
+        """
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Records written in a directory of Parquet files, one part by group of records
+    (path, status, error, duration and output of the analysis as JSON)
+    """
+
+    def __init__(self, directory: str, rows_by_part: int = 1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The parquet output needs the pyarrow package (pip install pyarrow)")
+        self._pyarrow = pyarrow
+        self.directory = directory
+        self.rows_by_part = rows_by_part
+        self._rows = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """
+        :return: True if the records written so far are on disk (a part was just written)
+        """
+        self._rows.append({"path": record["path"], "status": record["status"], "error": record.get("error"),
+                           "duration": record.get("duration"),
+                           "output": json.dumps(record["output"], ensure_ascii=False) if "output" in record
+                           else None})
+        if len(self._rows) >= self.rows_by_part:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        # a part by flush, the parts of the previous runs are kept. The part is written under a hidden name
+        # (ignored by the readers of the directory) and renamed once on disk, an interrupted run leaves no half part
+        name = "part-%d-%d.parquet" % (time.time() * 1000, os.getpid())
+        temporary_path = os.path.join(self.directory, "." + name)
+        self._pyarrow.parquet.write_table(self._pyarrow.Table.from_pylist(self._rows), temporary_path)
+        with open(temporary_path, "rb") as part_file:
+            os.fsync(part_file.fileno())
+        os.replace(temporary_path, os.path.join(self.directory, name))
+        self._rows = []
+
+    def close(self) -> None:
+        self.flush()
+
+
+def _init_worker(config_path: str) -> None:
+    # the models are loaded once by worker, the detectors of a file are run one after another
+    # since the files are already analyzed in parallel
+    global _worker_engine
+    _worker_engine = Engine(config_path)
+    _worker_engine.param_conf["executor"] = "sequential"
+    _worker_engine.result_cache = None
+
+
+def analyze_file(path: str, parameters: Dict[str, Any], engine: Engine = None,
+                 columnar: bool = False) -> Dict[str, Any]:
+    """
+    Analyze a VD file, its errors are recorded instead of raised
+    :param path: path of the file
+    :param parameters: arguments of Engine.analyze (without the text)
+    :param engine: engine of the analysis, that of the worker if None
+    :param columnar: give the output in the columnar format (see engine.columnar)
+    :return: record of the file: path, status (ok or error), output or error, duration in seconds
+    """
+    engine = engine if engine else _worker_engine
+    start_time = time.time()
+    record = {"path": path}
+    try:
+        record["signature"] = file_signature(path)
+        with open(path, encoding="utf-8") as vd_file:
+            text = vd_file.read()
+        output = engine.analyze(text, **parameters)
+        record["output"] = to_columnar(output) if columnar else output
+        record["status"] = "ok"
+    except Exception as error:
+        record["status"] = "error"
+        record["error"] = "%s: %s" % (type(error).__name__, error)
+        record["traceback"] = traceback.format_exc()
+    record["duration"] = time.time() - start_time
+
+    return record
+
+
+def run_batch(paths: List[str], writer, manifest: Manifest, parameters: Dict[str, Any], config_path: str = None,
+              workers: int = None, max_pending: int = None, columnar: bool = False) -> Dict[str, int]:
+    """
+    Analyze VD files with a pool of processes, the records are written as they come and checkpointed once the
+    writer has them on disk (the last records are flushed and checkpointed when the run ends or is interrupted)
+    :param paths: files to analyze
+    :param writer: JsonlWriter or ParquetWriter of the records
+    :param manifest: checkpoint of the run
+    :param parameters: arguments of Engine.analyze (without the text)
+    :param config_path: config file of the engines of the workers
+    :param workers: number of processes, number of CPUs if None
+    :param max_pending: max number of files submitted to the pool at a time, 4 by worker if None
+    :param columnar: give the outputs in the columnar format (see engine.columnar)
+    :return: number of files ok and in error
+    """
+    counts = {"ok": 0, "error": 0}
+    workers = workers if workers else os.cpu_count()
+    max_pending = max_pending if max_pending else 4 * workers
+    # files written but not on disk yet (path, status, signature), they are not in the manifest
+    unrecorded = []
+    # files pending when a worker died, analyzed again one at a time to find the file which killed it
+    suspects = []
+    pool = _new_pool(workers, config_path)
+    remaining = iter(paths)
+    pending = {}
+    try:
+        while True:
+            # the files are submitted as the workers progress, not all at once
+            if suspects:
+                if not pending:
+                    path = suspects.pop(0)
+                    pending[pool.submit(analyze_file, path, parameters, None, columnar)] = path
+            else:
+                for path in remaining:
+                    pending[pool.submit(analyze_file, path, parameters, None, columnar)] = path
+                    if len(pending) >= max_pending:
+                        break
+            if not pending:
+                break
+            alone = len(pending) == 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool as error:
+                    # a worker died (ex: out of memory) and the pool failed all its files: the file is analyzed
+                    # again, unless it was alone in the pool and killed the worker
+                    broken = True
+                    if not alone:
+                        suspects.append(path)
+                        continue
+                    record = {"path": path, "status": "error", "error": "%s: %s" % (type(error).__name__, error)}
+                except Exception as error:
+                    record = {"path": path, "status": "error", "error": "%s: %s" % (type(error).__name__, error)}
+                signature = record.pop("signature", None)
+                unrecorded.append((path, record["status"], signature))
+                if writer.write(record):
+                    _checkpoint(manifest, unrecorded)
+                counts[record["status"]] += 1
+                if record["status"] != "ok":
+                    print("ERROR %s: %s" % (path, record["error"]))
+            if broken:
+                suspects.extend(pending.values())
+                pending.clear()
+                pool.shutdown(wait=True)
+                pool = _new_pool(workers, config_path)
+                if suspects:
+                    print("WARNING a worker died, %s files are analyzed again one at a time" % len(suspects))
+            print("--- %s/%s files done" % (counts["ok"] + counts["error"], len(paths)))
+    finally:
+        pool.shutdown(wait=True)
+        writer.flush()
+        _checkpoint(manifest, unrecorded)
+
+    return counts
+
+
+def _new_pool(workers: int, config_path: str) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config_path,))
+
+
+def _checkpoint(manifest: Manifest, unrecorded: List[tuple]) -> None:
+    # files whose records are on disk
+    for path, status, signature in unrecorded:
+        manifest.add(path, status, signature)
+    unrecorded.clear()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Analyze a catalog of VD files with a pool of processes")
+    parser.add_argument("inputs", nargs="+", help="VD files, directories or glob patterns")
+    parser.add_argument("--output", required=True, help="JSONL file or directory of Parquet files of the results")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="format of the output (from --output by default)")
+    parser.add_argument("--manifest", help="checkpoint manifest (<output>.manifest.jsonl by default)")
+    parser.add_argument("--columnar", action="store_true",
+                        help="outputs in the compact columnar format (a table of parallel arrays by feature)")
+    parser.add_argument("--skip-failed", action="store_true", help="do not retry the files which failed before")
+    parser.add_argument("--workers", type=int, help="number of processes (number of CPUs by default)")
+    parser.add_argument("--extensions", nargs="+", default=[".txt", ".tsv"],
+                        help="extensions of the VD files taken in the directories")
+    parser.add_argument("--config", help="config file of the tool")
+    parser.add_argument("--features", nargs="+", choices=FEATURES, help="features to compute (all by default)")
+    parser.add_argument("--max-length", type=int, default=DEFAULT_PARAMETERS["max_length"])
+    parser.add_argument("--seuil-duplication", type=int, default=DEFAULT_PARAMETERS["seuil_duplication"])
+    parser.add_argument("--window-duplication", type=int, default=DEFAULT_PARAMETERS["window_duplication"])
+    parser.add_argument("--postag-repetition", nargs="+", default=DEFAULT_PARAMETERS["postag_repetition"])
+    parser.add_argument("--no-lemmatizing", action="store_true", help="match the lexicons without lemmatization")
+    parser.add_argument("--no-strict-mode", action="store_true", help="regular mode of the tense detection")
+    parser.add_argument("--max-coref-length", type=int, default=DEFAULT_PARAMETERS["max_coref_length"])
+    parser.add_argument("--with-emotion", action="store_true", help="call the emotion service")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> Dict[str, int]:
+    args = parse_args(argv)
+    output_format = args.format if args.format else ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    parameters = {"max_length": args.max_length, "seuil_duplication": args.seuil_duplication,
+                  "window_duplication": args.window_duplication, "postag_repetition": args.postag_repetition,
+                  "lemmatizing": not args.no_lemmatizing, "strict_mode": not args.no_strict_mode,
+                  "max_coref_length": args.max_coref_length, "with_emotion": args.with_emotion,
+                  "features": args.features}
+
+    manifest = Manifest(args.manifest if args.manifest else args.output.rstrip("/") + ".manifest.jsonl")
+    paths = collect_files(args.inputs, args.extensions)
+    todo = [path for path in paths if not manifest.is_done(path, retry_failed=not args.skip_failed)]
+    print("--- %s files, %s already done" % (len(paths), len(paths) - len(todo)))
+
+    writer = ParquetWriter(args.output) if output_format == "parquet" else JsonlWriter(args.output)
+    try:
+        counts = run_batch(todo, writer, manifest, parameters, args.config, args.workers, columnar=args.columnar)
+    finally:
+        writer.close()
+        manifest.close()
+    counts["skipped"] = len(paths) - len(todo)
+    print("--- %(ok)s files analyzed, %(error)s errors, %(skipped)s skipped" % counts)
+
+    return counts
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,289 @@
+"""
+Benchmark of the analysis of synthetic VDs of growing sizes.
+For each scenario (language, format, number of lines), the stages of the analysis are run one after another
+(language detection, splitting of the lines, Stanza annotation, conversion to the token table, each detector,
+recording and serialization of the output) and the complete analysis of the engine is run as well
+(detectors run by the executor).
+The latency of each stage, its throughput in lines and tokens by second and its peak of Python memory
+are written in a JSON file, with the scaling exponent of each stage (latency ~ lines ^ exponent)
+to spot the stages growing faster than the size of the VDs
+
+Usage: python -m benchmark.benchmark --sizes 10 100 1000 10000 --output benchmark.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import stanza
+from stanza import Document
+
+from modules import record_outputs
+from engine.annotation_cache import AnnotationCache
+from engine.token_table import TokenTable
+from engine.engine import Engine, FEATURES, STANZA_MODEL_VERSION, plan_processors, select_features, split_lines, \
+    normalize_text
+from benchmark.generator import FORMATS, generate_vd
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# Parameters of the analyses, those of the web service by default
+DEFAULT_PARAMETERS = {
+    "max_length": 40,
+    "seuil_duplication": 2,
+    "window_duplication": 2,
+    "postag_repetition": ["ADV", "VERB", "ADJ"],
+    "lemmatizing": True,
+    "strict_mode": True,
+    "max_coref_length": 5,
+}
+
+# A stage whose scaling exponent is above this value grows faster than the size of the VDs
+SUPER_LINEAR_EXPONENT = 1.2
+
+
+def _measure(function: Callable, args: tuple, memory: bool) -> Tuple[Any, float, int]:
+    """
+    Call a function
+    :param memory: measure the peak of the memory allocated by Python during the call (slower)
+    :return: result, duration in seconds and peak of memory in bytes (0 if not measured)
+    """
+    if memory:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+    start_time = time.perf_counter()
+    result = function(*args)
+    duration = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1] - current if memory else 0
+
+    return result, duration, peak
+
+
+def run_stages(engine: Engine, text: str, features: set, parameters: dict,
+               memory: bool = False) -> Tuple[Dict[str, Dict[str, float]], int]:
+    """
+    Run the stages of an analysis one after another
+    :param engine: engine running the analysis
+    :param text: text of the VD
+    :param features: enabled features
+    :param parameters: parameters of the analysis (see DEFAULT_PARAMETERS)
+    :param memory: measure the peak of memory of each stage
+    :return: duration (and peak of memory) of each stage and number of tokens of the VD
+    """
+    stages = {}
+
+    def stage(name: str, function: Callable, *args):
+        result, duration, peak = _measure(function, args, memory)
+        stages[name] = {"duration": duration}
+        if memory:
+            stages[name]["peak_memory"] = peak
+        return result
+
+    text = normalize_text(text)
+    lang = stage("lang_detection", engine.detect_language, text)
+    lines, clean_text = stage("split_lines", split_lines, text)
+    processors = plan_processors(features, parameters["lemmatizing"])
+    docs = [Document([], text=line) for line in lines]
+    if processors:
+        docs = stage("annotation", engine.annotate, lang, processors, docs)
+    num_tokens = sum(len(sentence.tokens) for doc in docs for sentence in doc.sentences)
+
+    table = stage("token_table", TokenTable.from_docs, docs)
+    tasks = engine.detector_tasks(table, clean_text, lang, features - {"emotions"}, processors, **parameters)
+    results = {feature: stage(feature, function, *args) for feature, (function, args) in tasks.items()}
+    if "emotions" in features:
+        results["emotions"] = stage("emotions", lambda: engine.wait_emotions(
+            engine.dispatch_emotions(lines, lang), time.perf_counter(), lang)[0])
+
+    out_json = stage("record_outputs", record_outputs, table, results)
+    stage("serialization", json.dumps, out_json)
+
+    return stages, num_tokens
+
+
+def scaling_exponent(sizes: List[int], durations: List[float]) -> float:
+    """
+    Exponent of the growth of a duration with the size (slope of the least squares fit in log-log scale)
+    :return: exponent (1 for a linear growth), nan if it can not be computed
+    """
+    points = [(math.log(size), math.log(duration)) for size, duration in zip(sizes, durations) if duration > 0]
+    if len(points) < 2:
+        return float("nan")
+    mean_x = statistics.mean(x for x, _ in points)
+    mean_y = statistics.mean(y for _, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return float("nan")
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """
+    Median and interquartile range of repeated measures
+    """
+    if len(durations) < 2:
+        return {"median": durations[0], "iqr": 0.}
+    quartiles = statistics.quantiles(durations, n=4, method="inclusive")
+    return {"median": statistics.median(durations), "iqr": quartiles[2] - quartiles[0]}
+
+
+def run_scenario(engine: Engine, lang: str, vd_format: str, num_lines: int, features: set, parameters: dict,
+                 repeat: int = 3, memory: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """
+    Benchmark of a synthetic VD
+    :param engine: engine running the analyses
+    :param lang: FR or EN
+    :param vd_format: txt or tsv
+    :param num_lines: number of lines of the VD
+    :param features: enabled features
+    :param parameters: parameters of the analysis (see DEFAULT_PARAMETERS)
+    :param repeat: number of measures of each stage
+    :param memory: measure the peaks of memory (in an additional run, tracemalloc slows the stages down)
+    :param seed: seed of the generation of the VD
+    :return: latencies (each run, median and interquartile range), throughputs and peaks of memory by stage
+    """
+    text = generate_vd(lang, num_lines, vd_format, seed)
+    runs: Dict[str, List[float]] = {}
+    num_tokens = 0
+    for _ in range(repeat):
+        stages, num_tokens = run_stages(engine, text, features, parameters)
+        for name, measure in stages.items():
+            runs.setdefault(name, []).append(measure["duration"])
+        # complete analysis of the engine, the detectors are run by its executor
+        _, duration, _ = _measure(lambda: engine.analyze(text, with_emotion="emotions" in features,
+                                                         features=features, use_cache=False, **parameters),
+                                  (), False)
+        runs.setdefault("analysis", []).append(duration)
+
+    peaks = {}
+    if memory:
+        tracemalloc.start()
+        try:
+            stages, _ = run_stages(engine, text, features, parameters, memory=True)
+            peaks = {name: measure["peak_memory"] for name, measure in stages.items()}
+        finally:
+            tracemalloc.stop()
+
+    results = {}
+    for name, durations in runs.items():
+        summary = summarize(durations)
+        results[name] = dict(summary, runs=durations,
+                             lines_per_second=num_lines / summary["median"] if summary["median"] else None,
+                             tokens_per_second=num_tokens / summary["median"] if summary["median"] else None)
+        if name in peaks:
+            results[name]["peak_memory"] = peaks[name]
+
+    return {"lang": lang, "format": vd_format, "num_lines": num_lines, "num_tokens": num_tokens,
+            "repeat": repeat, "stages": results}
+
+
+def scaling(scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Scaling exponent of each stage, by language and format
+    """
+    curves = {}
+    for scenario in scenarios:
+        curve = curves.setdefault((scenario["lang"], scenario["format"]), {})
+        for name, stage in scenario["stages"].items():
+            curve.setdefault(name, []).append((scenario["num_lines"], stage["median"]))
+
+    output = []
+    for (lang, vd_format), curve in curves.items():
+        for name, points in curve.items():
+            exponent = scaling_exponent([size for size, _ in points], [duration for _, duration in points])
+            output.append({"lang": lang, "format": vd_format, "stage": name,
+                           "exponent": None if math.isnan(exponent) else exponent,
+                           "super_linear": not math.isnan(exponent) and exponent > SUPER_LINEAR_EXPONENT})
+    return output
+
+
+def make_engine(config_path: str = None, cache: bool = False) -> Engine:
+    """
+    Engine of the benchmarks
+    :param cache: keep the annotation cache (the lines already seen are not annotated again)
+    """
+    engine = Engine(config_path)
+    if not cache:
+        engine.annotation_cache = AnnotationCache(max_size=0)
+    engine.result_cache = None
+    return engine
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Description of the machine and of the versions running the benchmark
+    """
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "stanza": stanza.__version__, "stanza_models": STANZA_MODEL_VERSION,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def run_benchmark(langs=("FR", "EN"), formats=FORMATS, sizes=DEFAULT_SIZES, features=None, repeat: int = 3,
+                  memory: bool = True, parameters: dict = None, engine: Engine = None) -> Dict[str, Any]:
+    """
+    Benchmark of all the scenarios (language x format x size)
+    :param features: enabled features, all of them except the emotions (external service) if None
+    :param parameters: parameters of the analyses, DEFAULT_PARAMETERS if None
+    :return: environment, scenarios and scaling exponents
+    """
+    engine = engine if engine else make_engine()
+    features = select_features(features if features else [feature for feature in FEATURES
+                                                           if feature != "emotions"])
+    parameters = dict(DEFAULT_PARAMETERS, **(parameters or {}))
+    # the models of the enabled features are loaded by a first analysis, before the measures
+    for lang in langs:
+        engine.analyze(generate_vd(lang, 5), with_emotion=False, features=features - {"emotions"}, use_cache=False,
+                       **parameters)
+
+    scenarios = []
+    for lang in langs:
+        for vd_format in formats:
+            for num_lines in sizes:
+                print("--- Benchmark %s %s %s lines" % (lang, vd_format, num_lines))
+                scenarios.append(run_scenario(engine, lang, vd_format, num_lines, features, parameters,
+                                              repeat, memory))
+
+    return {"environment": environment(), "langs": list(langs), "formats": list(formats), "sizes": list(sizes),
+            "repeat": repeat, "features": sorted(features), "parameters": parameters,
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "scenarios": scenarios, "scaling": scaling(scenarios)}
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark of the analysis of synthetic VDs")
+    parser.add_argument("--langs", nargs="+", default=["FR", "EN"], help="languages of the VDs")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS, help="formats of the VDs")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES), help="numbers of lines")
+    parser.add_argument("--features", nargs="+", help="features to enable (all of them but emotions by default)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of measures of each stage")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peaks of memory")
+    parser.add_argument("--cache", action="store_true", help="keep the annotation cache during the measures")
+    parser.add_argument("--config", help="config file of the tool")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file of the results")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    results = run_benchmark([lang.upper() for lang in args.langs], args.formats, args.sizes, args.features,
+                            args.repeat, not args.no_memory, engine=make_engine(args.config, args.cache))
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    for curve in results["scaling"]:
+        if curve["super_linear"]:
+            print("Warning: %(stage)s grows as lines ^ %(exponent).2f (%(lang)s %(format)s)" % curve)
+    print("--- Results written in %s" % args.output)
+
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+"""
+Benchmark of the implementations of the detectors over the token table against those over the Stanza documents.
+A synthetic VD is annotated once, then each detector is run on the Stanza documents and on the token table
+(see engine.token_table), the outputs are compared and the speedup of the table is given by detector
+
+Usage: python -m benchmark.detectors --lines 10000 --features person --output detectors.json
+"""
+import argparse
+import json
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+from stanza import Document
+
+from modules import check_length, check_length_table
+from duplication import duplication
+from person import person
+from tense_notpresent import tense_notpresent
+from engine.engine import plan_processors, split_lines, normalize_text
+from engine.token_table import TokenTable
+from benchmark.benchmark import DEFAULT_PARAMETERS, _measure, make_engine, summarize
+from benchmark.generator import generate_vd
+
+
+def implementations(parameters: dict) -> Dict[str, Tuple[Callable, Callable, tuple]]:
+    """
+    Implementations of the detectors compared by the benchmark
+    :param parameters: parameters of the analyses (see benchmark.DEFAULT_PARAMETERS)
+    :return: function over the Stanza documents, function over the token table and their other arguments,
+        by feature
+    """
+    return {
+        "length": (check_length, check_length_table, (parameters["max_length"],)),
+        "duplication": (duplication.check_duplication, duplication.check_duplication_table,
+                        (parameters["seuil_duplication"], parameters["window_duplication"],
+                         parameters["postag_repetition"])),
+        "tense_notpresent": (tense_notpresent.detect_non_present_tense,
+                             tense_notpresent.detect_non_present_tense_table, (parameters["strict_mode"],)),
+        "person": (person.detect_non_third_person, person.detect_non_third_person_table, ()),
+    }
+
+
+def compare_implementations(docs: List[Document], features: List[str], parameters: dict = None,
+                            repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the detectors on annotated documents and on their token table
+    :param docs: annotated Stanza documents of the lines of a VD
+    :param features: detectors to compare (see implementations)
+    :param parameters: parameters of the analyses, DEFAULT_PARAMETERS if None
+    :param repeat: number of measures of each implementation
+    :return: by feature, median durations in seconds over the documents and over the table, speedup
+        and whether the outputs are identical (token_table: duration of the conversion)
+    """
+    detectors = implementations(dict(DEFAULT_PARAMETERS, **(parameters or {})))
+    conversions = [_measure(TokenTable.from_docs, (docs,), False) for _ in range(repeat)]
+    table = conversions[0][0]
+    results = {"token_table": {"table": summarize([duration for _, duration, _ in conversions])["median"]}}
+
+    for feature in features:
+        docs_function, table_function, args = detectors[feature]
+        docs_runs = [_measure(docs_function, (docs,) + args, False) for _ in range(repeat)]
+        table_runs = [_measure(table_function, (table,) + args, False) for _ in range(repeat)]
+        docs_duration = summarize([duration for _, duration, _ in docs_runs])["median"]
+        table_duration = summarize([duration for _, duration, _ in table_runs])["median"]
+        results[feature] = {"documents": docs_duration, "table": table_duration,
+                            "speedup": docs_duration / table_duration if table_duration else None,
+                            "identical": docs_runs[0][0] == table_runs[0][0]}
+
+    return results
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the detectors over the token table and over the Stanza "
+                                                 "documents")
+    parser.add_argument("--lang", default="FR", help="language of the VD")
+    parser.add_argument("--lines", type=int, default=10000, help="number of lines of the VD")
+    parser.add_argument("--features", nargs="+", default=list(implementations(DEFAULT_PARAMETERS)),
+                        choices=list(implementations(DEFAULT_PARAMETERS)), help="detectors to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="number of measures of each implementation")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generation of the VD")
+    parser.add_argument("--config", help="config file of the tool")
+    parser.add_argument("--output", help="JSON file of the results")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> Dict[str, Dict[str, Any]]:
+    args = parse_args(argv)
+    engine = make_engine(args.config)
+    lang = args.lang.upper()
+    lines, _ = split_lines(normalize_text(generate_vd(lang, args.lines, seed=args.seed)))
+    processors = plan_processors(set(args.features), True)
+    print("--- Annotation of %s lines (%s)" % (len(lines), processors))
+    docs = engine.annotate(lang, processors, [Document([], text=line) for line in lines])
+
+    results = compare_implementations(docs, args.features, repeat=args.repeat)
+    print("%-18s %12s %12s %8s  %s" % ("detector", "documents", "table", "speedup", "identical"))
+    for feature, result in results.items():
+        print("%-18s %12s %11.4fs %8s  %s" % (
+            feature, "%.4fs" % result["documents"] if "documents" in result else "-", result["table"],
+            "x%.1f" % result["speedup"] if result.get("speedup") else "-", result.get("identical", "-")))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"lang": lang, "lines": args.lines, "repeat": args.repeat, "results": results}, output_file,
+                      indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+"""
+Generator of synthetic VDs for the benchmarks.
+The lines of the VDs of fichier_tests are recombined at random (with a seed, so that a VD of a given size
+is always the same) to build French and English VDs of any number of lines, in TXT or TSV format
+"""
+import glob
+import os
+import random
+from typing import Dict, List
+
+from engine.engine import split_lines
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "fichier_tests")
+
+# Files of each language, the malformed TSV file is not a VD
+CORPUS_FILES = {
+    "FR": ["test_*_fr.txt", "test_duplication.txt"],
+    "EN": ["test_*_en.txt", "test_person_en_tsv_correct.txt"],
+}
+
+FORMATS = ("txt", "tsv")
+
+_corpus: Dict[str, List[str]] = {}
+
+
+def load_corpus(lang: str) -> List[str]:
+    """
+    Lines of the VDs of fichier_tests in a language, without their timestamps
+    :param lang: FR or EN
+    :return: list of the distinct non empty lines, in a stable order
+    """
+    if lang not in CORPUS_FILES:
+        raise ValueError("Only the English and French languages are supported")
+
+    if lang not in _corpus:
+        lines = []
+        for pattern in CORPUS_FILES[lang]:
+            for path in sorted(glob.glob(os.path.join(CORPUS_DIR, pattern))):
+                with open(path, encoding="utf-8") as vd_file:
+                    _, text = split_lines(vd_file.read())
+                lines.extend(line for line in text.split("\n") if line)
+        _corpus[lang] = list(dict.fromkeys(lines))
+
+    return _corpus[lang]
+
+
+def timestamp(seconds: float) -> str:
+    """
+    Timestamp of a TSV line (ex: 00:45:30.000)
+    """
+    return "%02d:%02d:%06.3f" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def generate_vd(lang: str, num_lines: int, vd_format: str = "txt", seed: int = 0) -> str:
+    """
+    Synthetic VD made of lines of the corpus of a language
+    :param lang: FR or EN
+    :param num_lines: number of lines of the VD
+    :param vd_format: txt (one line by description) or tsv (timestamp and description)
+    :param seed: seed of the choice of the lines
+    :return: text of the VD
+    """
+    if vd_format not in FORMATS:
+        raise ValueError("Unknown format \"%s\" (%s)" % (vd_format, ", ".join(FORMATS)))
+
+    corpus = load_corpus(lang)
+    generator = random.Random("%s-%s-%s" % (lang, num_lines, seed))
+    lines = [generator.choice(corpus) for _ in range(num_lines)]
+    if vd_format == "tsv":
+        # a description every 5 seconds
+        lines = ["%s\t%s" % (timestamp(5 * i), line) for i, line in enumerate(lines)]
+
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""
+Performance regression gate.
+The scenarios of a stored baseline (results of benchmark.benchmark) are run again with the same languages,
+formats, sizes, features and parameters, and each stage is compared with the baseline:
+ - latency: the median of the repeated runs is a regression if it exceeds the baseline median by more than
+   the tolerance plus the noise of the measures (the largest interquartile range of the two runs)
+ - peak_memory: the peak of Python memory is a regression if it exceeds the baseline by more than the tolerance
+A report of the differences by stage is printed and the command exits with 1 if a stage regressed.
+The models are only read from the disk (no download) and the analyses run on the CPU, so that the gate runs
+offline on a CPU-only machine
+
+Usage: python -m benchmark.regression --baseline benchmark_baseline.json [--update-baseline]
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+from benchmark.benchmark import make_engine, run_benchmark
+
+# Relative tolerance of each metric (0.25: 25% slower than the baseline)
+TOLERANCES = {"latency": 0.25, "peak_memory": 0.2}
+
+# Differences below these values are never regressions (timer resolution and small allocations)
+MIN_DIFFERENCES = {"latency": 0.002, "peak_memory": 64 * 1024}
+
+# Exit codes of the command
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_NO_BASELINE = 2
+
+
+def _stage_metrics(stage: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    metrics = {"latency": {"value": stage["median"], "noise": stage.get("iqr", 0.)}}
+    if "peak_memory" in stage:
+        metrics["peak_memory"] = {"value": stage["peak_memory"], "noise": 0.}
+    return metrics
+
+
+def compare_stage(metric: str, baseline: Dict[str, float], current: Dict[str, float],
+                  tolerance: float) -> Dict[str, Any]:
+    """
+    Compare a metric of a stage with the baseline
+    :param metric: latency or peak_memory
+    :param baseline: value and noise (interquartile range) of the baseline
+    :param current: value and noise of the current run
+    :param tolerance: relative tolerance of the metric
+    :return: values, relative change and status (ok, regression or improvement)
+    """
+    difference = current["value"] - baseline["value"]
+    allowed = max(baseline["value"] * tolerance + max(baseline["noise"], current["noise"]),
+                  MIN_DIFFERENCES[metric])
+    status = "ok"
+    if difference > allowed:
+        status = "regression"
+    elif -difference > allowed:
+        status = "improvement"
+
+    return {"metric": metric, "baseline": baseline["value"], "current": current["value"],
+            "change": difference / baseline["value"] if baseline["value"] else None, "status": status}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerances: Dict[str, float] = None) -> List[dict]:
+    """
+    Compare the results of a benchmark with a baseline, stage by stage
+    :param baseline: results of run_benchmark stored as baseline
+    :param current: results of run_benchmark of the same scenarios
+    :param tolerances: relative tolerance by metric ("latency") or by stage and metric ("annotation.latency"),
+        TOLERANCES for the others
+    :return: one comparison by scenario, stage and metric (status new or missing for the stages
+        only in one of the results)
+    """
+    tolerances = tolerances if tolerances else {}
+    baseline_scenarios = {(scenario["lang"], scenario["format"], scenario["num_lines"]): scenario
+                          for scenario in baseline["scenarios"]}
+
+    comparisons = []
+    for scenario in current["scenarios"]:
+        key = (scenario["lang"], scenario["format"], scenario["num_lines"])
+        baseline_stages = baseline_scenarios[key]["stages"] if key in baseline_scenarios else {}
+        for name in list(scenario["stages"]) + [name for name in baseline_stages if name not in scenario["stages"]]:
+            description = {"lang": key[0], "format": key[1], "num_lines": key[2], "stage": name}
+            if name not in baseline_stages or name not in scenario["stages"]:
+                comparisons.append(dict(description, metric="latency", baseline=None, current=None, change=None,
+                                        status="new" if name not in baseline_stages else "missing"))
+                continue
+            baseline_metrics = _stage_metrics(baseline_stages[name])
+            for metric, current_metric in _stage_metrics(scenario["stages"][name]).items():
+                if metric not in baseline_metrics:
+                    continue
+                tolerance = tolerances.get("%s.%s" % (name, metric), tolerances.get(metric, TOLERANCES[metric]))
+                comparisons.append(dict(description, **compare_stage(metric, baseline_metrics[metric],
+                                                                     current_metric, tolerance)))
+
+    return comparisons
+
+
+def _format_value(metric: str, value: float) -> str:
+    if value is None:
+        return "-"
+    if metric == "latency":
+        return "%.4fs" % value
+    return "%.1fMB" % (value / 2 ** 20)
+
+
+def report(comparisons: List[dict]) -> str:
+    """
+    Table of the comparisons, one line by scenario, stage and metric
+    """
+    lines = ["%-4s %-4s %7s %-18s %-12s %12s %12s %8s  %s" % ("lang", "fmt", "lines", "stage", "metric",
+                                                            "baseline", "current", "change", "status")]
+    for comparison in comparisons:
+        change = "-" if comparison["change"] is None else "%+.1f%%" % (comparison["change"] * 100)
+        lines.append("%-4s %-4s %7s %-18s %-12s %12s %12s %8s  %s" % (
+            comparison["lang"], comparison["format"], comparison["num_lines"], comparison["stage"],
+            comparison["metric"], _format_value(comparison["metric"], comparison["baseline"]),
+            _format_value(comparison["metric"], comparison["current"]), change, comparison["status"].upper()
+            if comparison["status"] == "regression" else comparison["status"]))
+    return "\n".join(lines)
+
+
+def environment_differences(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    Differences of machine or versions between a baseline and the current run (the measures are then
+    not comparable, or the upgrade is what is measured)
+    """
+    return ["%s: %s -> %s" % (name, value, current["environment"].get(name))
+            for name, value in baseline["environment"].items()
+            if name != "time" and current["environment"].get(name) != value]
+
+
+def parse_tolerances(values: List[str]) -> Dict[str, float]:
+    """
+    :param values: tolerances as metric=value or stage.metric=value (ex: latency=0.3, annotation.latency=0.1)
+    """
+    tolerances = {}
+    for value in values or []:
+        name, _, tolerance = value.partition("=")
+        if name.split(".")[-1] not in TOLERANCES or not tolerance:
+            raise ValueError("Invalid tolerance \"%s\" (metric=value or stage.metric=value, metrics: %s)"
+                             % (value, ", ".join(TOLERANCES)))
+        tolerances[name] = float(tolerance)
+    return tolerances
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the performances of the analysis with a baseline")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="JSON file of the baseline")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="run the benchmark and store it as the new baseline, without comparing")
+    parser.add_argument("--tolerance", nargs="+", default=[],
+                        help="tolerances as metric=value or stage.metric=value (default: %s)"
+                             % ", ".join("%s=%s" % item for item in TOLERANCES.items()))
+    parser.add_argument("--repeat", type=int, help="number of measures of each stage (that of the baseline by default)")
+    parser.add_argument("--langs", nargs="+", default=["FR", "EN"], help="languages of a new baseline")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000], help="numbers of lines of a new "
+                                                                                      "baseline")
+    parser.add_argument("--features", nargs="+", help="features of a new baseline (all of them but emotions "
+                                                      "by default)")
+    parser.add_argument("--config", help="config file of the tool")
+    parser.add_argument("--output", help="JSON file of the current results and of the comparisons")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    tolerances = parse_tolerances(args.tolerance)
+    # the gate measures the CPU, the GPUs are hidden before the first use of CUDA by torch
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    engine = make_engine(args.config)
+    engine.param_conf["stanza_offline"] = True
+
+    if args.update_baseline:
+        results = run_benchmark([lang.upper() for lang in args.langs], sizes=args.sizes, features=args.features,
+                                repeat=args.repeat if args.repeat else 5, engine=engine)
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print("--- Baseline written in %s" % args.baseline)
+        return EXIT_OK
+
+    if not os.path.isfile(args.baseline):
+        print("ERROR: no baseline %s, create it with --update-baseline" % args.baseline)
+        return EXIT_NO_BASELINE
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    current = run_benchmark(baseline["langs"], baseline["formats"], baseline["sizes"], baseline["features"],
+                            args.repeat if args.repeat else baseline["repeat"], parameters=baseline["parameters"],
+                            engine=engine)
+    comparisons = compare(baseline, current, tolerances)
+
+    for difference in environment_differences(baseline, current):
+        print("Warning: environment changed since the baseline, %s" % difference)
+    print(report(comparisons))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"results": current, "comparisons": comparisons}, output_file, indent=2)
+
+    regressions = [comparison for comparison in comparisons if comparison["status"] == "regression"]
+    if regressions:
+        print("--- %s regression(s) against %s" % (len(regressions), args.baseline))
+        return EXIT_REGRESSION
+    print("--- No regression against %s" % args.baseline)
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
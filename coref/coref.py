@@ -5,6 +5,12 @@ Find coreference chains found in a video description that are longer than a cert
 import coreferee
 import spacy
 
+from engine.token_table import TokenTable
+
+# Stanza annotations needed to align the coreference chains found by spacy on the lines of the VD
+# (the chains themselves are found by spacy + coreferee)
+REQUIRED_PROCESSORS = {"tokenize", "mwt"}
+
 
 def split_chains(doc: spacy.tokens.doc.Doc, coref_chains: dict) -> dict:
     """
@@ -104,34 +110,69 @@ def add_global_offset(doc: spacy.tokens.doc.Doc, coref_chains: coreferee.data_mo
     return output_chain
 
 
-def flag_coref_chains(text: str, docs, lang: str, max_length: int):
+def _sentence_tokens(docs) -> list:
     """
-    Flag all elements in coreference chains that go over a certain threshold
-    :param text: Text of the videodescription
-    :param lang: Language
-    :param max_length: Threshold
-    :return: JSON document
+    Tokens of each sentence of each line of the VD
+    :param docs: Stanza documents of the lines or their TokenTable
+    :return: (start, end, text) of the tokens, by sentence, by line
     """
+    if isinstance(docs, TokenTable):
+        starts, ends = docs.token_start.tolist(), docs.token_end.tolist()
+        texts = [docs.strings[text] for text in docs.token_text.tolist()]
+        return [[[(starts[k], ends[k], texts[k]) for k in docs.sentence_token_range(sentence)]
+                 for sentence in docs.line_sentence_range(line)] for line in range(len(docs))]
+
+    return [[[(token.start_char, token.end_char, token.text) for token in sentence.tokens]
+             for sentence in doc.sentences] for doc in docs]
+
 
-    # Setup coreferee + spacy
+def load_coref_model(lang: str) -> spacy.language.Language:
+    """
+    Load the spacy model of a language and add coreferee to its pipeline
+    :param lang: Language (EN or FR)
+    :return: spacy pipeline with coreferee
+    """
     if lang == "EN":
         coref_model = spacy.load('en_core_web_trf')
     else:
         coref_model = spacy.load('fr_core_news_lg')
     coref_model.add_pipe('coreferee')
 
+    return coref_model
 
 
+def flag_coref_chains(text: str, docs, lang: str, max_length: int, coref_model: spacy.language.Language = None,
+                      spacy_doc: spacy.tokens.doc.Doc = None, split: bool = True):
+    """
+    Flag all elements in coreference chains that go over a certain threshold
+    :param text: Text of the videodescription
+    :param docs: Stanza documents of the lines of the VD or their TokenTable
+    :param lang: Language
+    :param max_length: Threshold
+    :param coref_model: spacy + coreferee pipeline already loaded, loaded here if not given
+    :param spacy_doc: text already processed by spacy + coreferee (ex: with coref_model.pipe), processed here if None
+    :param split: split the chains (see split_chains), if False the chains are those of coreferee and each token
+    gives the index of its mention in its chain (ex: to split the chains of a VD analyzed by parts, see engine.stream)
+    :return: JSON document
+    """
+
+    if spacy_doc is None:
+        # Setup coreferee + spacy
+        if coref_model is None:
+            coref_model = load_coref_model(lang)
+        spacy_doc = coref_model(text)
+
     # Retrieve coreference chains
-    doc = coref_model(text)
+    doc = spacy_doc
     coref_chains_token_indices = doc._.coref_chains
     coref_chains_global_offset = add_global_offset(doc, coref_chains_token_indices)
 
     # Split coreference chains if needed
-    split_coref_chains = split_chains(doc, coref_chains_global_offset)
+    split_coref_chains = split_chains(doc, coref_chains_global_offset) if split else coref_chains_global_offset
 
     # List of chain elements
-    # Each element will be stored as a list of: id_chain, text, begin offset, end offset, warning code
+    # Each element will be stored as a list of: id_chain, text, begin offset, end offset, warning code,
+    # index of the mention in the chain
     # this is the offset for the whole VD
     flagged_coref_elems = []
     for key, chain in split_coref_chains.items():
@@ -140,14 +181,14 @@ def flag_coref_chains(text: str, docs, lang: str, max_length: int):
             # Example: ('Peter', 9, 41, 46)            
             if isinstance(elem, tuple):
                 flagged_coref_elems.append(
-                    [key, elem[0], elem[1], elem[2], 1 if idx + 1 > max_length else 0]
+                    [key, elem[0], elem[1], elem[2], 1 if idx + 1 > max_length else 0, idx]
                 )
             # Compound elements
             # Example: [('she', 69, 71), ('husband', 80, 84)] 
             else:
                 for sub_elem in elem:
                     flagged_coref_elems.append(
-                        [key, sub_elem[0], sub_elem[1], sub_elem[2], 1 if idx + 1 > max_length else 0]
+                        [key, sub_elem[0], sub_elem[1], sub_elem[2], 1 if idx + 1 > max_length else 0, idx]
                     )
 
     # Sort chain elems by begin offset
@@ -157,13 +198,16 @@ def flag_coref_chains(text: str, docs, lang: str, max_length: int):
     last_offset_sentence = 0
     dict_sent_offset = {}
 
+    # tokens (start, end, text) of each sentence of each line
+    sentence_tokens = _sentence_tokens(docs)
+
     # find the offset of sentences
-    for j, doc in enumerate(docs):
+    for j, doc in enumerate(sentence_tokens):
         dict_sent_offset[j] = []
 
-        for i, sent in enumerate(doc.sentences):
-            sent_beg_idx = sent.tokens[0].start_char
-            sent_end_idx = sent.tokens[-1].end_char
+        for i, sent in enumerate(doc):
+            sent_beg_idx = sent[0][0]
+            sent_end_idx = sent[-1][1]
 
             if j == 0:
                 # Each doc begin with 0 so for the first doc the offset are already correct
@@ -186,16 +230,16 @@ def flag_coref_chains(text: str, docs, lang: str, max_length: int):
     dic_offset = dict()
     last_offset = 0
     last_char_rel = 0
-    for j, one_doc in enumerate(docs):
+    for j, one_doc in enumerate(sentence_tokens):
         dic_offset[j] = dict()
-        for i, sent in enumerate(one_doc.sentences):
+        for i, sent in enumerate(one_doc):
             dic_offset[j][i] = []
-            for k, token in enumerate(sent.tokens):
+            for k, (token_start, token_end, token_text) in enumerate(sent):
 
                 # on va inscrire l'offset absolu dans le dictionnaire'
                 if j == 0:  # first doc
-                    begin = token.start_char
-                    end = token.end_char
+                    begin = token_start
+                    end = token_end
                 else:
                     if i == 0:
 
@@ -203,33 +247,33 @@ def flag_coref_chains(text: str, docs, lang: str, max_length: int):
                             # suite de combien on saute de token
                             saut = 1
 
-                            begin = last_offset + saut + token.start_char
-                            end = begin + (token.end_char - token.start_char)
+                            begin = last_offset + saut + token_start
+                            end = begin + (token_end - token_start)
                             # last_offset = end + 1
                         else:
                             # on saute de combien de token
-                            saut = token.start_char - last_char_rel
+                            saut = token_start - last_char_rel
 
                             # begin = last_offset
-                            # end = token.end_char + last_offset
+                            # end = token_end + last_offset
                             begin = last_offset + saut
-                            end = begin + (token.end_char - token.start_char)
+                            end = begin + (token_end - token_start)
 
                     else:
                         if k == 0:
                             # suite de combien on saute de token
                             saut = 1
                         else:
-                            saut = token.start_char - last_char_rel
+                            saut = token_start - last_char_rel
 
                         begin = last_offset + saut
-                        # end = token.end_char + last_offset
-                        end = begin + (token.end_char - token.start_char)
+                        # end = token_end + last_offset
+                        end = begin + (token_end - token_start)
                 # pour savoir de combien on saute
-                last_char_rel = token.end_char
+                last_char_rel = token_end
                 last_offset = end
                 dic_offset[j][i].append(
-                    {"relative": (token.start_char, token.end_char), "absolute": (begin, end), "text": token.text})
+                    {"relative": (token_start, token_end), "absolute": (begin, end), "text": token_text})
 
     # creation d'un dic pour chaque id
     main_output = dict()
@@ -250,5 +294,7 @@ def flag_coref_chains(text: str, docs, lang: str, max_length: int):
                                 "warning": elem[4]
                             }
                         })
+                        if not split:
+                            main_output[j][-1]["token"]["mention"] = elem[5]
 
     return main_output
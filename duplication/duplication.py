@@ -7,14 +7,23 @@ for a liste of specific pos-tag like ADJ, ADV, VERB
 
 from collections import Counter
 
-def build_dic_lemme(docs:list) -> dict:
+import numpy as np
+
+from engine.token_table import TokenTable, upos_codes
+
+# Stanza annotations needed by the detection (lemmas and pos-tags of the words)
+REQUIRED_PROCESSORS = {"tokenize", "mwt", "pos", "lemma"}
+
+def build_dic_lemme(docs:list, dic_lemme: dict = None) -> dict:
     """
     Build a dictionary with key (id_count) and value (lemma)
     :param docs: list of VD
+    :param dic_lemme: dictionary to complete with the new lemmas (ex: ids kept between analyses), new one if None
     :return: dictionary with key (id_count) and value (lemma)
     """
-    dic_lemme = {}
-    compteur = 0
+    if dic_lemme is None:
+        dic_lemme = {}
+    compteur = len(dic_lemme)
 
     for doc in docs:
         for sentence in doc.sentences:
@@ -26,7 +35,8 @@ def build_dic_lemme(docs:list) -> dict:
     return dic_lemme
 
 
-def check_duplication(docs: list, seuil_duplication: int, repetition_span: int, postag: list) -> dict:
+def check_duplication(docs: list, seuil_duplication: int, repetition_span: int, postag: list,
+                      dic_lemme: dict = None) -> dict:
     """
     Find all the repetitions in a VDS by searching in a window of lines
     and return the result for one line of VD
@@ -34,6 +44,7 @@ def check_duplication(docs: list, seuil_duplication: int, repetition_span: int,
     :param seuil_duplication: minimum threshold of repetition
     :param repetition_span: number of lines to look before and after the line
     :param postag : list of postag to look for
+    :param dic_lemme: ids of the lemmas to use and complete, ids given in order of appearance if None
     :return: dictionary with key (index of vd) and value (list of repetitions)
     """
 
@@ -82,7 +93,7 @@ def check_duplication(docs: list, seuil_duplication: int, repetition_span: int,
 
 
     # Build the output by line of VD
-    output_repetition = build_output_repetition(dic_repetitions, docs)
+    output_repetition = build_output_repetition(dic_repetitions, docs, dic_lemme)
 
     return output_repetition
 
@@ -148,17 +159,18 @@ def find_repetitions_in_window(repetitions_windows: dict, seuil_duplication: int
     return dict_repetitions_window
 
 
-def build_output_repetition(repetitions: dict, docs: list) -> dict:
+def build_output_repetition(repetitions: dict, docs: list, dic_lemme: dict = None) -> dict:
     """
     Build the output by line of VD
     :param repetitions: list of repetitions in the line of vd (object "word" of stanza)
     :param docs: list of VDs (stanza)
+    :param dic_lemme: ids of the lemmas to use and complete, ids given in order of appearance if None
     :return: output : list of repetitions in the line of vd with specific info by token
     """
     results = {}
 
     # récupération d'un id par lemme
-    dic_lemme = build_dic_lemme(docs)
+    dic_lemme = build_dic_lemme(docs, dic_lemme)
 
 
     if repetitions != {}:
@@ -177,7 +189,8 @@ def build_output_repetition(repetitions: dict, docs: list) -> dict:
                                 "id_lemma": dic_lemme[word.lemma],
                             }
                         }
-                        for word in repetitions[i]
+                        # the repetitions are in a set, they are given in the order of the line
+                        for word in sorted(repetitions[i], key=lambda word: (word.parent.start_char, word.id))
                     ]
                 )
                 # cas où il y a une répétition dans la ligne et pas une liste vide à l'intérieur
@@ -187,3 +200,75 @@ def build_output_repetition(repetitions: dict, docs: list) -> dict:
         results = {}
 
     return results
+
+
+def check_duplication_table(table: TokenTable, seuil_duplication: int, repetition_span: int, postag: list,
+                            dic_lemme: dict = None) -> dict:
+    """
+    check_duplication over the token table of the VD (see engine.token_table)
+    The windows of lines are the same, the lemmas of each line are counted once
+    and the counts of a window are the sum of those of its lines
+    :param table: token table of the lines of the VD
+    :return: dictionary with key (index of vd) and value (list of repetitions)
+    """
+    selected = np.isin(table.upos, upos_codes(postag))
+    lemmas = table.lemma.tolist()
+    # words with one of the pos-tags and their lemmas, by line
+    line_words = []
+    line_counters = []
+    for i in range(len(table)):
+        rows = table.line_word_range(i)
+        words = [row for row in rows if selected[row]]
+        line_words.append(words)
+        line_counters.append(Counter(lemmas[row] for row in words))
+
+    # same windows as check_duplication (slices of the lines, the first ones can be empty or wrap around)
+    lines = list(range(len(table)))
+    if (2 * repetition_span + 1) >= len(lines):
+        start, end, all_lines = 0, len(lines), True
+    else:
+        start, end, all_lines = repetition_span, len(lines) - repetition_span, False
+
+    dic_repetitions = {}
+    for i in range(start, end):
+        windows = lines[i - repetition_span:i + repetition_span + 1]
+        repetitions_window = Counter()
+        for line in windows:
+            repetitions_window.update(line_counters[line])
+        if not repetitions_window:
+            continue
+
+        for k, line in enumerate(windows):
+            true_index = i + k if all_lines else k + i - repetition_span
+            repetitions = dic_repetitions.setdefault(true_index, set())
+            repetitions.update(row for row in line_words[line] if repetitions_window[lemmas[row]] >= seuil_duplication)
+
+    # ids of the lemmas in order of appearance
+    if dic_lemme is None:
+        dic_lemme = {}
+    for lemma in dict.fromkeys(lemmas):
+        if table.string(lemma) not in dic_lemme:
+            dic_lemme[table.string(lemma)] = len(dic_lemme)
+
+    results = {}
+    tokens = table.token.tolist()
+    token_starts = table.token_start.tolist()
+    indices = table.index.tolist()
+    for i in range(len(table)):
+        if dic_repetitions.get(i):
+            results[i] = [
+                [
+                    {
+                        "token": {
+                            "text": table.strings[table.token_text[tokens[row]]],
+                            "offset_start": table.offset(table.token_start, tokens[row]),
+                            "offset_end": table.offset(table.token_end, tokens[row]),
+                            "id_lemma": dic_lemme[table.string(lemmas[row])],
+                        }
+                    }
+                    # the repetitions are in a set, they are given in the order of the line
+                    for row in sorted(dic_repetitions[i], key=lambda row: (token_starts[tokens[row]], indices[row]))
+                ]
+            ]
+
+    return results
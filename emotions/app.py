@@ -2,8 +2,24 @@ from wrapper import SpanModel
 from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from configparser import ConfigParser
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
 import os
 import argparse
+import gzip
+import json
+import random
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 CORS(app)
@@ -11,24 +27,122 @@ CORS(app)
 config = ConfigParser()
 config.read(os.getenv('EMOTION_CONFIG'))
 
+# Sampling of the request logs
+LOG_SAMPLE_RATE = config.getfloat("log", "sample_rate", fallback=0.1)
+
+STAGE_DURATION = Histogram("vdqual_emotions_stage_duration_seconds", "Duration of the stages of the requests",
+                           ["stage"], buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+LINES = Counter("vdqual_emotions_lines", "Lines of VD processed")
+ERRORS = Counter("vdqual_emotions_errors", "Errors by kind", ["kind"])
+IN_PROGRESS = Gauge("vdqual_emotions_requests_in_progress", "Requests being processed")
+LOADED_MODELS = Gauge("vdqual_emotions_loaded_models", "Span-ASTE models loaded", ["lang"])
+RESPONSE_BYTES = Histogram("vdqual_emotions_response_bytes", "Size of the responses sent, by encoding", ["encoding"],
+                           buckets=(1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8))
+SERIALIZED_BYTES = Counter("vdqual_emotions_serialized_bytes", "Size of the responses before compression")
+
+# Span-ASTE models by language with their predictor (the weights loaded at the first request of the language)
+# and a lock, a predictor runs one prediction at a time
+models = {}
+models_lock = threading.Lock()
+
+# Encodings of the responses by order of preference, the responses smaller than MIN_COMPRESSED_SIZE bytes
+# are not compressed
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+MIN_COMPRESSED_SIZE = 1024
+
+
+def serialize(output):
+    """
+    JSON response of an output (orjson if installed), compressed with the best encoding accepted by the client
+    """
+    stage_time = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(output, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(output, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    STAGE_DURATION.labels("serialization").observe(time.perf_counter() - stage_time)
+    SERIALIZED_BYTES.inc(len(body))
+
+    encoding = request.accept_encodings.best_match(ENCODINGS) if len(body) >= MIN_COMPRESSED_SIZE else None
+    if encoding is not None:
+        stage_time = time.perf_counter()
+        body = gzip.compress(body, compresslevel=5) if encoding == "gzip" \
+            else zstandard.ZstdCompressor(level=3).compress(body)
+        STAGE_DURATION.labels("compression").observe(time.perf_counter() - stage_time)
+    RESPONSE_BYTES.labels(encoding if encoding else "identity").observe(len(body))
+
+    response = Response(body, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.content_encoding = encoding
+    return response
+
+
+def get_model(lang, model_path):
+    """
+    Span-ASTE model of a language, its weights are loaded once and kept for the next requests
+    :return: the model, its predictor and the lock of its predictions
+    """
+    with models_lock:
+        if lang not in models:
+            stage_time = time.perf_counter()
+            model = SpanModel(save_dir=model_path, random_seed=0)
+            models[lang] = (model, model.load_predictor(), threading.Lock())
+            STAGE_DURATION.labels("model_loading").observe(time.perf_counter() - stage_time)
+            LOADED_MODELS.labels(lang).set(1)
+        return models[lang]
+
+
+def log_request(error=False, **fields):
+    """
+    Log a request as one JSON line, only a sample of the requests is logged (always the errors)
+    """
+    if error or random.random() < LOG_SAMPLE_RATE:
+        print(json.dumps(dict({"time": round(time.time(), 3), "endpoint": "predict", "error": error}, **fields)))
+
 
 @app.route('/predict', methods = ['POST'])
+@IN_PROGRESS.track_inprogress()
 def predict():
-    print(request.json)
+    start_time = time.perf_counter()
 
-    data = request.json
-    lines = data['lines']
-    lang = str(data['lang']).upper()
-    model_path = config['model'][lang]
-    model = SpanModel(save_dir=model_path, random_seed=0)
-    output_emotion = model.predict(lines)
+    try :
+        data = request.json
+        lines = data['lines']
+        lang = str(data['lang']).upper()
+        model_path = config['model'][lang]
+    except (KeyError, TypeError) as error:
+        ERRORS.labels("invalid_parameters").inc()
+        log_request(error=True, message=str(error))
+        return jsonify({"error": "Invalid parameters: %s" % error}), 400
 
-    print(output_emotion)
-    response = jsonify(output_emotion)
+    try :
+        model, predictor, prediction_lock = get_model(lang, model_path)
+        with prediction_lock:
+            stage_time = time.perf_counter()
+            output_emotion = model.predict(lines, predictor)
+            STAGE_DURATION.labels("prediction").observe(time.perf_counter() - stage_time)
+    except Exception as error:
+        ERRORS.labels(type(error).__name__).inc()
+        log_request(error=True, lang=lang, num_lines=len(lines), message=str(error))
+        raise
+    LINES.inc(len(lines))
+
+    response = serialize(output_emotion)
+    log_request(lang=lang, num_lines=len(lines), duration=round(time.perf_counter() - start_time, 4),
+                response_bytes=response.content_length)
 
     return response
 
 
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    """
+    Metrics in the text format of Prometheus
+    """
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
 @app.route('/status', methods = ['GET', 'POST'])
 def status():
     status_check = jsonify({
@@ -40,6 +154,3 @@ def status():
 
 if __name__ == "__main__":
     app.run(debug=False, host='0.0.0.0', port=5007)
-    
-
-    
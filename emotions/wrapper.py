@@ -1,12 +1,13 @@
 import json
 import sys
-import os
 import ast
-import torch
+import tempfile
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from allennlp.commands.train import train_model
 from allennlp.common import Params
+from allennlp.common.util import import_module_and_submodules
+from allennlp.predictors import Predictor
 from pydantic import BaseModel
 
 # Make sure the path to the emotions folder is in the sys path
@@ -14,14 +15,13 @@ sys.path.append(str(Path(__file__).parent))
 
 from data_utils import Data, Sentence, SplitEnum, SentimentTriple
 from main import SpanModelData, SpanModelPrediction
-from utils import Shell
 
 class SpanModel(BaseModel):
     save_dir: str
     random_seed: int
 
-    def save_temp_data(self, sentences: List[str], name: str) -> Path:
-        path_temp = Path(self.save_dir) / "temp_data" / f"{name}.json"
+    def save_temp_data(self, sentences: List[str], name: str, directory: Optional[str] = None) -> Path:
+        path_temp = Path(directory if directory else Path(self.save_dir) / "temp_data") / f"{name}.json"
         path_temp = path_temp.resolve()
         path_temp.parent.mkdir(exist_ok=True, parents=True)
 
@@ -94,33 +94,34 @@ class SpanModel(BaseModel):
                     )
         return line_output
 
-    def predict(self, sentences:List[str]):             
-        work_dir = str(Path(__file__).parent)
+    def load_predictor(self) -> Predictor:
+        """
+        Predictor of the model with its weights loaded in the process, to keep between the predictions
+        """
+        # the model, the dataset reader and the predictor of Span-ASTE are registered by the package span_model
+        import_module_and_submodules("span_model")
         path_model = Path(self.save_dir) / "weights" / "model.tar.gz"
-        path_temp_in = self.save_temp_data(sentences, "pred_in")
-        path_temp_out = Path(self.save_dir) / "temp_data" / "pred_out.json"
-        if path_temp_out.exists():
-            os.remove(path_temp_out)
-
-        shell = Shell()
-        shell.run(
-            f"cd {work_dir} && allennlp predict {path_model}",
-            str(path_temp_in),
-            predictor="span_model",
-            include_package="span_model",
-            use_dataset_reader="",
-            output_file=str(path_temp_out),
-            # force disabled CUDA (even if available)
-            cuda_device="-1" if torch.cuda.is_available() else "-1",
-            silent="",
-        )
+        # force disabled CUDA (even if available)
+        return Predictor.from_path(str(path_model), predictor_name="span_model", cuda_device=-1)
+
+    def predict(self, sentences: List[str], predictor: Optional[Predictor] = None):
+        """
+        Emotions of the sentences, the predictor is loaded for this call only if it is not given
+        (a predictor runs one prediction at a time)
+        """
+        if predictor is None:
+            predictor = self.load_predictor()
+
+        # The input of each call has its own file, the dataset reader of the model reads it
+        with tempfile.TemporaryDirectory() as directory:
+            path_temp_in = self.save_temp_data(sentences, "pred_in", directory)
+            line_preds = [SpanModelPrediction(**json.loads(predictor.dump_line(predictor.predict_instance(instance))))
+                          for instance in predictor._dataset_reader.read(str(path_temp_in))]
 
         # Transform predictions into JSON document
         main_output = {}
-        with open(path_temp_out) as f:
-            line_preds = [SpanModelPrediction(**json.loads(line.strip())) for line in f]
-            for i, line_pred in enumerate(line_preds):                
-                line_output = self.get_line_output(line_pred)
-                main_output[i] = line_output
-                        
+        for i, line_pred in enumerate(line_preds):
+            line_output = self.get_line_output(line_pred)
+            main_output[i] = line_output
+
         return main_output
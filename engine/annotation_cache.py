@@ -0,0 +1,160 @@
+"""
+Cache of the Stanza annotations of the lines of the VDs.
+The annotations of a line are identified by a hash of the language, the Stanza processors,
+the version of the models and the text of the line. They are kept in memory (LRU)
+and optionally on disk, so that a line already seen is never annotated again by the neural models
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from stanza import Document
+
+
+def annotation_key(lang: str, processors: str, model_version: str, text: str) -> str:
+    """
+    Content address of the annotations of a line
+    :param lang: EN or FR
+    :param processors: Stanza processors (ex: "tokenize,mwt")
+    :param model_version: version of the Stanza models
+    :param text: text of the line
+    :return: hexadecimal sha256 hash
+    """
+    return hashlib.sha256("\x1f".join((lang, processors, model_version, text)).encode("utf-8")).hexdigest()
+
+
+def _restore_ids(sentences: list) -> list:
+    """
+    JSON turns the ids of the multi-word tokens (ex: (1, 2)) into lists, Stanza expects tuples
+    :param sentences: annotations read from the disk
+    :return: annotations with the ids as tuples
+    """
+    for sentence in sentences:
+        for word in sentence:
+            if isinstance(word.get("id"), list):
+                word["id"] = tuple(word["id"])
+    return sentences
+
+
+class AnnotationCache:
+    """
+    Two-tier cache of line annotations: a LRU dictionary in memory and an optional directory on disk
+    The annotations are stored as the dictionaries of Stanza (Document.to_dict)
+    """
+
+    def __init__(self, max_size: int = 10000, directory: str = None):
+        """
+        :param max_size: max number of lines kept in memory (0 disables the cache in memory)
+        :param directory: directory of the cache on disk, no cache on disk if None
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[list]:
+        """
+        Annotations of a line
+        :param key: content address of the line (see annotation_key)
+        :return: Stanza dictionaries of the sentences of the line, None if the line is not in the cache
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._entries[key]
+
+        if self.directory and os.path.isfile(self._path(key)):
+            with open(self._path(key), encoding="utf-8") as cache_file:
+                sentences = _restore_ids(json.load(cache_file))
+            self._put_in_memory(key, sentences)
+            with self._lock:
+                self.counters["disk_hits"] += 1
+            return sentences
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, sentences: list) -> None:
+        """
+        Record the annotations of a line
+        :param key: content address of the line (see annotation_key)
+        :param sentences: Stanza dictionaries of the sentences of the line
+        """
+        self._put_in_memory(key, sentences)
+
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so that a file of the cache is never read half written
+            file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as cache_file:
+                json.dump(sentences, cache_file, ensure_ascii=False)
+            os.replace(temp_path, path)
+
+    def _put_in_memory(self, key: str, sentences: list) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = sentences
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Counters of the cache
+        :return: hits in memory and on disk, misses, number of lines in memory and hit rate
+        """
+        with self._lock:
+            stats = dict(self.counters, size=len(self._entries))
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.
+
+        return stats
+
+
+def annotate_with_cache(cache: AnnotationCache, processor, docs: List[Document], lang: str,
+                        processors: str, model_version: str) -> List[Document]:
+    """
+    Annotate documents, only the lines never seen before go through the Stanza pipeline
+    and the lines repeated in the documents are annotated once
+    :param cache: cache of the annotations
+    :param processor: Stanza pipeline (or any callable annotating a list of documents)
+    :param docs: Stanza documents to annotate, one by line
+    :param lang: EN or FR
+    :param processors: Stanza processors of the pipeline
+    :param model_version: version of the Stanza models
+    :return: annotated Stanza documents
+    """
+    keys = [annotation_key(lang, processors, model_version, doc.text) for doc in docs]
+
+    annotations = {}
+    to_annotate = {}
+    for key, doc in zip(keys, docs):
+        if key in annotations or key in to_annotate:
+            continue
+        sentences = cache.get(key)
+        if sentences is None:
+            to_annotate[key] = doc
+        else:
+            annotations[key] = sentences
+
+    if to_annotate:
+        for key, annotated_doc in zip(to_annotate, processor(list(to_annotate.values()))):
+            annotations[key] = annotated_doc.to_dict()
+            cache.put(key, annotations[key])
+
+    return [Document(annotations[key], text=doc.text) for key, doc in zip(keys, docs)]
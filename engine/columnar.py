@@ -0,0 +1,263 @@
+"""
+Compact columnar format of the outputs.
+In the output of an analysis (see modules.record_outputs) each line holds the list of the results of each feature,
+with the keys repeated for each token. In the columnar format, each feature is a table of parallel arrays,
+one row by result: line_id, start, end, text, ref (chain of the coreference, lemma of the duplication,
+verbal expression of the tense), warning, type (emotions), distance (approximate matching of the lexicons)...
+The format is lossless, to_records gives back the output of the analysis.
+It is available as JSON (to_columnar / to_records) and as Arrow IPC (to_arrow / from_arrow, pyarrow needed):
+a single table holding the rows of all the features (feature column) and the lines (feature "document")
+"""
+import io
+import json
+from typing import Any, Dict, Iterable, List
+
+COLUMNAR_FORMAT = "columnar"
+
+# Media types of the columnar output (Accept header of the requests)
+COLUMNAR_MIMETYPE = "application/vnd.vdqual.columnar+json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# Columns of each feature: the keys of the results mapped to their column ("offset.start": key start of
+# the dictionary offset), the results of the features in TOKEN_FEATURES are in a "token" dictionary,
+# those of the features in GROUPED_FEATURES are in lists of results (column group: index of the list in the line)
+FEATURE_COLUMNS = {
+    "length": {"id": "sentence", "offset.start": "start", "offset.end": "end", "num_words": "num_words",
+               "warning": "warning"},
+    "duplication": {"text": "text", "offset_start": "start", "offset_end": "end", "id_lemma": "ref"},
+    "cinema": {"text": "text", "offset_start": "start", "offset_end": "end"},
+    "offensive": {"text": "text", "offset_start": "start", "offset_end": "end"},
+    "tense_notpresent": {"text": "text", "offset_start": "start", "offset_end": "end",
+                         "ref_token.0": "sentence", "ref_token.1": "ref"},
+    "person": {"text": "text", "offset_start": "start", "offset_end": "end"},
+    "coref": {"text": "text", "offset_start": "start", "offset_end": "end", "ref_id_chain": "ref",
+              "warning": "warning"},
+    "emotions": {"text": "text", "offset_start": "start", "offset_end": "end", "type": "type", "warning": "warning"},
+}
+# Columns of the keys given only by some results (distance of the approximate matching of the lexicons, see
+# find_voc.fuzzy): the column is in the table of a feature when a result has the key, None for the other results
+OPTIONAL_COLUMNS = {"cinema": {"distance": "distance"}, "offensive": {"distance": "distance"}}
+TOKEN_FEATURES = {"duplication", "cinema", "offensive", "tense_notpresent", "person", "coref", "emotions"}
+GROUPED_FEATURES = {"duplication"}
+# the other features are personal lexicons (see Engine.lexicon_sources), their results are those of cinema
+LEXICON_FEATURE = "cinema"
+
+# Columns of the Arrow table, with their type
+ARROW_COLUMNS = (("feature", "string"), ("line_id", "int32"), ("group", "int32"), ("sentence", "int32"),
+                 ("start", "int32"), ("end", "int32"), ("text", "string"), ("ref", "int32"), ("warning", "int8"),
+                 ("type", "string"), ("num_words", "int32"), ("distance", "int32"))
+
+# Feature of the rows of the lines in the Arrow table (their text and line_id)
+DOCUMENT_ROW = "document"
+
+
+def _kind(feature: str) -> str:
+    # feature whose columns are those of a feature, the personal lexicons are like cinema
+    return feature if feature in FEATURE_COLUMNS else LEXICON_FEATURE
+
+
+def _columns(feature: str, optional: bool = False) -> List[str]:
+    # columns of the table of a feature, with its optional columns
+    columns = ["line_id"] + (["group"] if feature in GROUPED_FEATURES else []) \
+        + list(FEATURE_COLUMNS[_kind(feature)].values())
+    return columns + (list(OPTIONAL_COLUMNS.get(_kind(feature), {}).values()) if optional else [])
+
+
+def _ordered(features: Iterable[str]) -> List[str]:
+    # features in the order of the outputs of the analyses, the personal lexicons after those of the config
+    features = list(dict.fromkeys(features))
+    order = list(FEATURE_COLUMNS)
+    position = order.index("offensive") + 1
+    order[position:position] = [feature for feature in features if feature not in FEATURE_COLUMNS]
+    return [feature for feature in order if feature in features]
+
+
+def _without_empty_optional(feature: str, table: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+    # the optional columns of a table are removed when no result has them
+    optional = set(OPTIONAL_COLUMNS.get(_kind(feature), {}).values())
+    return {column: values for column, values in table.items()
+            if column not in optional or any(value is not None for value in values)}
+
+
+def _flatten(feature: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    # values of a result by column
+    feature = _kind(feature)
+    values = result["token"] if feature in TOKEN_FEATURES else result
+    optional = OPTIONAL_COLUMNS.get(feature, {})
+    if len(values) != len({path.split(".")[0] for path in FEATURE_COLUMNS[feature]} | (set(values) & set(optional))):
+        raise ValueError("Unexpected result of %s: %s" % (feature, result))
+    row = {column: values.get(key) for key, column in optional.items()}
+    for path, column in FEATURE_COLUMNS[feature].items():
+        value = values
+        for key in path.split("."):
+            value = value[int(key)] if isinstance(value, (list, tuple)) else value[key]
+        row[column] = value
+    return row
+
+
+def _unflatten(feature: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    # result of a feature from its values by column
+    feature = _kind(feature)
+    values = {}
+    for path, column in FEATURE_COLUMNS[feature].items():
+        keys = path.split(".")
+        if len(keys) == 1:
+            values[keys[0]] = row[column]
+        elif keys[1].isdigit():
+            values.setdefault(keys[0], []).append(row[column])
+        else:
+            values.setdefault(keys[0], {})[keys[1]] = row[column]
+    for key, column in OPTIONAL_COLUMNS.get(feature, {}).items():
+        if row.get(column) is not None:
+            values[key] = row[column]
+    return {"token": values} if feature in TOKEN_FEATURES else values
+
+
+def to_columnar(output: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Columnar format of the output of an analysis
+    :param output: output of an analysis (documents and optional other keys, ex: timings)
+    :return: documents (id and text arrays), features (a table of parallel arrays by feature, the features
+        computed for no line are absent), missing (lines without a feature computed for other lines)
+        and the other keys of the output
+    """
+    columnar = {key: value for key, value in output.items() if key != "documents"}
+    documents = output["documents"]
+    columnar["format"] = COLUMNAR_FORMAT
+    columnar["documents"] = {"id": [document["id"] for document in documents],
+                             "text": [document["text"] for document in documents]}
+
+    features = {}
+    missing = {}
+    for feature in _ordered(feature for document in documents for feature in document["features"]):
+        columns = _columns(feature, optional=True)
+        table = {column: [] for column in columns}
+        for document in documents:
+            if feature not in document["features"]:
+                missing.setdefault(feature, []).append(document["id"])
+                continue
+            results = document["features"][feature]
+            groups = enumerate(results) if feature in GROUPED_FEATURES else [(None, results)]
+            for group, group_results in groups:
+                for result in group_results:
+                    row = _flatten(feature, result)
+                    row["line_id"] = document["id"]
+                    row["group"] = group
+                    for column in columns:
+                        table[column].append(row[column])
+        features[feature] = _without_empty_optional(feature, table)
+
+    columnar["features"] = features
+    columnar["missing"] = missing
+    return columnar
+
+
+def to_records(columnar: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Output of an analysis from its columnar format (see to_columnar)
+    """
+    if columnar.get("format") != COLUMNAR_FORMAT:
+        raise ValueError("Not a columnar output")
+
+    output = {key: value for key, value in columnar.items()
+              if key not in ("format", "documents", "features", "missing")}
+    lines = {}
+    for line_id, text in zip(columnar["documents"]["id"], columnar["documents"]["text"]):
+        lines[line_id] = {"id": line_id, "text": text, "features": {}}
+
+    for feature, table in columnar["features"].items():
+        missing = set(columnar["missing"].get(feature, []))
+        for line_id, line in lines.items():
+            if line_id not in missing:
+                line["features"][feature] = []
+        for i in range(len(table["line_id"])):
+            row = {column: values[i] for column, values in table.items()}
+            results = lines[row["line_id"]]["features"][feature]
+            if feature in GROUPED_FEATURES:
+                while len(results) <= row["group"]:
+                    results.append([])
+                results = results[row["group"]]
+            results.append(_unflatten(feature, row))
+
+    # the features are in the order of the output of the analyses
+    for line in lines.values():
+        line["features"] = {feature: line["features"][feature] for feature in _ordered(line["features"])}
+    output["documents"] = list(lines.values())
+    return output
+
+
+def check_arrow() -> None:
+    """
+    :raise ImportError: if pyarrow is not installed (the Arrow format is not available)
+    """
+    _pyarrow()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError("The Arrow output needs the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+def to_arrow(output: Dict[str, Any]) -> bytes:
+    """
+    Arrow IPC stream of the output of an analysis: a table with the rows of all the features
+    (see ARROW_COLUMNS) and the rows of the lines (feature "document": line_id and text).
+    The other keys of the output and the missing lines are in the metadata of the schema (JSON in "vdqual")
+    """
+    pyarrow = _pyarrow()
+    columnar = to_columnar(output)
+
+    columns = {name: [] for name, _ in ARROW_COLUMNS}
+
+    def add_rows(feature: str, table: Dict[str, List[Any]]) -> None:
+        num_rows = len(table["line_id"])
+        for name, _ in ARROW_COLUMNS:
+            columns[name].extend([feature] * num_rows if name == "feature" else table.get(name, [None] * num_rows))
+
+    add_rows(DOCUMENT_ROW, {"line_id": columnar["documents"]["id"], "text": columnar["documents"]["text"]})
+    for feature, table in columnar["features"].items():
+        add_rows(feature, table)
+
+    metadata = {key: value for key, value in columnar.items() if key not in ("documents", "features")}
+    # the features without results are not in the rows
+    metadata["features"] = list(columnar["features"])
+    schema = pyarrow.schema([(name, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if name == "feature"
+                              else getattr(pyarrow, column_type)()) for name, column_type in ARROW_COLUMNS],
+                            metadata={"vdqual": json.dumps(metadata, ensure_ascii=False)})
+    arrays = [pyarrow.array(columns[name], pyarrow.string()).dictionary_encode() if name == "feature"
+              else pyarrow.array(columns[name], schema.field(name).type) for name, _ in ARROW_COLUMNS]
+    table = pyarrow.Table.from_arrays(arrays, schema=schema)
+
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def from_arrow(data: bytes) -> Dict[str, Any]:
+    """
+    Output of an analysis from its Arrow IPC stream (see to_arrow)
+    """
+    pyarrow = _pyarrow()
+    table = pyarrow.ipc.open_stream(data).read_all()
+    columnar = json.loads(table.schema.metadata[b"vdqual"])
+    rows = table.to_pydict()
+
+    columnar["documents"] = {"id": [], "text": []}
+    features: Dict[str, Dict[str, List[Any]]] = {}
+    for feature in columnar["features"]:
+        features[feature] = {column: [] for column in _columns(feature, optional=True)}
+    for i, feature in enumerate(rows["feature"]):
+        if feature == DOCUMENT_ROW:
+            columnar["documents"]["id"].append(rows["line_id"][i])
+            columnar["documents"]["text"].append(rows["text"][i])
+            continue
+        for column, values in features[feature].items():
+            values.append(rows[column][i])
+
+    columnar["features"] = {feature: _without_empty_optional(feature, table) for feature, table in features.items()}
+    return to_records(columnar)
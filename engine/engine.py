@@ -0,0 +1,958 @@
+"""
+Long-lived analysis engine.
+The engine owns the NLP resources needed by the quality checks (fastText language detection,
+Stanza pipelines and spacy + coreferee pipelines by language) so that they are loaded once,
+on first use or at startup, and reused by every analysis instead of being reloaded at each call
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, as_completed
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Union
+
+import fasttext
+import pandas as pd
+import requests
+import stanza
+from stanza import Document, DownloadMethod, Pipeline
+
+from modules import check_length_table, record_outputs, load_config, LENGTH_REQUIRED_PROCESSORS
+from duplication import duplication
+from find_voc import find_voc
+from find_voc.matcher import LemmaMatcher, LexiconMatcher
+from tense_notpresent import tense_notpresent
+from person import person
+from coref import coref
+from coref.coref import flag_coref_chains, load_coref_model
+from engine.annotation_cache import AnnotationCache, annotate_with_cache
+from engine.lexicons import LEXICON_ID_ATTRIBUTE, LexiconRegistry
+from engine.result_cache import make_result_cache, result_key
+from engine.token_table import TokenTable
+from engine import metrics
+
+SUPPORTED_LANGUAGES = ("EN", "FR")
+
+# Stanza processors https://stanfordnlp.github.io/stanza/pipeline.html
+# There is a tokenization, the multi-word tokenization (useful for French), a pos-tagging,
+# a lemmatisation and a syntactic parsing, only the ones needed by the enabled features are run
+STANZA_PROCESSORS = ("tokenize", "mwt", "pos", "lemma", "depparse")
+# The default models of Stanza are those of its version, the cached annotations depend on it
+STANZA_MODEL_VERSION = stanza.__version__
+
+# Lexicons of the config by feature (keys of the config)
+CONFIG_LEXICONS = {"cinema": "voc_cinema", "offensive": "voc_offensant"}
+# Detector matching all the lexicons of an analysis in a single pass, its result is split by lexicon
+# (see split_lexicon_results)
+LEXICONS_TASK = "lexicons"
+
+# Number of lines annotated together when the progress of an analysis is reported
+PROGRESS_ANNOTATION_LINES = 100
+
+# Features that can be enabled in an analysis and the Stanza processors each of them needs
+# the processors of cinema and offensive depend on the lemmatization option (see plan_processors)
+FEATURES = {
+    "length": LENGTH_REQUIRED_PROCESSORS,
+    "duplication": duplication.REQUIRED_PROCESSORS,
+    "cinema": find_voc.REQUIRED_PROCESSORS,
+    "offensive": find_voc.REQUIRED_PROCESSORS,
+    "tense_notpresent": tense_notpresent.REQUIRED_PROCESSORS,
+    "person": person.REQUIRED_PROCESSORS,
+    "coref": coref.REQUIRED_PROCESSORS,
+    "emotions": set(),
+}
+
+
+def select_features(features: Iterable[str] = None, with_emotion: bool = True) -> Set[str]:
+    """
+    Check the features requested for an analysis
+    :param features: names of the features to compute, all of them if None
+    :param with_emotion: emotions are removed from the features if False
+    :return: set of the enabled features
+    """
+    if features is None:
+        enabled = set(FEATURES)
+    else:
+        enabled = set(features)
+        unknown = enabled - set(FEATURES)
+        if unknown:
+            raise ValueError("Unknown features: %s (available features: %s)"
+                             % (", ".join(sorted(unknown)), ", ".join(FEATURES)))
+    if not with_emotion:
+        enabled.discard("emotions")
+
+    return enabled
+
+
+def check_lexicon_names(names: Iterable[str]) -> None:
+    """
+    Check the names of the personal lexicons of an analysis, each one is a feature of the output
+    :raise ValueError: if a lexicon has the name of a feature
+    """
+    for name in names:
+        if name in FEATURES or name == LEXICONS_TASK:
+            raise ValueError("The lexicon \"%s\" has the name of a feature" % name)
+
+
+def plan_processors(features: Set[str], lemmatizing: bool, lexicons: Iterable[str] = ()) -> str:
+    """
+    Minimal set of Stanza processors needed by the enabled features
+    :param features: enabled features
+    :param lemmatizing: lexicons are matched on the lemmatized text (True) or on the raw text (False)
+    :param lexicons: names of the personal lexicons matched besides the features, they need the processors of cinema
+    :return: processors in the Stanza format (ex: "tokenize,mwt"), empty if no annotation is needed
+    """
+    required = set()
+    for feature in set(features) | ({"cinema"} if lexicons else set()):
+        if feature in ("cinema", "offensive") and not lemmatizing:
+            required |= find_voc.REQUIRED_PROCESSORS_RAW
+        else:
+            required |= FEATURES[feature]
+
+    return ",".join(processor for processor in STANZA_PROCESSORS if processor in required)
+
+
+def _timed_call(function: Callable, args: tuple) -> Tuple[Any, float]:
+    """
+    Call a function and measure its duration
+    :param function: function to call
+    :param args: arguments of the function
+    :return: result of the function and duration in seconds
+    """
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+class _DetectorError:
+    """
+    Error of a detector of a VD of a batch, given back as its result (see _guarded_call)
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+def _guarded_call(function: Callable, args: tuple) -> Any:
+    """
+    Call a detector of a VD of a batch, its exception is given back as a _DetectorError instead of being raised
+    so that it only fails its VD
+    :param function: detector
+    :param args: arguments of the detector
+    :return: result of the detector or _DetectorError
+    """
+    try:
+        return function(*args)
+    except Exception as error:
+        return _DetectorError("%s: %s" % (type(error).__name__, error))
+
+
+def feature_order(labels: Iterable[str] = ()) -> List[str]:
+    """
+    Order of the features in the outputs
+    :param labels: names of the personal lexicons of an analysis, given after the lexicons of the config
+    """
+    order = list(FEATURES)
+    position = order.index("offensive") + 1
+    return order[:position] + list(labels) + order[position:]
+
+
+def split_lexicon_results(results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Results by feature, the result of the lexicons detector (by lexicon) replaced by the result of each lexicon
+    :param results: results by feature (see Engine.run_detectors)
+    """
+    split = {}
+    for feature, result in results.items():
+        if feature == LEXICONS_TASK:
+            split.update(result)
+        else:
+            split[feature] = result
+    return split
+
+
+def _check_lexicons(table: TokenTable, lang: str, lemmatizing: bool,
+                    sources: Dict[str, Tuple[str, pd.DataFrame]], engine: "Engine" = None,
+                    matcher: Union[LexiconMatcher, LemmaMatcher] = None) -> Dict[str, dict]:
+    """
+    Lexicon detector run by the executor, all the lexicons are matched in a single pass over the lines
+    :param table: token table of the lines of the VD
+    :param sources: lexicons by feature (see Engine.lexicon_sources)
+    :param engine: engine owning the registry of the lexicons (see Engine.lexicon_matcher),
+    the engine of the current process if None (process executor)
+    :param matcher: lexicons already indexed, taken from the registry if None
+    :return: results of each lexicon, by feature
+    """
+    if matcher is None:
+        engine = engine if engine else get_engine()
+        matcher = engine.lexicon_matcher(lang, lemmatizing, sources)
+    return find_voc.check_lexicons_table(table, matcher, lemmatizing)
+
+
+def _flag_coref_chains(text: str, docs: list, lang: str, max_coref_length: int, engine: "Engine" = None,
+                       spacy_doc=None, split: bool = True) -> dict:
+    """
+    Coreference detector run by the executor
+    :param docs: Stanza documents of the lines of the VD or their TokenTable
+    :param engine: engine owning the spacy + coreferee pipeline,
+    the engine of the current process if None (process executor)
+    :param spacy_doc: text already processed by spacy + coreferee, processed here if None
+    :param split: split the chains, see flag_coref_chains
+    """
+    if spacy_doc is not None:
+        return flag_coref_chains(text, docs, lang, max_coref_length, spacy_doc=spacy_doc, split=split)
+
+    engine = engine if engine else get_engine()
+    with engine.resource_lock(("coref", lang)):
+        return flag_coref_chains(text, docs, lang, max_coref_length, engine.get_coref_model(lang), split=split)
+
+
+def request_emotions(lines: List[str], lang: str, timeout: float = None) -> Dict[int, list]:
+    """
+    Detect the emotions with the Span-ASTE model served by the emotion service
+    as the configuration of the model Span-Aste is not the same as coreferee there is need to have 2 envs,
+    one for coreferee and one for Span-ASTE
+    :param lines: lines of the VD
+    :param lang: EN or FR
+    :param timeout: max number of seconds to wait for the service
+    :return: emotions by line of the VD
+    """
+    response = requests.post(url=os.environ['EMOTION_SERVICE'], json={'lines': lines, 'lang': lang}, timeout=timeout)
+
+    output_emotion = dict(response.json())
+    return {int(k): v for k, v in output_emotion.items()}
+
+
+def get_config_path() -> str:
+    """
+    Path of the config file of the tool, use the local one if it exists
+    :return: path of config_local.ini or config.ini
+    """
+    main_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if os.path.isfile(os.path.join(main_dir, "config_local.ini")):
+        return os.path.join(main_dir, "config_local.ini")
+
+    return os.path.join(main_dir, "config.ini")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize the line breaks of a VD (Windows and old Mac line breaks become \n)
+    :param text: Text corresponding to the VD
+    :return: normalized text
+    """
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def split_lines(text: str) -> Tuple[List[str], str]:
+    """
+    Split a VD in lines and remove timestamps if present.
+    The text to process should be a single string made up of lines or be in TSV format
+    In TSV format we should have two columns: timestamps and their corresponding lines of text
+    :param text: Text corresponding to the VD
+    :return: raw lines of the VD and the text without timestamps
+    """
+    clean_lines = []
+    format_found = None
+    lines = text.split("\n")
+    for line in lines:
+        if "\t" in line:
+            if format_found is None:
+                format_found = "TSV"
+            elif format_found == "TXT":
+                raise ValueError("The text is neither in TXT nor TSV format with 2 columns")
+            columns = line.split("\t")
+            if len(columns) != 2:
+                raise ValueError("The text is in TSV format but it has more than 2 columns")
+            clean_lines.append(columns[1].strip())
+        else:
+            if format_found is None:
+                format_found = "TXT"
+            elif format_found == "TSV":
+                raise ValueError("The text is neither in TXT nor TSV format with 2 columns")
+            clean_lines.append(line.strip())
+
+    return lines, "\n".join(clean_lines)
+
+
+class Engine:
+    """
+    Owns the models used to analyze VDs. Each model is created once, on first use
+    or eagerly with warm_up, and is then shared by all the analyses
+    """
+
+    def __init__(self, config_path: str = None):
+        """
+        :param config_path: path of the config file, config_local.ini or config.ini by default
+        """
+        self.config_path = config_path if config_path else get_config_path()
+        self.param_conf = load_config(self.config_path)
+
+        self._lock = threading.RLock()
+        # a model is used by one analysis at a time
+        self._resource_locks = defaultdict(threading.Lock)
+        self._lang_detection_model = None
+        self._stanza_pipelines = {}
+        self._coref_models = {}
+        self.annotation_cache = AnnotationCache(self.param_conf["annotation_cache_size"],
+                                                self.param_conf["annotation_cache_dir"])
+        self.result_cache = make_result_cache(self.param_conf)
+        # lexicons by id and their matchers, the lexicons of the config are registered by warm_up or on first use
+        self.lexicons = LexiconRegistry(self.param_conf["lexicon_registry_size"], self.param_conf["lexicon_cache_size"],
+                                        self.param_conf["lexicon_artifact_dir"], STANZA_MODEL_VERSION)
+        self._executor = None
+        # the requests to the emotion service are waiting on the network, they have their own threads
+        self._emotion_executor = ThreadPoolExecutor(thread_name_prefix="emotions")
+
+    @property
+    def lang_detection_model(self):
+        """
+        FastText language detection model, loaded on first use
+        """
+        if self._lang_detection_model is None:
+            with self._lock:
+                if self._lang_detection_model is None:
+                    self._lang_detection_model = fasttext.load_model(
+                        self.param_conf["lang_detection_pretrained_model"])
+        return self._lang_detection_model
+
+    def get_stanza_pipeline(self, lang: str, processors: str = ",".join(STANZA_PROCESSORS)) -> Pipeline:
+        """
+        Stanza pipeline of a language with the given processors, created on first use
+        :param lang: EN or FR
+        :param processors: Stanza processors (ex: "tokenize,mwt"), all of them by default
+        :return: Stanza pipeline
+        """
+        key = (lang, processors)
+        if key not in self._stanza_pipelines:
+            with self._lock:
+                if key not in self._stanza_pipelines:
+                    # offline, the models must already be downloaded
+                    download_method = None if self.param_conf["stanza_offline"] \
+                        else DownloadMethod.DOWNLOAD_RESOURCES
+                    self._stanza_pipelines[key] = Pipeline(lang, processors=processors,
+                                                           download_method=download_method)
+        return self._stanza_pipelines[key]
+
+    def get_coref_model(self, lang: str):
+        """
+        spacy + coreferee pipeline of a language, created on first use
+        :param lang: EN or FR
+        :return: spacy pipeline with coreferee
+        """
+        if lang not in self._coref_models:
+            with self._lock:
+                if lang not in self._coref_models:
+                    self._coref_models[lang] = load_coref_model(lang)
+        return self._coref_models[lang]
+
+    def loaded_models(self) -> Dict[str, int]:
+        """
+        Number of models loaded by kind
+        :return: number of language detection models, Stanza pipelines and spacy + coreferee pipelines
+        """
+        return {"lang_detection": int(self._lang_detection_model is not None),
+                "stanza": len(self._stanza_pipelines), "coref": len(self._coref_models)}
+
+    def resource_lock(self, key: tuple) -> threading.Lock:
+        """
+        Lock protecting a model shared by concurrent analyses
+        :param key: key of the model (ex: ("coref", "EN"))
+        :return: lock of the model
+        """
+        with self._lock:
+            return self._resource_locks[key]
+
+    def annotate(self, lang: str, processors: str, docs: list) -> list:
+        """
+        Annotate documents with the Stanza pipeline of a language
+        the lines already annotated are taken from the annotation cache
+        :param lang: EN or FR
+        :param processors: Stanza processors (ex: "tokenize,mwt")
+        :param docs: Stanza documents to annotate
+        :return: annotated Stanza documents
+        """
+        def run_pipeline(docs_to_annotate: list) -> list:
+            processor = self.get_stanza_pipeline(lang, processors)
+            with self.resource_lock(("stanza", lang, processors)):
+                start_time = time.perf_counter()
+                annotated = processor(docs_to_annotate)
+            metrics.observe("stanza", time.perf_counter() - start_time)
+            return annotated
+
+        return annotate_with_cache(self.annotation_cache, run_pipeline, docs, lang, processors, STANZA_MODEL_VERSION)
+
+    @property
+    def executor(self) -> Executor:
+        """
+        Pool running the detectors concurrently, created on first use
+        None if the detectors are run one after another ("sequential" executor in the config)
+        """
+        if self._executor is None and self.param_conf["executor"] != "sequential":
+            with self._lock:
+                if self._executor is None:
+                    if self.param_conf["executor"] == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.param_conf["max_workers"])
+                    elif self.param_conf["executor"] == "thread":
+                        self._executor = ThreadPoolExecutor(max_workers=self.param_conf["max_workers"],
+                                                            thread_name_prefix="detector")
+                    else:
+                        raise ValueError("Unknown executor \"%s\" (thread, process or sequential)"
+                                         % self.param_conf["executor"])
+        return self._executor
+
+    def close(self) -> None:
+        """
+        Stop the pool running the detectors
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._emotion_executor.shutdown()
+
+    def run_detectors(self, tasks: Dict[str, Tuple[Callable, tuple]],
+                      progress: Callable[[str, int, int], None] = None,
+                      sequential: bool = False) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """
+        Run independent detectors with the executor of the engine
+        :param tasks: function and arguments of each detector, by feature
+        :param progress: called with (feature, 1, 1) when a detector is done, the detectors not started yet
+        are cancelled if it raises an exception
+        :param sequential: run the detectors one after another in the calling thread, whatever the executor
+        :return: results and durations in seconds of the detectors, by feature
+        """
+        if sequential or self.executor is None:
+            outputs = {}
+            for feature, (function, args) in tasks.items():
+                outputs[feature] = _timed_call(function, args)
+                if progress:
+                    progress(feature, 1, 1)
+        else:
+            futures = {self.executor.submit(_timed_call, function, args): feature
+                       for feature, (function, args) in tasks.items()}
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    if progress:
+                        progress(futures[future], 1, 1)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            outputs = {feature: future.result() for future, feature in futures.items()}
+
+        results = {feature: result for feature, (result, _) in outputs.items()}
+        timings = {feature: duration for feature, (_, duration) in outputs.items()}
+        for key, duration in timings.items():
+            # the keys of the batches and sessions are tuples holding the name of the feature
+            metrics.observe(key if isinstance(key, str) else next(part for part in key if isinstance(part, str)),
+                            duration)
+
+        return results, timings
+
+    def dispatch_emotions(self, lines: List[str], lang: str) -> Future:
+        """
+        Send the lines of a VD to the emotion service without waiting for the answer
+        :param lines: lines of the VD
+        :param lang: EN or FR
+        :return: future of the emotions and of the duration of the request
+        """
+        return self._emotion_executor.submit(_timed_call, request_emotions,
+                                             (lines, lang, self.param_conf["emotion_timeout"]))
+
+    def wait_emotions(self, future: Future, dispatch_time: float, lang: str) -> Tuple[Dict[int, list], float]:
+        """
+        Wait for the answer of the emotion service, at most emotion_timeout seconds after the dispatch
+        :param future: future returned by dispatch_emotions
+        :param dispatch_time: time (perf_counter) of the dispatch
+        :param lang: EN or FR
+        :return: emotions by line of the VD (empty if the service is too slow) and duration of the request
+        """
+        timeout = self.param_conf["emotion_timeout"]
+        if timeout is not None:
+            timeout = max(0., timeout - (time.perf_counter() - dispatch_time))
+        try:
+            emotions, duration = future.result(timeout=timeout)
+            metrics.observe("emotions", duration)
+            return emotions, duration
+        except (TimeoutError, requests.Timeout):
+            self.abandon_emotions(future)
+            metrics.ERRORS.labels("emotions", "timeout").inc()
+            metrics.log_request("emotions", self.param_conf["log_sample_rate"], error=True, lang=lang,
+                                message="the emotion service did not answer within %s seconds"
+                                        % self.param_conf["emotion_timeout"])
+        except (FileNotFoundError, PermissionError) as error:
+            metrics.ERRORS.labels("emotions", "model").inc()
+            metrics.log_request("emotions", self.param_conf["log_sample_rate"], error=True, lang=lang,
+                                message="emotions not detected with the Span-ASTE model \"%s\" - %s"
+                                        % (self.param_conf["span_aste_model_path_%s" % lang.lower()], error))
+
+        return {}, time.perf_counter() - dispatch_time
+
+    def abandon_emotions(self, future: Future) -> None:
+        """
+        Stop waiting for the emotions of an analysis: the request is cancelled if it has not started yet,
+        else its error is counted and logged when it ends instead of being lost
+        :param future: future returned by dispatch_emotions
+        """
+        if not future.cancel():
+            future.add_done_callback(self._abandoned_emotions)
+
+    def _abandoned_emotions(self, future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            metrics.ERRORS.labels("emotions", type(error).__name__).inc()
+            metrics.log_request("emotions", self.param_conf["log_sample_rate"], error=True,
+                                message="request of the emotions abandoned: %s" % error)
+
+    def warm_up(self, langs: Iterable[str] = SUPPORTED_LANGUAGES) -> None:
+        """
+        Load eagerly the models of the given languages needed by a complete analysis
+        :param langs: languages to load
+        """
+        self.lang_detection_model
+        for lang in langs:
+            if lang not in SUPPORTED_LANGUAGES:
+                raise ValueError("Only the English and French languages are supported")
+            self.get_stanza_pipeline(lang)
+            self.get_coref_model(lang)
+        # the matchers of the lexicons of the config are built for the languages loaded
+        self.register_config_lexicons()
+        for lang in langs:
+            self.lexicon_matcher(lang, True, self.lexicon_sources(set(CONFIG_LEXICONS)))
+
+    def detect_language(self, text: str) -> str:
+        """
+        Detect the language of a text with FastText
+        :param text: Text corresponding to the VD
+        :return: upper case language code (ex: EN)
+        """
+        # FastText's response is in tuple form (language label, probability, data type)
+        # Example: ([['__label__en']], [array([0.8957091], dtype=float32)])
+        start_time = time.perf_counter()
+        lang_preds = self.lang_detection_model.predict(
+            [text[:self.param_conf["lang_detection_max_num_chars"]].replace("\n", " ")])
+        metrics.observe("lang_detection", time.perf_counter() - start_time)
+        return lang_preds[0][0][0].replace("__label__", "").upper()
+
+    def register_config_lexicons(self) -> Dict[str, str]:
+        """
+        Register the lexicons of the config in the registry, they are never evicted
+        :return: ids of the lexicons by name (voc_cinema, voc_offensant)
+        """
+        return {name: self.lexicons.register_file(self.param_conf[name], name, pinned=True)
+                for name in CONFIG_LEXICONS.values()}
+
+    def lexicon_hash(self, path_lex: str = None, voc_df: pd.DataFrame = None) -> str:
+        """
+        Hash of the content of a lexicon, its id in the registry of the lexicons (registered if needed)
+        :param path_lex: path of the lexicon, used if voc_df is None
+        :param voc_df: personal lexicon, not modified once registered
+        :return: hexadecimal sha256 hash
+        """
+        if voc_df is not None:
+            known_id = voc_df.attrs.get(LEXICON_ID_ATTRIBUTE)
+            if known_id is not None and self.lexicons.contains(known_id):
+                return known_id
+            return self.lexicons.register(voc_df)
+
+        return self.lexicons.register_file(path_lex, pinned=True)
+
+    def lexicon_sources(self, features: Set[str], voc_cinema_df: pd.DataFrame = None,
+                        voc_offensant_df: pd.DataFrame = None,
+                        lexicons: Dict[str, pd.DataFrame] = None) -> Dict[str, Tuple[str, pd.DataFrame]]:
+        """
+        Lexicons matched by an analysis
+        :param features: enabled features, the lexicons of cinema and offensive are matched if they are enabled
+        :param voc_cinema_df: personal cinematographic lexicon, the one of the config is used if None
+        :param voc_offensant_df: personal offensive lexicon, the one of the config is used if None
+        :param lexicons: other personal lexicons by name, each one is a feature of the output
+        :return: path of the lexicon of the config (None for a personal lexicon) and personal lexicon, by feature
+        :raise ValueError: if a personal lexicon has the name of a feature
+        """
+        personal = {"cinema": voc_cinema_df, "offensive": voc_offensant_df}
+        sources = {feature: (self.param_conf[name] if personal[feature] is None else None, personal[feature])
+                   for feature, name in CONFIG_LEXICONS.items() if feature in features}
+        check_lexicon_names(lexicons or {})
+        sources.update({name: (None, voc_df) for name, voc_df in (lexicons or {}).items()})
+
+        return sources
+
+    def lexicon_matcher(self, lang: str, lemmatizing: bool,
+                        sources: Dict[str, Tuple[str, pd.DataFrame]]) -> Union[LexiconMatcher, LemmaMatcher]:
+        """
+        Matcher of the lexicons of an analysis, taken from the registry of the lexicons (built on its first use)
+        :param lang: FR or EN
+        :param lemmatizing: lexicons are matched on the lemmatized text (True) or on the raw text (False)
+        :param sources: lexicons by feature (see lexicon_sources)
+        :return: labeled matcher of the lexicons, the labels are the features
+        :raise ValueError: if a lexicon has no column for the language
+        """
+        lexicon_ids = tuple((feature, self.lexicon_hash(path_lex, voc_df))
+                            for feature, (path_lex, voc_df) in sources.items())
+        return self.lexicons.labeled_matcher(lexicon_ids, lang, lemmatizing,
+                                             partial(self.annotate, lang, plan_processors({"cinema"}, True)),
+                                             self.param_conf["lexicon_max_distance"])
+
+    def result_key(self, text: str, max_length: int, seuil_duplication: int,
+                   window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
+                   max_coref_length: int, with_emotion: bool,
+                   voc_cinema_df: pd.DataFrame = None, voc_offensant_df: pd.DataFrame = None,
+                   features: Iterable[str] = None, lexicons: Dict[str, pd.DataFrame] = None, **_) -> str:
+        """
+        Content address of the result of an analysis (see Engine.analyze for the parameters)
+        Only the parameters of the enabled features are taken into account
+        :return: hexadecimal sha256 hash of the normalized text, of the parameters,
+        of the contents of the lexicons and of the versions of the models
+        """
+        features = select_features(features, with_emotion)
+        # the lexicons of the config and the personal lexicons are matched with the same distance
+        max_distance = self.param_conf["lexicon_max_distance"]
+        parameters = {"length": {"max_length": max_length},
+                      "duplication": {"seuil_duplication": seuil_duplication,
+                                      "window_duplication": window_duplication,
+                                      "postag_repetition": sorted(set(postag_repetition))},
+                      "cinema": {"lemmatizing": lemmatizing, "max_distance": max_distance,
+                                 "lexicon": self.lexicon_hash(self.param_conf["voc_cinema"], voc_cinema_df)
+                                 if "cinema" in features else None},
+                      "offensive": {"lemmatizing": lemmatizing, "max_distance": max_distance,
+                                    "lexicon": self.lexicon_hash(self.param_conf["voc_offensant"], voc_offensant_df)
+                                    if "offensive" in features else None},
+                      "tense_notpresent": {"strict_mode": strict_mode},
+                      "person": {},
+                      "coref": {"max_coref_length": max_coref_length, "spacy": coref.spacy.__version__},
+                      "emotions": {"model_%s" % lang: self.param_conf["span_aste_model_path_%s" % lang]
+                                   for lang in ("en", "fr")}}
+
+        # the personal lexicons are features named after them
+        check_lexicon_names(lexicons or {})
+        for name, voc_df in (lexicons or {}).items():
+            parameters[name] = {"lemmatizing": lemmatizing, "max_distance": max_distance,
+                                "lexicon": self.lexicon_hash(None, voc_df)}
+        features |= set(lexicons or {})
+
+        return result_key({"text": normalize_text(text),
+                           "features": {feature: parameters[feature] for feature in features},
+                           "stanza": STANZA_MODEL_VERSION,
+                           "lang_detection": [self.param_conf["lang_detection_pretrained_model"],
+                                              self.param_conf["lang_detection_max_num_chars"]]})
+
+    def prepare(self, text: str, features: Iterable[str] = None, with_emotion: bool = True,
+                lemmatizing: bool = True, lexicons: Iterable[str] = ()) -> Tuple[str, List[str], str, Set[str], str]:
+        """
+        Detect the language of a VD, split it in lines and plan its annotations
+        :param text: Text corresponding to the VD
+        :param features: names of the features to compute, all of them if None
+        :param with_emotion: Boolean indicating if emotion detection is required
+        :param lemmatizing: Boolean indicating if lemmatization is required for check of lex_cinema
+        :param lexicons: names of the personal lexicons matched besides the features
+        :return: language, raw lines, text without timestamps, enabled features and Stanza processors
+        """
+        features = select_features(features, with_emotion)
+        check_lexicon_names(lexicons)
+
+        text = normalize_text(text)
+        lang = self.detect_language(text)
+        lines, text = split_lines(text)
+
+        # Error handling
+        if not text:
+            raise ValueError("No input text was specified")
+        if lang not in SUPPORTED_LANGUAGES:
+            raise ValueError("Only the English and French languages are supported")
+
+        return lang, lines, text, features, plan_processors(features, lemmatizing, lexicons)
+
+    def detector_tasks(self, table: TokenTable, text: str, lang: str, features: Set[str], processors: str,
+                       max_length: int, seuil_duplication: int, window_duplication: int, postag_repetition: list,
+                       lemmatizing: bool, strict_mode: bool, max_coref_length: int,
+                       voc_cinema_df: pd.DataFrame = None, voc_offensant_df: pd.DataFrame = None,
+                       lexicons: Dict[str, pd.DataFrame] = None, matcher: Union[LexiconMatcher, LemmaMatcher] = None,
+                       spacy_doc=None) -> Dict[str, Tuple[Callable, tuple]]:
+        """
+        Detectors of the enabled features for an annotated VD, to run with run_detectors
+        :param table: token table of the annotated lines of the VD (see TokenTable.from_docs)
+        :param lexicons: other personal lexicons by name (see lexicon_sources)
+        :param matcher: lexicons already indexed (see lexicon_matcher), indexed by the task if None
+        :param spacy_doc: text already processed by spacy + coreferee, processed by the task if None
+        :return: function and arguments of each detector, by feature (the lexicons are matched by the
+        LEXICONS_TASK detector, see split_lexicon_results)
+        """
+        # The detectors only read the annotations, they are run concurrently by the executor
+        # in a process pool the models are those of the engine of each worker
+        engine = None if self.param_conf["executor"] == "process" else self
+        tasks = {}
+        if "length" in features:
+            tasks["length"] = (check_length_table, (table, max_length))
+
+        if "duplication" in features:
+            tasks["duplication"] = (duplication.check_duplication_table,
+                                    (table, seuil_duplication, window_duplication, postag_repetition))
+
+        sources = self.lexicon_sources(features, voc_cinema_df, voc_offensant_df, lexicons)
+        if sources:
+            tasks[LEXICONS_TASK] = (_check_lexicons, (table, lang, lemmatizing, sources, engine, matcher))
+
+        if "tense_notpresent" in features:
+            tasks["tense_notpresent"] = (tense_notpresent.detect_non_present_tense_table, (table, strict_mode))
+
+        if "person" in features:
+            tasks["person"] = (person.detect_non_third_person_table, (table,))
+
+        if "coref" in features:
+            tasks["coref"] = (_flag_coref_chains, (text, table, lang, max_coref_length, engine, spacy_doc))
+
+        return tasks
+
+    def analyze(self, text: str, max_length: int, seuil_duplication: int,
+                window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
+                max_coref_length: int, with_emotion: bool,
+                voc_cinema_df: pd.DataFrame = None, voc_offensant_df: pd.DataFrame = None,
+                features: Iterable[str] = None, with_timings: bool = False,
+                progress: Callable[[str, int, int], None] = None, use_cache: bool = True,
+                sequential: bool = False, lexicons: Dict[str, pd.DataFrame] = None) -> Dict[str, Any]:
+        """
+        Performs the quality checks of the enabled features on a video description
+        Only the annotations needed by these features are computed
+
+        Args:
+            text: Text corresponding to the VD
+            max_length: Max length threshold. Required for the length feature
+            seuil_duplication: duplication threshold. Required for the duplication feature
+            window_duplication: Window size for the duplication feature
+            postag_repetition : List of postags for which the repetition feature is required
+            lemmatizing : Boolean indicating if lemmatization is required for check of lex_cinema
+            strict_mode : for the tense_notpresent feature
+            max_coref_length: Max number of elements in a coreference chain
+            with_emotion: Boolean indicating if emotion detection is required
+            voc_cinema_df: personal cinematographic lexicon, the one of the config is used if None
+            voc_offensant_df: personal offensive lexicon, the one of the config is used if None
+            features: names of the features to compute (see FEATURES), all of them if None
+            with_timings: add the durations in seconds of the annotation and of each detector to the output
+            progress: called with (stage, done, total) as the analysis goes on (annotation in lines,
+                then each feature), first with done = 0 for all the stages. An exception raised by it
+                stops the analysis (ex: cancellation of a job)
+            use_cache: take the result from the result cache if it is there
+            sequential: run the detectors in the calling thread (ex: to profile them)
+            lexicons: other personal lexicons by name, the terms of each one are a feature named after it
+                (the lexicons are matched together by the stage "lexicons")
+
+        Returns:
+            A JSON document
+        """
+        start_time = time.time()
+        if self.result_cache is not None and use_cache:
+            key = self.result_key(text, max_length, seuil_duplication, window_duplication, postag_repetition,
+                                  lemmatizing, strict_mode, max_coref_length, with_emotion,
+                                  voc_cinema_df, voc_offensant_df, features, lexicons)
+            out_json = self.result_cache.get(key)
+            if out_json is not None:
+                if with_timings:
+                    out_json["timings"] = {"cache": time.time() - start_time}
+                metrics.log_request("analyze", self.param_conf["log_sample_rate"], cached=True,
+                                    duration=round(time.time() - start_time, 4))
+                return out_json
+
+        lang, lines, text, features, processors = self.prepare(text, features, with_emotion, lemmatizing,
+                                                               lexicons or ())
+        if progress:
+            progress("annotation", 0, len(lines))
+            # the lexicons are matched in a single stage
+            lexicon_features = (features & set(CONFIG_LEXICONS)) | set(lexicons or ())
+            for stage in dict.fromkeys(LEXICONS_TASK if feature in lexicon_features else feature
+                                       for feature in feature_order(lexicons or ())
+                                       if feature in features | lexicon_features):
+                progress(stage, 0, 1)
+
+        # The emotion service only needs the lines, it works while the text is analyzed here
+        if "emotions" in features:
+            emotion_dispatch_time = time.perf_counter()
+            emotion_future = self.dispatch_emotions(lines, lang)
+
+        # the request of the emotions is abandoned if the analysis fails or is cancelled
+        try:
+            # Obtain a list of Stanza document objects annotated only with the processors needed
+            # Each document corresponds to a line of the video description
+            annotation_start_time = time.perf_counter()
+            docs = [Document([], text=line) for line in lines]
+            if processors and progress:
+                # annotated by batches of lines to report the progress (and stop between them)
+                annotated = []
+                for first_line in range(0, len(docs), PROGRESS_ANNOTATION_LINES):
+                    annotated.extend(self.annotate(lang, processors,
+                                                   docs[first_line:first_line + PROGRESS_ANNOTATION_LINES]))
+                    progress("annotation", len(annotated), len(docs))
+                docs = annotated
+                del annotated
+            elif processors:
+                docs = self.annotate(lang, processors, docs)
+            timings = {"annotation": time.perf_counter() - annotation_start_time}
+            metrics.observe("annotation", timings["annotation"])
+            metrics.count_documents(docs)
+            if progress and not processors:
+                progress("annotation", len(docs), len(docs))
+
+            # The detectors work on the token table, the Stanza documents are released before they run
+            table_start_time = time.perf_counter()
+            table = TokenTable.from_docs(docs)
+            del docs
+            timings["token_table"] = time.perf_counter() - table_start_time
+            metrics.observe("token_table", timings["token_table"])
+
+            tasks = self.detector_tasks(table, text, lang, features, processors, max_length, seuil_duplication,
+                                        window_duplication, postag_repetition, lemmatizing, strict_mode,
+                                        max_coref_length, voc_cinema_df, voc_offensant_df, lexicons)
+            results, detector_timings = self.run_detectors(tasks, progress, sequential)
+        except BaseException:
+            if "emotions" in features:
+                self.abandon_emotions(emotion_future)
+            raise
+        results = split_lexicon_results(results)
+        timings.update(detector_timings)
+
+        emotions_received = True
+        if "emotions" in features:
+            results["emotions"], timings["emotions"] = self.wait_emotions(emotion_future, emotion_dispatch_time,
+                                                                          lang)
+            # the emotions given back are those of the answer, not the empty ones of a failed request
+            # (even if the request ended after its timeout)
+            emotions_received = emotion_future.done() and not emotion_future.cancelled() \
+                and emotion_future.exception() is None and emotion_future.result()[0] is results["emotions"]
+            if progress:
+                progress("emotions", 1, 1)
+
+        # Record the results, only if the feature is detected
+        out_json = record_outputs(table, results)
+        # a result without the emotions because of the emotion service is not kept
+        if self.result_cache is not None and use_cache and emotions_received:
+            self.result_cache.put(key, out_json)
+        if with_timings:
+            out_json["timings"] = timings
+        metrics.log_request("analyze", self.param_conf["log_sample_rate"], lang=lang, num_lines=len(lines),
+                            duration=round(time.time() - start_time, 4),
+                            timings={stage: round(duration, 4) for stage, duration in timings.items()})
+
+        return out_json
+
+    def analyze_batch(self, items: List[Dict[str, Any]], **parameters) -> List[Dict[str, Any]]:
+        """
+        Performs the quality checks on many video descriptions at once
+        The lines of all the VDs of a language are annotated together in large Stanza batches,
+        their texts go through spacy + coreferee with nlp.pipe, the emotions of a language
+        are asked with one request and the lexicons are indexed once
+
+        Args:
+            items: VDs to analyze, each item holds the text of the VD ("text") and optionally
+                its own values for the other arguments of analyze
+            parameters: values of the arguments of analyze shared by the items (ex: max_length=35)
+
+        Returns:
+            The JSON document of each VD, in the order of the items,
+            {"error": message} for the VDs which can not be analyzed
+        """
+        start_time = time.time()
+        outputs: List[Dict[str, Any]] = [{} for _ in items]
+        prepared = {}
+        for i, item in enumerate(items):
+            item_parameters = dict(parameters, **item)
+            try:
+                item_parameters.pop("with_timings", None)
+                lang, lines, text, features, processors = self.prepare(
+                    item_parameters.pop("text"), item_parameters.pop("features", None),
+                    item_parameters.pop("with_emotion"), item_parameters["lemmatizing"],
+                    item_parameters.get("lexicons") or ())
+                prepared[i] = (lang, lines, text, features, processors, item_parameters)
+            except (KeyError, ValueError) as error:
+                outputs[i] = {"error": str(error)}
+
+        # One request to the emotion service by language, the lines of the VDs are concatenated
+        emotion_requests = {}
+        for lang in {lang for lang, _, _, features, _, _ in prepared.values() if "emotions" in features}:
+            indices = [i for i, (item_lang, _, _, features, _, _) in prepared.items()
+                       if item_lang == lang and "emotions" in features]
+            lines = [line for i in indices for line in prepared[i][1]]
+            emotion_requests[lang] = ([(i, len(prepared[i][1])) for i in indices], time.perf_counter(),
+                                      self.dispatch_emotions(lines, lang))
+
+        # The lines of the VDs with the same language and annotations are annotated together
+        docs = {}
+        for lang, processors in {(lang, processors) for lang, _, _, _, processors, _ in prepared.values()}:
+            indices = [i for i, (item_lang, _, _, _, item_processors, _) in prepared.items()
+                       if (item_lang, item_processors) == (lang, processors)]
+            batch = [Document([], text=line) for i in indices for line in prepared[i][1]]
+            if processors:
+                batch = self.annotate(lang, processors, batch)
+            for i in indices:
+                docs[i], batch = batch[:len(prepared[i][1])], batch[len(prepared[i][1]):]
+        metrics.count_documents(doc for item_docs in docs.values() for doc in item_docs)
+        # the detectors work on the token table of each VD
+        tables = {i: TokenTable.from_docs(item_docs) for i, item_docs in docs.items()}
+        del docs
+
+        # The texts of a language go through spacy + coreferee together
+        # (in a process pool, each worker processes the texts with its own models)
+        spacy_docs = {}
+        if self.param_conf["executor"] != "process":
+            for lang in {lang for lang, _, _, features, _, _ in prepared.values() if "coref" in features}:
+                indices = [i for i, (item_lang, _, _, features, _, _) in prepared.items()
+                           if item_lang == lang and "coref" in features]
+                with self.resource_lock(("coref", lang)):
+                    spacy_docs.update(zip(indices, self.get_coref_model(lang).pipe(prepared[i][2] for i in indices)))
+
+        # The lexicons shared by the VDs are taken once from the registry
+        tasks = {}
+        for i, (lang, _, text, features, processors, item_parameters) in list(prepared.items()):
+            try:
+                sources = self.lexicon_sources(features, item_parameters.get("voc_cinema_df"),
+                                               item_parameters.get("voc_offensant_df"), item_parameters.get("lexicons"))
+                matcher = self.lexicon_matcher(lang, item_parameters["lemmatizing"], sources) if sources else None
+            except ValueError as error:
+                outputs[i] = {"error": str(error)}
+                del prepared[i]
+                continue
+
+            item_tasks = self.detector_tasks(tables[i], text, lang, features, processors, matcher=matcher,
+                                             spacy_doc=spacy_docs.get(i), **item_parameters)
+            tasks.update({(i, feature): (_guarded_call, task) for feature, task in item_tasks.items()})
+
+        # The detectors of all the VDs are run together by the executor, a detector failing only fails its VD
+        results, _ = self.run_detectors(tasks)
+        for (i, feature), result in results.items():
+            if isinstance(result, _DetectorError) and i in prepared:
+                metrics.ERRORS.labels(feature, "detector").inc()
+                outputs[i] = {"error": "%s: %s" % (feature, result.message)}
+                del prepared[i]
+
+        for lang, (indices, dispatch_time, future) in emotion_requests.items():
+            emotions, _ = self.wait_emotions(future, dispatch_time, lang)
+            first_line = 0
+            for i, num_lines in indices:
+                results[(i, "emotions")] = {line: emotions[first_line + line] for line in range(num_lines)
+                                            if first_line + line in emotions}
+                first_line += num_lines
+
+        for i in prepared:
+            outputs[i] = record_outputs(tables[i], split_lexicon_results(
+                {feature: result for (j, feature), result in results.items() if j == i}))
+        metrics.log_request("analyze_batch", self.param_conf["log_sample_rate"], num_items=len(items),
+                            num_errors=len(items) - len(prepared), duration=round(time.time() - start_time, 4))
+
+        return outputs
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """
+    Engine shared by the whole process, created on first call
+    :return: the shared engine
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine()
+    return _engine
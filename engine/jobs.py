@@ -0,0 +1,174 @@
+"""
+Asynchronous analysis jobs for the long VDs.
+A job is submitted to a local pool of workers with a bounded queue and returns at once,
+its status reports the progress of each stage of the analysis (annotation, each feature, emotions)
+and a job can be cancelled: a queued job is never run, a running job stops at the next step of its analysis
+"""
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from engine.engine import Engine
+from engine import metrics
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised in the analysis of a job which was cancelled"""
+
+
+class Job:
+    """
+    Analysis of a VD run by a worker of a JobQueue
+    """
+
+    def __init__(self, parameters: Dict[str, Any]):
+        """
+        :param parameters: arguments of Engine.analyze
+        """
+        self.job_id = uuid.uuid4().hex
+        self.parameters = parameters
+        self.state = "queued"
+        # progress of each stage: {"done": ..., "total": ...}
+        self.stages: Dict[str, Dict[str, int]] = {}
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def progress(self, stage: str, done: int, total: int) -> None:
+        """
+        Record the progress of a stage, called by the analysis (see Engine.analyze)
+        :raise JobCancelled: if the job was cancelled, to stop the analysis
+        """
+        self.stages[stage] = {"done": done, "total": total}
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        """
+        Cancel the job, a running analysis stops at its next step
+        """
+        if self.state in ("done", "failed", "cancelled"):
+            return
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.state = "cancelled"
+            self.finished = time.time()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        State and progress of the job
+        """
+        status = {"job_id": self.job_id, "status": self.state, "stages": {stage: dict(progress) for stage, progress
+                                                                          in list(self.stages.items())},
+                  "submitted": self.submitted, "started": self.started, "finished": self.finished}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobQueue:
+    """
+    Jobs run by a pool of workers of an engine, at most max_queued jobs wait for a worker
+    The finished jobs are kept ttl seconds for their results
+    """
+
+    def __init__(self, engine: Engine, max_workers: int = 2, max_queued: int = 20, ttl: float = 3600):
+        """
+        :param engine: engine analyzing the VDs of the jobs
+        :param max_workers: number of jobs run at the same time
+        :param max_queued: max number of jobs waiting for a worker
+        :param ttl: number of seconds the finished jobs are kept
+        """
+        self.engine = engine
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, **parameters) -> Job:
+        """
+        Queue the analysis of a VD
+        :param parameters: arguments of Engine.analyze
+        :return: the new job
+        :raise queue.Full: if max_queued jobs are already waiting
+        """
+        job = Job(parameters)
+        with self._lock:
+            self._evict()
+            if sum(queued.state == "queued" for queued in self._jobs.values()) >= self.max_queued:
+                raise queue.Full("%s jobs are already waiting" % self.max_queued)
+            self._jobs[job.job_id] = job
+            job.future = self._workers.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job) -> None:
+        if job._cancelled.is_set():
+            job.state, job.finished = "cancelled", time.time()
+            return
+        job.state, job.started = "running", time.time()
+        try:
+            job.result = self.engine.analyze(progress=job.progress, **job.parameters)
+            job.state = "done"
+        except JobCancelled:
+            job.state = "cancelled"
+        except Exception as error:
+            metrics.log_request("job", self.engine.param_conf["log_sample_rate"], error=True, job_id=job.job_id,
+                                message=str(error))
+            job.error = str(error)
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
+            # the text of the VD is not needed anymore
+            job.parameters = None
+
+    def get(self, job_id: str) -> Job:
+        """
+        :param job_id: id of a job
+        :return: the job, KeyError if it does not exist or was evicted
+        """
+        with self._lock:
+            self._evict()
+            return self._jobs[job_id]
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        :param job_id: id of the job to cancel
+        :return: the job, KeyError if it does not exist or was evicted
+        """
+        job = self.get(job_id)
+        job.cancel()
+        return job
+
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting for a worker
+        """
+        with self._lock:
+            return sum(job.state == "queued" for job in self._jobs.values())
+
+    def close(self) -> None:
+        """
+        Cancel the queued jobs and stop the workers once the running jobs are finished
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.state == "queued":
+                job.cancel()
+        self._workers.shutdown(wait=True)
+
+    def _evict(self) -> None:
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and now - job.finished > self.ttl]:
+            del self._jobs[job_id]
@@ -0,0 +1,272 @@
+"""
+Registry of the lexicons of the lexicon detectors (cinema, offensive).
+A lexicon is registered once, the lexicons of the config when the engine starts and the personal lexicons
+when a client uploads them, and its id is the hash of its content. The matchers of the lexicons
+(raw terms indexed with flashtext, see find_voc.build_keyword_processor, terms lemmatized with Stanza indexed on
+their lemmas, see find_voc.lemma_matcher) are built on
+their first use and cached by id, language and lemmatization option: a lexicon is no longer read and
+lemmatized again at each request. The least recently used lexicons and matchers are evicted first,
+the lexicons of the config are kept. The lexicons matched together by an analysis are also indexed in a single
+labeled matcher (see find_voc.matcher, over the lemmas of the words for the lemmatized lexicons), cached as the
+matchers of the lexicons.
+When a directory of prebuilt artifacts is given (see find_voc.artifact), the lemmatized matcher of a lexicon is
+loaded from its artifact instead of lemmatizing the lexicon, if the artifact was built with the same Stanza models
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from flashtext import KeywordProcessor
+import pandas as pd
+
+from find_voc import artifact, find_voc
+from find_voc.fuzzy import ApproximateLemmaMatcher
+from find_voc.matcher import LemmaMatcher, LexiconMatcher
+
+# Key of the id of a registered lexicon in the attributes of its DataFrame (DataFrame.attrs)
+LEXICON_ID_ATTRIBUTE = "lexicon_id"
+
+
+def lexicon_id(content: bytes) -> str:
+    """
+    Id of a lexicon
+    :param content: content of the lexicon file, or its DataFrame as TSV (see dataframe_content)
+    :return: hexadecimal sha256 hash
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def dataframe_content(voc_df: pd.DataFrame) -> bytes:
+    """
+    Content of a lexicon given as a DataFrame, hashed to get its id
+    """
+    return voc_df.to_csv(sep="\t", index=False).encode("utf-8")
+
+
+class LexiconRegistry:
+    """
+    Lexicons by id and their matchers, see the module documentation
+    """
+
+    def __init__(self, max_lexicons: int = 100, max_matchers: int = 32, artifact_dir: str = None,
+                 model_version: str = None):
+        """
+        :param max_lexicons: max number of lexicons kept, without those of the config
+        :param max_matchers: max number of matchers kept (a matcher by lexicon, language and lemmatization option)
+        :param artifact_dir: directory of the prebuilt artifacts of the lexicons, None to always lemmatize them
+        :param model_version: version of the Stanza models lemmatizing the VDs, an artifact of other models is ignored
+        """
+        self.max_lexicons = max_lexicons
+        self.max_matchers = max_matchers
+        self.artifact_dir = artifact_dir
+        self.model_version = model_version
+        self._lexicons = OrderedDict()
+        # lexicons which are never evicted and names of the lexicons (ex: voc_cinema for the one of the config)
+        self._pinned = set()
+        self._names = {}
+        # ids of the lexicon files by (path, modification time, size)
+        self._file_ids = {}
+        self._matchers = OrderedDict()
+        self._lock = threading.Lock()
+        # a matcher is built once even if it is asked by concurrent analyses
+        self._build_locks = defaultdict(threading.Lock)
+        self.counters = {"hits": 0, "misses": 0, "artifacts": 0}
+
+    def register(self, voc_df: pd.DataFrame, name: str = None, pinned: bool = False) -> str:
+        """
+        Register a lexicon
+        :param voc_df: lexicon with a column TERM_FR/FR and/or TERM_EN/EN (see find_voc.load_lexicon)
+        :param name: name of the lexicon, listed by lexicons
+        :param pinned: the lexicon is never evicted
+        :return: id of the lexicon, also kept in the attributes of the DataFrame
+        :raise ValueError: if the lexicon has no column of terms
+        """
+        if not set(voc_df.columns) & {"TERM_FR", "FR", "TERM_EN", "EN"}:
+            raise ValueError("The lexicon has no column TERM_FR, FR, TERM_EN or EN")
+        return self._add(lexicon_id(dataframe_content(voc_df)), voc_df, name, pinned)
+
+    def register_content(self, content: str, name: str = None) -> str:
+        """
+        Register a lexicon sent by a client
+        :param content: TSV content of the lexicon
+        :param name: name of the lexicon
+        :return: id of the lexicon
+        :raise ValueError: if the content is not a TSV lexicon
+        """
+        return self.register(pd.read_csv(io.StringIO(content), sep="\t"), name)
+
+    def register_file(self, path: str, name: str = None, pinned: bool = False) -> str:
+        """
+        Register a lexicon file, the file is read again only if it changed
+        :param path: TSV file of the lexicon
+        :param name: name of the lexicon
+        :param pinned: the lexicon is never evicted
+        :return: id of the lexicon, hash of the content of the file
+        """
+        file_stat = os.stat(path)
+        file_key = (path, file_stat.st_mtime, file_stat.st_size)
+        with self._lock:
+            known_id = self._file_ids.get(file_key)
+        if known_id is not None and self.contains(known_id):
+            return known_id
+
+        with open(path, "rb") as lexicon_file:
+            content = lexicon_file.read()
+        new_id = self._add(lexicon_id(content), pd.read_csv(io.BytesIO(content), sep="\t"), name, pinned)
+        with self._lock:
+            self._file_ids[file_key] = new_id
+        return new_id
+
+    def _add(self, new_id: str, voc_df: pd.DataFrame, name: str, pinned: bool) -> str:
+        voc_df.attrs[LEXICON_ID_ATTRIBUTE] = new_id
+        with self._lock:
+            if new_id not in self._lexicons:
+                self._lexicons[new_id] = voc_df
+            self._lexicons.move_to_end(new_id)
+            if name is not None:
+                self._names[new_id] = name
+            if pinned:
+                self._pinned.add(new_id)
+            self._evict(self._lexicons, self.max_lexicons + len(self._pinned), self._pinned)
+        return new_id
+
+    @staticmethod
+    def _evict(entries: OrderedDict, max_size: int, pinned: set = frozenset()) -> None:
+        # the least recently used entries first
+        for key in list(entries):
+            if len(entries) <= max_size:
+                break
+            if key not in pinned:
+                del entries[key]
+
+    def contains(self, lexicon_id: str) -> bool:
+        with self._lock:
+            return lexicon_id in self._lexicons
+
+    def get(self, lexicon_id: str) -> pd.DataFrame:
+        """
+        Lexicon of an id
+        :raise KeyError: if the id is unknown (or the lexicon was evicted)
+        """
+        with self._lock:
+            if lexicon_id not in self._lexicons:
+                raise KeyError("Unknown lexicon %s" % lexicon_id)
+            self._lexicons.move_to_end(lexicon_id)
+            return self._lexicons[lexicon_id]
+
+    def lexicons(self) -> List[Dict[str, str]]:
+        """
+        Registered lexicons: id and name (None for the anonymous ones)
+        """
+        with self._lock:
+            return [{"id": lexicon_id, "name": self._names.get(lexicon_id)} for lexicon_id in self._lexicons]
+
+    def matcher(self, lexicon_id: str, lang: str, lemmatizing: bool,
+                processor: Callable[[list], list]) -> Union[KeywordProcessor, LemmaMatcher]:
+        """
+        Matcher of a lexicon, built on first use
+        :param lexicon_id: id of a registered lexicon
+        :param lang: FR or EN
+        :param lemmatizing: index the lemmatized terms (True) or the raw terms (False)
+        :param processor: Stanza pipeline (or any callable annotating a list of documents) lemmatizing the terms
+        :return: flashtext index of the raw terms, matcher of the lemmatized terms if lemmatizing
+        :raise KeyError: if the id is unknown
+        :raise ValueError: if the lexicon has no column for the language
+        """
+        key = (lexicon_id, lang, lemmatizing)
+
+        def build() -> Union[KeywordProcessor, LemmaMatcher]:
+            if not lemmatizing:
+                return find_voc.build_keyword_processor(processor, lang, lemmatizing, voc_df=self.get(lexicon_id))
+            lemma_matcher = self._load_artifact(lexicon_id, lang)
+            if lemma_matcher is None:
+                lemma_matcher = find_voc.lemma_matcher(
+                    find_voc.build_keyword_processor(processor, lang, lemmatizing, voc_df=self.get(lexicon_id)))
+            return lemma_matcher
+
+        return self._cached(key, build)
+
+    def labeled_matcher(self, lexicon_ids: Tuple[Tuple[str, str], ...], lang: str, lemmatizing: bool,
+                        processor: Callable[[list], list],
+                        max_distance: int = 0) -> Union[LexiconMatcher, LemmaMatcher]:
+        """
+        Matcher of several lexicons scanned together, built on first use from the matchers of the lexicons
+        :param lexicon_ids: (label, id of a registered lexicon) of each lexicon, the hits are given by label
+        :param lang: FR or EN
+        :param lemmatizing: index the lemmatized terms (True) or the raw terms (False)
+        :param processor: Stanza pipeline lemmatizing the terms (see matcher)
+        :param max_distance: max edit distance of the approximate matching of the lemmatized terms
+            (see find_voc.fuzzy), 0 for the exact matching
+        :return: labeled matcher of the lexicons, over the lemmas of the words if lemmatizing
+        :raise KeyError: if an id is unknown
+        :raise ValueError: if a lexicon has no column for the language
+        """
+        def build() -> Union[LexiconMatcher, LemmaMatcher]:
+            if not lemmatizing:
+                labeled_matcher = LexiconMatcher()
+            elif max_distance:
+                labeled_matcher = ApproximateLemmaMatcher(max_distance)
+            else:
+                labeled_matcher = LemmaMatcher()
+            for label, lexicon_id in lexicon_ids:
+                if lemmatizing:
+                    labeled_matcher.add_matcher(label, self.matcher(lexicon_id, lang, lemmatizing, processor))
+                else:
+                    labeled_matcher.add_keyword_processor(label,
+                                                          self.matcher(lexicon_id, lang, lemmatizing, processor))
+            return labeled_matcher
+
+        return self._cached((tuple(lexicon_ids), lang, lemmatizing, max_distance if lemmatizing else 0), build)
+
+    def _cached(self, key: tuple, build: Callable[[], object]):
+        # matcher of the cache, built once even if it is asked by concurrent analyses
+        with self._lock:
+            if key in self._matchers:
+                self._matchers.move_to_end(key)
+                self.counters["hits"] += 1
+                return self._matchers[key]
+
+        with self._build_lock(key):
+            with self._lock:
+                if key in self._matchers:
+                    self.counters["hits"] += 1
+                    return self._matchers[key]
+                self.counters["misses"] += 1
+            built = build()
+            with self._lock:
+                self._matchers[key] = built
+                self._evict(self._matchers, self.max_matchers)
+                self._build_locks.pop(key, None)
+        return built
+
+    def _load_artifact(self, lexicon_id: str, lang: str) -> Optional[LemmaMatcher]:
+        # None if there is no usable artifact, the lexicon is then lemmatized
+        if self.artifact_dir is None:
+            return None
+        # an unknown id raises KeyError even if its artifact exists
+        self.get(lexicon_id)
+        lemma_matcher = artifact.load_lemma_matcher(
+            artifact.artifact_path(self.artifact_dir, lexicon_id, lang), lexicon_id, lang, self.model_version)
+        if lemma_matcher is not None:
+            with self._lock:
+                self.counters["artifacts"] += 1
+        return lemma_matcher
+
+    def _build_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._build_locks[key]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Counters of the cache of the matchers
+        :return: hits, misses, matchers loaded from artifacts, number of lexicons and of matchers and hit rate
+        """
+        with self._lock:
+            stats = dict(self.counters, lexicons=len(self._lexicons), size=len(self._matchers))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.
+
+        return stats
@@ -0,0 +1,121 @@
+"""
+Prometheus metrics and structured logs of the analyses.
+The durations of the stages of an analysis (language detection, Stanza annotation, each detector,
+emotion round trip, serialization, compression) and the sizes of the responses are histograms,
+the lines, tokens, bytes serialized and errors are counters,
+the models loaded, the jobs waiting and the caches are read from the engine when the metrics are scraped.
+The requests are logged as one JSON line without their text, only a sample of them
+(the errors are always logged)
+"""
+import json
+import random
+import time
+from typing import Any, Dict, Iterable
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+# Sizes of the responses from 1KB to 100MB
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+# Durations from 1ms to 5 minutes, the annotation and the emotions of a film take minutes
+STAGE_BUCKETS = (.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_DURATION = Histogram("vdqual_stage_duration_seconds", "Duration of the stages of the analyses",
+                           ["stage"], buckets=STAGE_BUCKETS)
+LINES = Counter("vdqual_lines", "Lines of VD analyzed")
+TOKENS = Counter("vdqual_tokens", "Tokens of VD analyzed")
+ERRORS = Counter("vdqual_errors", "Errors by source (endpoint or stage) and kind", ["source", "kind"])
+REQUESTS = Counter("vdqual_requests", "Requests by endpoint", ["endpoint"])
+RESPONSE_BYTES = Histogram("vdqual_response_bytes", "Size of the JSON responses sent, by encoding",
+                           ["encoding"], buckets=SIZE_BUCKETS)
+SERIALIZED_BYTES = Counter("vdqual_serialized_bytes", "Size of the JSON responses before compression")
+
+
+def observe(stage: str, duration: float) -> None:
+    """
+    Record the duration of a stage
+    :param stage: name of the stage (ex: annotation, duplication, serialization)
+    :param duration: duration in seconds
+    """
+    STAGE_DURATION.labels(stage).observe(duration)
+
+
+def count_documents(docs: Iterable) -> None:
+    """
+    Count the lines and the tokens of the annotated Stanza documents of a VD
+    """
+    num_lines = 0
+    num_tokens = 0
+    for doc in docs:
+        num_lines += 1
+        num_tokens += sum(len(sentence.tokens) for sentence in doc.sentences)
+    LINES.inc(num_lines)
+    TOKENS.inc(num_tokens)
+
+
+class EngineCollector:
+    """
+    Gauges read from an engine (and its job queue and sessions) when the metrics are scraped
+    """
+
+    def __init__(self, engine, jobs=None, sessions=None):
+        self.engine = engine
+        self.jobs = jobs
+        self.sessions = sessions
+
+    def collect(self):
+        models = GaugeMetricFamily("vdqual_loaded_models", "Models loaded by kind", labels=["kind"])
+        for kind, count in self.engine.loaded_models().items():
+            models.add_metric([kind], count)
+        yield models
+
+        if self.jobs is not None:
+            yield GaugeMetricFamily("vdqual_queue_depth", "Jobs waiting for a worker", value=self.jobs.queue_depth())
+        if self.sessions is not None:
+            yield GaugeMetricFamily("vdqual_sessions", "Editing sessions open", value=len(self.sessions))
+
+        caches = {"annotation": self.engine.annotation_cache, "lexicon": self.engine.lexicons}
+        if self.engine.result_cache is not None:
+            caches["result"] = self.engine.result_cache
+        hit_rate = GaugeMetricFamily("vdqual_cache_hit_rate", "Hit rate of the caches", labels=["cache"])
+        lookups = CounterMetricFamily("vdqual_cache_lookups", "Lookups of the caches by result",
+                                      labels=["cache", "result"])
+        for name, cache in caches.items():
+            stats = cache.stats()
+            hit_rate.add_metric([name], stats["hit_rate"])
+            for result in ("hits", "memory_hits", "disk_hits", "misses"):
+                if result in stats:
+                    lookups.add_metric([name, result], stats[result])
+        yield hit_rate
+        yield lookups
+
+
+def register_engine(engine, jobs=None, sessions=None) -> None:
+    """
+    Expose the gauges of an engine in the metrics
+    """
+    REGISTRY.register(EngineCollector(engine, jobs, sessions))
+
+
+def metrics_response():
+    """
+    Metrics in the text format of Prometheus
+    :return: body and content type of the response
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def log_request(endpoint: str, sample_rate: float, error: bool = False, **fields: Any) -> None:
+    """
+    Log a request as one JSON line, only a sample of the requests is logged (always the errors)
+    :param endpoint: name of the endpoint
+    :param sample_rate: fraction of the requests logged (0 to 1)
+    :param error: True if the request failed
+    :param fields: details of the request (ex: number of lines, features), not its text
+    """
+    if not error and random.random() >= sample_rate:
+        return
+    record: Dict[str, Any] = {"time": round(time.time(), 3), "endpoint": endpoint, "error": error}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str))
@@ -0,0 +1,197 @@
+"""
+On-demand profiling of an analysis.
+Only the analyses asked to be profiled go through a profiler, the others run as usual:
+ - deterministic: cProfile on the thread of the analysis (the detectors are then run in this thread),
+   exact number of calls and times of each function
+ - sampling: the stacks of all the threads of the process are read at regular intervals,
+   low overhead and the threads of the executor and of the emotion request are included
+The profile holds the collapsed stacks ("frame;frame;frame value" by line, the input of flamegraph.pl
+or speedscope) and the cumulative and self times of the functions
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+PROFILE_MODES = ("deterministic", "sampling")
+
+# Number of functions given in the profile, by cumulative time
+MAX_FUNCTIONS = 50
+
+# Innermost functions of the threads waiting for work (pools, Flask server), these threads are not sampled
+IDLE_FUNCTIONS = {("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker"),
+                  ("selectors.py", "select"), ("socketserver.py", "serve_forever")}
+
+# The calls shorter than this number of seconds are not in the stacks of the deterministic profiles
+MIN_STACK_TIME = 1e-5
+
+
+def _function_name(filename: str, line: int, name: str) -> str:
+    # the two last parts of the path are enough to find a file of the tool or of a library
+    short_path = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return "%s:%s(%s)" % (short_path, line, name)
+
+
+def _collapse(stacks: Dict[Tuple[str, ...], float]) -> str:
+    return "\n".join("%s %d" % (";".join(stack), value) for stack, value in sorted(stacks.items()) if value >= 1)
+
+
+def _deterministic_profile(profiler: cProfile.Profile) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Collapsed stacks and functions of a cProfile profile
+    cProfile keeps the callers of each function and not the stacks, the stacks are rebuilt from the roots
+    by sharing the time of each function between its callees as the profile does (flameprof method)
+    """
+    stats = pstats.Stats(profiler).stats
+    callees: Dict[tuple, Dict[tuple, tuple]] = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[function] = edge
+
+    stacks: Dict[Tuple[str, ...], float] = Counter()
+
+    def walk(function: tuple, stack: Tuple[str, ...], cumulative_time: float) -> None:
+        _, _, self_time, total_time, _ = stats[function]
+        scale = cumulative_time / total_time if total_time else 0.
+        stack = stack + (_function_name(*function),)
+        # times in microseconds
+        stacks[stack] += self_time * scale * 1e6
+        for callee, (_, _, _, edge_time) in callees.get(function, {}).items():
+            # recursive calls are already counted in the time of the function
+            if _function_name(*callee) not in stack and edge_time * scale >= MIN_STACK_TIME:
+                walk(callee, stack, edge_time * scale)
+
+    for function, (_, _, _, total_time, callers) in stats.items():
+        if not callers:
+            walk(function, (), total_time)
+
+    functions = [{"function": _function_name(*function), "calls": calls, "self_time": self_time,
+                  "cumulative_time": total_time}
+                 for function, (_, calls, self_time, total_time, _) in stats.items()]
+    return _collapse(stacks), functions
+
+
+class SamplingProfiler:
+    """
+    Reads the stacks of the threads of the process every interval seconds in a background thread
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self.start_time = None
+        self.duration = 0.
+        self.stacks: Dict[Tuple[str, ...], int] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def _sample(self) -> None:
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._thread.ident or (os.path.basename(frame.f_code.co_filename),
+                                                       frame.f_code.co_name) in IDLE_FUNCTIONS:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_function_name(frame.f_code.co_filename, frame.f_code.co_firstlineno,
+                                                frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self.start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.start_time
+
+    def profile(self) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Collapsed stacks (in number of samples) and functions (times estimated from the samples)
+        """
+        # the samples are late when the analysis holds the GIL, a sample stands for its share of the duration
+        sample_time = self.duration / self.samples if self.samples else 0.
+        cumulative = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            # a recursive function is counted once by sample
+            for function in set(stack[1:]):
+                cumulative[function] += count
+            own[stack[-1]] += count
+
+        functions = [{"function": function, "samples": count, "self_time": own[function] * sample_time,
+                      "cumulative_time": count * sample_time} for function, count in cumulative.items()]
+        return _collapse(self.stacks), functions
+
+
+def profile_call(function: Callable, mode: str = "sampling", interval: float = 0.005,
+                 directory: str = None) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Call a function under a profiler
+    :param function: function without arguments to profile (ex: partial of Engine.analyze)
+    :param mode: deterministic or sampling (see PROFILE_MODES)
+    :param interval: number of seconds between 2 samples (sampling mode)
+    :param directory: directory where the profile is also written (<id>.collapsed and <id>.json), not written if None
+    :return: result of the function and profile
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError("Unknown profiling mode \"%s\" (%s)" % (mode, ", ".join(PROFILE_MODES)))
+
+    start_time = time.perf_counter()
+    if mode == "deterministic":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function)
+        duration = time.perf_counter() - start_time
+        collapsed, functions = _deterministic_profile(profiler)
+        profile = {"mode": mode, "unit": "microseconds"}
+    else:
+        sampler = SamplingProfiler(interval)
+        sampler.start()
+        try:
+            result = function()
+        finally:
+            sampler.stop()
+        duration = time.perf_counter() - start_time
+        collapsed, functions = sampler.profile()
+        profile = {"mode": mode, "unit": "samples", "interval": interval, "samples": sampler.samples}
+
+    functions.sort(key=lambda function_stats: function_stats["cumulative_time"], reverse=True)
+    profile.update({"profile_id": uuid.uuid4().hex, "duration": duration, "functions": functions[:MAX_FUNCTIONS],
+                    "collapsed": collapsed})
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile["profile_id"])
+        with open(path + ".collapsed", "w", encoding="utf-8") as collapsed_file:
+            collapsed_file.write(collapsed + "\n")
+        with open(path + ".json", "w", encoding="utf-8") as profile_file:
+            json.dump(profile, profile_file, ensure_ascii=False)
+        profile["path"] = path
+
+    return result, profile
+
+
+def profile_analysis(engine, mode: str = "sampling", **parameters) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Analyze a VD under a profiler, without the result cache, the detectors are run in the thread
+    of the analysis in deterministic mode
+    :param engine: engine analyzing the VD
+    :param mode: deterministic or sampling (see PROFILE_MODES)
+    :param parameters: arguments of Engine.analyze
+    :return: output of the analysis and profile
+    """
+    return profile_call(lambda: engine.analyze(use_cache=False, sequential=mode == "deterministic", **parameters),
+                        mode, engine.param_conf["profile_interval"], engine.param_conf["profile_dir"])
@@ -0,0 +1,269 @@
+"""
+Cache of the results of the analyses.
+A result is identified by a canonical hash of the normalized text of the VD, of the parameters
+of the enabled features, of the contents of the lexicons and of the versions of the models,
+so that an analysis already done is given back without computing anything.
+The results are kept in a backend with a time to live and a max size:
+ - MemoryBackend: LRU dictionary of the process
+ - DiskBackend: directory shared by the processes (and kept between restarts)
+ - RedisBackend: Redis server (or any client with the get/set/exists/delete methods of redis-py)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Version of the format of the results, to change when the output of an analysis changes
+RESULT_FORMAT_VERSION = "1"
+
+# Values of the tokens which are tuples in the output of an analysis (lists once read from JSON), by feature
+TUPLE_VALUES = {"tense_notpresent": ("ref_token",)}
+
+
+def result_key(description: Dict[str, Any]) -> str:
+    """
+    Content address of a result
+    :param description: everything the result depends on (text, parameters, lexicons, models), JSON serializable
+    :return: hexadecimal sha256 hash of its canonical JSON (sorted keys, no spaces)
+    """
+    canonical = json.dumps(dict(description, format=RESULT_FORMAT_VERSION), sort_keys=True,
+                           separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def restore_tuples(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Give back to a result read from JSON the tuples of the output of an analysis (see TUPLE_VALUES)
+    :param result: output of an analysis read from JSON, modified
+    :return: the result
+    """
+    for document in result.get("documents", []):
+        for feature, keys in TUPLE_VALUES.items():
+            for token in document.get("features", {}).get(feature, []):
+                for key in keys:
+                    if isinstance(token["token"].get(key), list):
+                        token["token"][key] = tuple(token["token"][key])
+    return result
+
+
+class MemoryBackend:
+    """
+    Results kept in the memory of the process, the least recently used are evicted first
+    """
+
+    def __init__(self, max_size: int = 1000):
+        """
+        :param max_size: max number of results
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            expiry, value = self._entries[key]
+            if expiry is not None and expiry < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def exists(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DiskBackend:
+    """
+    Results kept in a directory, one file by result, the oldest files are evicted first
+    """
+
+    def __init__(self, directory: str, max_size: int = 1000):
+        """
+        :param directory: directory of the results
+        :param max_size: max number of results
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(len(files) for _, _, files in os.walk(self.directory))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as result_file:
+                expiry = float(result_file.readline())
+                value = result_file.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if expiry and expiry < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        if self.max_size <= 0:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        is_new = not os.path.isfile(path)
+        # write then rename, so that a result is never read half written
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as result_file:
+            result_file.write(b"%f\n" % (time.time() + ttl if ttl else 0))
+            result_file.write(value)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._size += is_new
+            if self._size > self.max_size:
+                self._evict()
+
+    def exists(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= 1
+
+    def _evict(self) -> None:
+        # the oldest results are removed down to 90% of the max size, to not scan the directory at each result
+        paths = sorted((os.path.join(root, name) for root, _, files in os.walk(self.directory) for name in files
+                        if not name.endswith(".tmp")), key=os.path.getmtime)
+        for path in paths[:max(0, len(paths) - int(self.max_size * 0.9))]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = sum(len(files) for _, _, files in os.walk(self.directory))
+
+
+class RedisBackend:
+    """
+    Results kept in a Redis server, the eviction is done by Redis (time to live of the keys, maxmemory policy)
+    """
+
+    def __init__(self, client, prefix: str = "vdqual:result:"):
+        """
+        :param client: redis.Redis client or any object with the same get, set (with ex), exists and delete methods
+        :param prefix: prefix of the keys in Redis
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def exists(self, key: str) -> bool:
+        return bool(self.client.exists(self.prefix + key))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+
+class ResultCache:
+    """
+    Results of the analyses stored as JSON in a backend
+    """
+
+    def __init__(self, backend, ttl: float = None):
+        """
+        :param backend: MemoryBackend, DiskBackend, RedisBackend or any object with the same methods
+        :param ttl: number of seconds a result is kept, without limit if None
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        :param key: content address of the result (see result_key)
+        :return: the result with the same types as the output of the analysis, None if it is not in the cache
+        """
+        value = self.backend.get(key)
+        with self._lock:
+            self.counters["hits" if value is not None else "misses"] += 1
+        return None if value is None else restore_tuples(json.loads(value))
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """
+        :param key: content address of the result (see result_key)
+        :param result: output of the analysis
+        """
+        self.backend.set(key, json.dumps(result, ensure_ascii=False).encode("utf-8"), self.ttl)
+
+    def contains(self, key: str) -> bool:
+        """
+        :param key: content address of the result (see result_key)
+        :return: True if the result is in the cache
+        """
+        return self.backend.exists(key)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Counters of the cache
+        :return: hits, misses and hit rate
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.
+
+        return stats
+
+
+def make_result_cache(param_conf: dict) -> Optional[ResultCache]:
+    """
+    Result cache of the config
+    :param param_conf: config of the tool (see load_config)
+    :return: the cache, None if the results are not cached
+    """
+    backend = param_conf["result_cache"]
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return ResultCache(MemoryBackend(param_conf["result_cache_size"]), param_conf["result_cache_ttl"])
+    if backend == "disk":
+        if not param_conf["result_cache_dir"]:
+            raise ValueError("The disk result cache needs a result_cache_dir")
+        return ResultCache(DiskBackend(param_conf["result_cache_dir"], param_conf["result_cache_size"]),
+                           param_conf["result_cache_ttl"])
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis result cache needs the redis package (pip install redis)")
+        return ResultCache(RedisBackend(redis.Redis.from_url(param_conf["result_cache_url"])),
+                           param_conf["result_cache_ttl"])
+
+    raise ValueError("Unknown result cache \"%s\" (none, memory, disk or redis)" % backend)
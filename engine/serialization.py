@@ -0,0 +1,66 @@
+"""
+Serialization and compression of the JSON responses.
+The outputs are serialized with orjson when it is installed (several times faster than the json module on the
+nested dictionaries of the results, json otherwise) and compressed with the best encoding accepted by
+the client in its Accept-Encoding header (zstd if the zstandard package is installed, or gzip),
+the small responses are not compressed
+"""
+import gzip
+import json
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodings by order of preference
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# Responses smaller than this number of bytes are not compressed, the headers would cost more than the gain
+MIN_COMPRESSED_SIZE = 1024
+
+# Compression levels: fast levels, the responses are compressed at each request
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+def _default(value: Any) -> Any:
+    # types of the outputs unknown to the JSON serializers (ex: sets, numpy numbers)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+def dumps(output: Any) -> bytes:
+    """
+    Serialize an output in compact UTF-8 JSON
+    :param output: JSON serializable output (the keys which are not strings are converted)
+    :return: JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(output, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(output, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    """
+    :param body: response to compress
+    :param encoding: gzip, zstd or None (body returned as is)
+    :return: compressed body
+    """
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding is None:
+        return body
+    raise ValueError("Unsupported encoding \"%s\" (%s)" % (encoding, ", ".join(ENCODINGS)))
+
@@ -0,0 +1,381 @@
+"""
+Incremental analysis sessions for the live edition of a VD.
+A session keeps the annotations and the results of a VD. The edits of lines (insert, replace, delete)
+are applied to it and only what they can change is computed again:
+ - the edited lines are the only ones annotated and checked by the features of a single line
+   (length, cinema, offensive and the personal lexicons, tense_notpresent, person, emotions)
+ - the duplication is computed again on the lines sharing a window with an edited line
+ - the coreference is computed again on each group of edited lines and coref_context lines around it, from
+   the first edited line: the chains of the lines before it are continued (see engine.stream._continue_chains)
+   and a chain starting at a mention already in a chain keeps its id. The chains are found with coref_context
+   more lines after the group, the mentions after the group keep their chains
+The ids of the lemmas of the duplication are kept between the edits, they identify the same lemma in all the
+results of the session but are not those of a complete analysis (given in order of appearance in the VD)
+"""
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from stanza import Document
+
+from modules import check_length_table, record_outputs
+from duplication import duplication
+from tense_notpresent import tense_notpresent
+from person import person
+from engine.engine import Engine, LEXICONS_TASK, SUPPORTED_LANGUAGES, feature_order, plan_processors, \
+    normalize_text, select_features, split_lexicon_results, split_lines, _check_lexicons, _flag_coref_chains, \
+    _timed_call
+from engine.stream import _continue_chains
+from engine.token_table import TokenTable
+
+# Features computed on each line independently of the others
+LINE_FEATURES = ("length", "cinema", "offensive", "tense_notpresent", "person")
+
+EDIT_ACTIONS = ("insert", "replace", "delete")
+
+
+def _merge_ranges(positions: Iterable[int], margin: int, num_lines: int) -> List[Tuple[int, int]]:
+    """
+    Ranges of lines within a margin of the given positions, the overlapping ranges are merged
+    :param positions: indices of lines
+    :param margin: number of lines added before and after each position
+    :param num_lines: number of lines of the VD
+    :return: list of (first line, last line + 1)
+    """
+    ranges = []
+    for position in sorted(set(positions)):
+        start, end = max(0, position - margin), min(num_lines, position + margin + 1)
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+class AnalysisSession:
+    """
+    Results of a VD kept up to date with the edits of its lines
+    """
+
+    def __init__(self, engine: Engine, text: str, max_length: int, seuil_duplication: int,
+                 window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
+                 max_coref_length: int, with_emotion: bool,
+                 voc_cinema_df: pd.DataFrame = None, voc_offensant_df: pd.DataFrame = None,
+                 features: Iterable[str] = None, coref_context: int = 10, lexicons: Dict[str, pd.DataFrame] = None):
+        """
+        Analyze the VD which is then edited, the parameters are those of Engine.analyze
+        :param coref_context: number of lines around the edited lines on which the coreference is computed again
+        """
+        self.session_id = uuid.uuid4().hex
+        self.engine = engine
+        self.max_length = max_length
+        self.seuil_duplication = seuil_duplication
+        self.window_duplication = window_duplication
+        self.postag_repetition = postag_repetition
+        self.lemmatizing = lemmatizing
+        self.strict_mode = strict_mode
+        self.max_coref_length = max_coref_length
+        self.coref_context = coref_context
+        self.features = select_features(features, with_emotion)
+        self.last_use = time.time()
+        self._lock = threading.Lock()
+
+        text = normalize_text(text)
+        self.lang = engine.detect_language(text)
+        self.lines, clean_text = split_lines(text)
+        self.clean_lines = clean_text.split("\n")
+        if not clean_text:
+            raise ValueError("No input text was specified")
+        if self.lang not in SUPPORTED_LANGUAGES:
+            raise ValueError("Only the English and French languages are supported")
+
+        self.processors = plan_processors(self.features, lemmatizing, lexicons or ())
+
+        # The lexicons are taken once from the registry of the engine for the whole session
+        self.lexicon_sources = engine.lexicon_sources(self.features, voc_cinema_df, voc_offensant_df, lexicons)
+        self.matcher = engine.lexicon_matcher(self.lang, lemmatizing, self.lexicon_sources) \
+            if self.lexicon_sources else None
+
+        # ids of the lemmas of the duplication, kept between the edits
+        self.dic_lemme = {}
+        # next id of coreference chain, the new chains computed again after an edit get new ids
+        self.next_chain_id = 0
+        # chain and number in this chain of the coreference mentions of each line, by (start, end)
+        self.chain_mentions: List[Dict[tuple, tuple]] = [{} for _ in self.lines]
+
+        self.docs = self._annotate(self.lines)
+        # result of each feature for each line, None when the feature has no result for the line
+        self.results = {feature: [None] * len(self.lines) for feature in feature_order(lexicons or ())
+                        if feature in self.features or feature in self.lexicon_sources}
+        self._compute(set(range(len(self.lines))), [], len(self.lines))
+
+    def _annotate(self, lines: List[str]) -> List[Document]:
+        docs = [Document([], text=line) for line in lines]
+        if self.processors and docs:
+            docs = self.engine.annotate(self.lang, self.processors, docs)
+        return docs
+
+    def _line_tasks(self, positions: List[int]) -> Dict[str, tuple]:
+        """
+        Detectors of the features of a single line, applied to the given lines
+        """
+        table = TokenTable.from_docs(self.docs[position] for position in positions)
+        tasks = {}
+        if "length" in self.features:
+            tasks["length"] = (check_length_table, (table, self.max_length))
+        if self.matcher is not None:
+            tasks[LEXICONS_TASK] = (_check_lexicons, (table, self.lang, self.lemmatizing, self.lexicon_sources, None,
+                                                      self.matcher))
+        if "tense_notpresent" in self.features:
+            tasks["tense_notpresent"] = (tense_notpresent.detect_non_present_tense_table, (table, self.strict_mode))
+        if "person" in self.features:
+            tasks["person"] = (person.detect_non_third_person_table, (table,))
+        return tasks
+
+    def _compute(self, new_positions: set, boundaries: List[int], previous_num_lines: int) -> Dict[str, float]:
+        """
+        Compute the results which can have changed
+        :param new_positions: lines which are new (inserted or replaced)
+        :param boundaries: lines next to a deleted line
+        :param previous_num_lines: number of lines before the edits
+        :return: durations of the detectors
+        """
+        num_lines = len(self.lines)
+        changed = new_positions | {position for position in boundaries if 0 <= position < num_lines}
+        new_positions = sorted(new_positions)
+
+        if "emotions" in self.features and new_positions:
+            emotion_dispatch_time = time.perf_counter()
+            emotion_future = self.engine.dispatch_emotions([self.lines[position] for position in new_positions],
+                                                           self.lang)
+
+        tasks = {}
+        if new_positions:
+            tasks.update(self._line_tasks(new_positions))
+
+        # The duplication of a line depends on the lines within 2 windows of it
+        # the ranges computed again are widened so that each line keeps all the windows it belongs to
+        # when the window covers the whole VD (before or after the edits), the duplication is computed on all of it
+        span = self.window_duplication
+        duplication_ranges = []
+        if "duplication" in self.features and changed:
+            if min(num_lines, previous_num_lines) <= 2 * span + 1:
+                duplication_ranges = [(0, num_lines, 0, num_lines)]
+            else:
+                for start, end in _merge_ranges(changed, 2 * span, num_lines):
+                    context_start, context_end = max(0, start - 2 * span), min(num_lines, end + 2 * span)
+                    if context_end - context_start <= 2 * span + 1:
+                        context_end = min(num_lines, context_start + 2 * span + 2)
+                    duplication_ranges.append((start, end, context_start, context_end))
+            for i, (_, _, context_start, context_end) in enumerate(duplication_ranges):
+                tasks[("duplication", i)] = (duplication.check_duplication,
+                                             (self.docs[context_start:context_end], self.seuil_duplication,
+                                              span, self.postag_repetition, self.dic_lemme))
+
+        # The coreference is computed again on each group of edited lines with the lines around it,
+        # from the first edited line of the group
+        coref_ranges = []
+        if "coref" in self.features and changed:
+            engine = None if self.engine.param_conf["executor"] == "process" else self.engine
+            for start, end in _merge_ranges(changed, self.coref_context, num_lines):
+                coref_ranges.append((min(position for position in changed if start <= position < end), start, end))
+                window_end = min(num_lines, end + self.coref_context)
+                tasks[("coref", len(coref_ranges) - 1)] = (_flag_coref_chains, (
+                    "\n".join(self.clean_lines[start:window_end]), self.docs[start:window_end], self.lang,
+                    self.max_coref_length, engine, None, False))
+
+        # the ids of the lemmas are shared by the duplication ranges, they are computed one after another
+        duplication_tasks = {key: tasks.pop(key) for key in list(tasks)
+                             if isinstance(key, tuple) and key[0] == "duplication"}
+        outputs, timings = self.engine.run_detectors(tasks)
+        outputs = split_lexicon_results(outputs)
+        for key, (function, args) in duplication_tasks.items():
+            outputs[key], timings[key] = _timed_call(function, args)
+
+        for feature in LINE_FEATURES + tuple(self.lexicon_sources):
+            if feature in outputs:
+                for i, position in enumerate(new_positions):
+                    self.results[feature][position] = outputs[feature].get(i)
+
+        for i, (start, end, context_start, _) in enumerate(duplication_ranges):
+            output = outputs[("duplication", i)]
+            for position in range(start, end):
+                self.results["duplication"][position] = output.get(position - context_start)
+
+        for i, (first, start, end) in enumerate(coref_ranges):
+            # the mentions already in a chain continue it, or give its id to the chains starting at them
+            chain_ids = {(position, ) + key: mention
+                         for position in range(start, min(num_lines, end + self.coref_context))
+                         for key, mention in self.chain_mentions[position].items()}
+            output, self.next_chain_id = _continue_chains(outputs[("coref", i)], start, first, end, chain_ids,
+                                                          self.next_chain_id, self.max_coref_length)
+            for position in range(first, end):
+                self.results["coref"][position] = output.get(position - first, [])
+                keys = [(token["token"]["offset_start"], token["token"]["offset_end"])
+                        for token in outputs[("coref", i)].get(position - start, [])]
+                self.chain_mentions[position] = {key: chain_ids[(position, ) + key] for key in keys}
+
+        if "emotions" in self.features and new_positions:
+            emotions, timings["emotions"] = self.engine.wait_emotions(emotion_future, emotion_dispatch_time,
+                                                                      self.lang)
+            for i, position in enumerate(new_positions):
+                self.results["emotions"][position] = emotions.get(i)
+
+        durations = {}
+        for key, duration in timings.items():
+            feature = str(key[0]) if isinstance(key, tuple) else key
+            durations[feature] = durations.get(feature, 0.) + duration
+        return durations
+
+    def _record(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        """
+        Output of the given lines, in the format of the documents of record_outputs
+        """
+        positions = list(positions)
+        docs = [self.docs[position] for position in positions]
+        results = {feature: {i: values[position] for i, position in enumerate(positions)
+                             if values[position] is not None}
+                   for feature, values in self.results.items()}
+        documents = record_outputs(docs, results)["documents"]
+        for document, position in zip(documents, positions):
+            document["id"] = position
+        return documents
+
+    def output(self) -> Dict[str, Any]:
+        """
+        Output of the whole VD, in the format of Engine.analyze
+        """
+        with self._lock:
+            self.last_use = time.time()
+            return {"session_id": self.session_id, "documents": self._record(range(len(self.lines)))}
+
+    def edit(self, edits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Apply edits to the lines of the VD, one after another
+        :param edits: list of edits {"action": "insert", "replace" or "delete", "line": index of the line
+        in the VD edited by the previous edits, "text": text of the line (insert and replace)}
+        :return: number of lines of the VD and output of the lines whose results changed
+        (the lines after an insertion or a deletion are shifted by the client)
+        :raise ValueError: if the edits are not a list of edits or an edit is invalid
+        """
+        if not isinstance(edits, list) or not all(isinstance(edit, dict) for edit in edits):
+            raise ValueError("The edits must be a list of objects")
+
+        with self._lock:
+            self.last_use = time.time()
+            start_time = time.perf_counter()
+
+            # index of each line before the edits, None for the new lines
+            origins: List[Optional[int]] = list(range(len(self.lines)))
+            lines = list(self.lines)
+            clean_lines = list(self.clean_lines)
+            deletions = []
+            for edit in edits:
+                action, position = edit.get("action"), int(edit.get("line", -1))
+                if action not in EDIT_ACTIONS:
+                    raise ValueError("Unknown edit action \"%s\" (%s)" % (action, ", ".join(EDIT_ACTIONS)))
+                if not 0 <= position <= len(lines) - (action != "insert"):
+                    raise ValueError("Line %s does not exist" % position)
+                if action == "delete":
+                    del origins[position], lines[position], clean_lines[position]
+                    deletions = [deleted if deleted < position else deleted - 1 for deleted in deletions] + [position]
+                    continue
+
+                line, clean_line = split_lines(normalize_text(str(edit.get("text", ""))).replace("\n", " "))
+                if action == "insert":
+                    origins.insert(position, None)
+                    lines.insert(position, line[0])
+                    clean_lines.insert(position, clean_line)
+                    deletions = [deleted if deleted < position else deleted + 1 for deleted in deletions]
+                else:
+                    origins[position] = None
+                    lines[position] = line[0]
+                    clean_lines[position] = clean_line
+
+            if not lines or not "\n".join(clean_lines):
+                raise ValueError("No input text was specified")
+
+            # The lines kept and their results are moved to their new positions
+            new_positions = {position for position, origin in enumerate(origins) if origin is None}
+            new_docs = self._annotate([lines[position] for position in sorted(new_positions)])
+            old_docs, old_results = self.docs, self.results
+            annotated = dict(zip(sorted(new_positions), new_docs))
+            self.lines, self.clean_lines = lines, clean_lines
+            self.docs = [annotated[position] if origin is None else old_docs[origin]
+                         for position, origin in enumerate(origins)]
+            self.results = {feature: [None if origin is None else values[origin] for origin in origins]
+                            for feature, values in old_results.items()}
+            self.chain_mentions = [{} if origin is None else self.chain_mentions[origin] for origin in origins]
+
+            # the lines around a deletion are now next to each other
+            boundaries = [line for position in deletions for line in (position - 1, position)]
+            timings = self._compute(new_positions, boundaries, len(old_docs))
+
+            changed = [position for position, origin in enumerate(origins)
+                       if origin is None or any(self.results[feature][position] != old_results[feature][origin]
+                                                for feature in self.results)]
+            timings["total"] = time.perf_counter() - start_time
+
+            return {"session_id": self.session_id, "num_lines": len(self.lines),
+                    "documents": self._record(changed), "timings": timings}
+
+
+class SessionRegistry:
+    """
+    Sessions opened on an engine, the sessions unused for ttl seconds or beyond max_sessions are closed
+    """
+
+    def __init__(self, engine: Engine, max_sessions: int = 100, ttl: float = 3600):
+        """
+        :param engine: engine analyzing the VDs of the sessions
+        :param max_sessions: max number of sessions kept, the least recently used are closed first
+        :param ttl: number of seconds after which an unused session is closed
+        """
+        self.engine = engine
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: Dict[str, AnalysisSession] = {}
+        self._lock = threading.Lock()
+
+    def open(self, **parameters) -> AnalysisSession:
+        """
+        Open a session on a VD
+        :param parameters: parameters of AnalysisSession
+        :return: the new session
+        """
+        session = AnalysisSession(self.engine, **parameters)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict()
+        return session
+
+    def get(self, session_id: str) -> AnalysisSession:
+        """
+        :param session_id: id of an open session
+        :return: the session, KeyError if it does not exist or was closed
+        """
+        with self._lock:
+            self._evict()
+            return self._sessions[session_id]
+
+    def close(self, session_id: str) -> None:
+        """
+        :param session_id: id of the session to close
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self) -> None:
+        now = time.time()
+        for session_id in [session_id for session_id, session in self._sessions.items()
+                           if now - session.last_use > self.ttl]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            oldest = min(self._sessions.values(), key=lambda session: session.last_use)
+            del self._sessions[oldest.session_id]
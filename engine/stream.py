@@ -0,0 +1,209 @@
+"""
+Streaming analysis of long VDs (feature films of thousands of lines).
+The VD is analyzed by chunks of lines and the output of each line is given as soon as it is final,
+only the annotations of the current chunk and of the lines around it are kept in memory:
+ - the features of a single line are computed on the lines of the chunk
+ - the duplication of the lines of the chunk is computed with the 2 windows of lines around them,
+   the lines of these windows after the chunk are annotated in advance
+ - the coreference is computed on the chunk with coref_context lines before it, a chain continued in the chunk
+   keeps its id and its mentions are counted and split from those of the previous chunks (see _continue_chains)
+"""
+import time
+from typing import Any, Dict, Iterable, Iterator, List
+
+import pandas as pd
+from stanza import Document
+
+from modules import record_outputs
+from duplication import duplication
+from engine.engine import CONFIG_LEXICONS, Engine, LEXICONS_TASK, feature_order, split_lexicon_results, \
+    _check_lexicons, _flag_coref_chains
+from engine.token_table import TokenTable
+from engine import metrics
+
+
+def analyze_stream(engine: Engine, text: str, max_length: int, seuil_duplication: int,
+                   window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
+                   max_coref_length: int, with_emotion: bool,
+                   voc_cinema_df: pd.DataFrame = None, voc_offensant_df: pd.DataFrame = None,
+                   features: Iterable[str] = None, chunk_size: int = 200,
+                   coref_context: int = 10, lexicons: Dict[str, pd.DataFrame] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Performs the quality checks of a VD by chunks of lines, the parameters are those of Engine.analyze
+    The text is checked (language, format) before returning, so that errors are raised before the first line
+    :param chunk_size: number of lines analyzed together
+    :param coref_context: number of lines before a chunk on which the coreference of the chunk is computed
+    :return: iterator over the output of each line, in the format of the documents of record_outputs
+    """
+    if chunk_size < 1:
+        raise ValueError("The size of the chunks must be at least 1 line")
+    lang, lines, text, features, processors = engine.prepare(text, features, with_emotion, lemmatizing,
+                                                             lexicons or ())
+
+    # The lexicons are taken once from the registry of the engine for the whole VD
+    sources = engine.lexicon_sources(features, voc_cinema_df, voc_offensant_df, lexicons)
+    matcher = engine.lexicon_matcher(lang, lemmatizing, sources) if sources else None
+
+    return _stream_lines(engine, lang, lines, text.split("\n"), features, processors, sources, matcher,
+                         max_length, seuil_duplication, window_duplication, postag_repetition, lemmatizing,
+                         strict_mode, max_coref_length, chunk_size, coref_context)
+
+
+def _stream_lines(engine: Engine, lang: str, lines: List[str], clean_lines: List[str], features: set,
+                  processors: str, sources: dict, matcher, max_length: int, seuil_duplication: int,
+                  window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
+                  max_coref_length: int, chunk_size: int, coref_context: int) -> Iterator[Dict[str, Any]]:
+    start_time = time.time()
+    num_lines = len(lines)
+    span = window_duplication
+    # annotated documents of the lines still needed, by position
+    docs: Dict[int, Document] = {}
+    # ids of the lemmas of the duplication, given in order of appearance as in a complete analysis
+    dic_lemme = {}
+    # chain and number in this chain of the coreference mentions of the last lines, by (line, start, end)
+    chain_ids: Dict[tuple, tuple] = {}
+    next_chain_id = 0
+
+    for start in range(0, num_lines, chunk_size):
+        end = min(num_lines, start + chunk_size)
+
+        if "emotions" in features:
+            emotion_dispatch_time = time.perf_counter()
+            emotion_future = engine.dispatch_emotions(lines[start:end], lang)
+
+        # The duplication of a line depends on the lines within 2 windows of it
+        # (on all the VD when a window covers it)
+        if "duplication" in features and num_lines > 2 * span + 1:
+            context_start, context_end = max(0, start - 2 * span), min(num_lines, end + 2 * span)
+            if context_end - context_start <= 2 * span + 1:
+                context_start = max(0, context_end - 2 * span - 2)
+        elif "duplication" in features:
+            context_start, context_end = 0, num_lines
+        else:
+            context_start, context_end = start, end
+        coref_start = max(0, start - coref_context) if "coref" in features else start
+
+        # the annotations of the lines before the contexts are released, the new lines are annotated
+        for position in [position for position in docs if position < min(context_start, coref_start)]:
+            del docs[position]
+        to_annotate = [position for position in range(min(context_start, coref_start), max(context_end, end))
+                       if position not in docs]
+        annotated = [Document([], text=lines[position]) for position in to_annotate]
+        if processors and annotated:
+            annotated = engine.annotate(lang, processors, annotated)
+        docs.update(zip(to_annotate, annotated))
+
+        chunk_docs = [docs[position] for position in range(start, end)]
+        metrics.count_documents(chunk_docs)
+        table = TokenTable.from_docs(chunk_docs)
+        tasks = engine.detector_tasks(table, "\n".join(clean_lines[start:end]), lang,
+                                      features - {"duplication", "coref", "emotions"} - set(CONFIG_LEXICONS),
+                                      processors, max_length, seuil_duplication, span, postag_repetition, lemmatizing,
+                                      strict_mode, max_coref_length)
+        if matcher is not None:
+            tasks[LEXICONS_TASK] = (_check_lexicons, (table, lang, lemmatizing, sources, None, matcher))
+        if "coref" in features:
+            tasks["coref"] = (_flag_coref_chains, ("\n".join(clean_lines[coref_start:end]),
+                                                   [docs[position] for position in range(coref_start, end)], lang,
+                                                   max_coref_length,
+                                                   None if engine.param_conf["executor"] == "process" else engine,
+                                                   None, False))
+        results, _ = engine.run_detectors(tasks)
+        results = split_lexicon_results(results)
+
+        # the ids of the lemmas are shared by the chunks, the duplication is computed here after the other detectors
+        if "duplication" in features:
+            output = duplication.check_duplication([docs[position] for position in range(context_start, context_end)],
+                                                   seuil_duplication, span, postag_repetition, dic_lemme)
+            results["duplication"] = {position - start: output[position - context_start]
+                                      for position in range(start, end) if position - context_start in output}
+
+        if "coref" in features:
+            results["coref"], next_chain_id = _continue_chains(results.pop("coref"), coref_start, start, end,
+                                                               chain_ids, next_chain_id, max_coref_length)
+            for key in [key for key in chain_ids if key[0] < end - coref_context]:
+                del chain_ids[key]
+
+        if "emotions" in features:
+            results["emotions"], _ = engine.wait_emotions(emotion_future, emotion_dispatch_time, lang)
+
+        # the features are given in the order of a complete analysis
+        results = {feature: results[feature] for feature in feature_order(
+            feature for feature in sources if feature not in CONFIG_LEXICONS) if feature in results}
+        documents = record_outputs(chunk_docs, results)["documents"]
+        for document in documents:
+            document["id"] += start
+            yield document
+
+    metrics.log_request("analyze_stream", engine.param_conf["log_sample_rate"], num_lines=num_lines,
+                        duration=round(time.time() - start_time, 4))
+
+
+def _continue_chains(coref_output: Dict[int, list], coref_start: int, start: int, end: int,
+                     chain_ids: Dict[tuple, tuple], next_chain_id: int, max_length: int):
+    """
+    Split the chains of a chunk and give them their ids in the stream, as the complete analysis does
+    (see coref.split_chains). A chain with a mention of the context already seen continues the chain of its last
+    such mention: its mentions are numbered from this mention (warning beyond max_length) and it is split again at
+    the text of the first mention of this chain. The other chains start at their first mention, the mentions of
+    the context lines are counted but not given. As in the complete analysis, a chain with a single mention is not
+    given, but the lines of the previous chunks are already given: unlike the complete analysis, the first mention
+    of a chain is not given if the other mentions are in the next chunks. A chain gets its id at its first mention
+    given, a chain starting at a mention of the chunk already in a chain (ex: a line of a session computed again)
+    keeps the id of this chain
+    :param coref_output: coreference of the lines from coref_start to end (or beyond, the mentions after end are
+    counted but not given) by line relative to coref_start, with the chains not split (see flag_coref_chains)
+    :param chain_ids: chain and number in this chain of the mentions already seen, by (line, start, end), completed
+    here. A chain is {"id": id, None until given, "mentions": number of mentions, "first": texts of the first mention}
+    :param next_chain_id: first id not used by a chain
+    :param max_length: number of mentions of a chain beyond which its mentions are flagged
+    :return: coreference of the lines of the chunk by line relative to start, next id not used
+    """
+    # tokens of each mention of each chain of the window: chain -> index of the mention -> (line, token)
+    window_chains = {}
+    for line in sorted(coref_output):
+        for token in coref_output[line]:
+            window_chains.setdefault(token["token"]["ref_id_chain"], {}).setdefault(
+                token["token"]["mention"], []).append((coref_start + line, token["token"]))
+
+    # chain and number in this chain of each mention of the window
+    mentions = {}
+    # ids of the chains kept by the chains starting at their mentions
+    kept_ids = set()
+    for window_chain, chain_mentions in window_chains.items():
+        chain, number = None, 0
+        for index in sorted(chain_mentions):
+            keys = [(position, token["offset_start"], token["offset_end"])
+                    for position, token in chain_mentions[index]]
+            if keys[0][0] < start and keys[0] in chain_ids:
+                chain, number = chain_ids[keys[0]]
+                continue
+            texts = tuple(token["text"].lower() for _, token in chain_mentions[index])
+            if chain is None or texts == chain["first"]:
+                chain_id = chain_ids[keys[0]][0]["id"] if keys[0] in chain_ids else None
+                if chain_id in kept_ids:
+                    chain_id = None
+                kept_ids.add(chain_id)
+                chain, number = {"id": chain_id, "mentions": 0, "first": texts}, 0
+            number += 1
+            chain["mentions"] = max(chain["mentions"], number)
+            mentions[(window_chain, index)] = (chain, number)
+            for key in keys:
+                chain_ids[key] = (chain, number)
+
+    output = {}
+    for position in range(start, end):
+        tokens = []
+        for token in coref_output.get(position - coref_start, []):
+            token = dict(token["token"])
+            chain, number = mentions[(token["ref_id_chain"], token.pop("mention"))]
+            if chain["mentions"] < 2:
+                continue
+            if chain["id"] is None:
+                chain["id"] = next_chain_id
+                next_chain_id += 1
+            tokens.append({"token": dict(token, ref_id_chain=chain["id"], warning=1 if number > max_length else 0)})
+        if position - coref_start in coref_output:
+            output[position - start] = tokens
+
+    return output, next_chain_id
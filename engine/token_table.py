@@ -0,0 +1,245 @@
+"""
+Columnar token table of the annotated lines of a VD.
+The Stanza documents (objects by line, sentence, token and word) are converted once, right after the annotation,
+into a table of parallel numpy arrays with one row by word: line, sentence, index of the word in its sentence,
+char offsets of the word and of its token, interned ids of the lemma, text and features, UPOS code, bitmask of
+the morphological features tested by the detectors and head in the sentence. The detectors have implementations
+over the table (the functions ending in _table), so the Stanza documents can be released before they run.
+The table holds its own vocabulary of strings, it is sent as is to the workers of a process executor
+"""
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Universal POS tags https://universaldependencies.org/u/pos/ , the code of a tag is its index
+UPOS = ("ADJ", "ADP", "ADV", "AUX", "CCONJ", "DET", "INTJ", "NOUN", "NUM", "PART", "PRON", "PROPN", "PUNCT",
+        "SCONJ", "SYM", "VERB", "X")
+UPOS_CODES = {upos: code for code, upos in enumerate(UPOS)}
+# Code of the words without pos-tag (pos processor not run)
+NO_UPOS = 255
+
+# Morphological features tested by the detectors, the bit of a flag is its index.
+# A bit is set when the flag is in the features of the word (ex: "Mood" for all the moods)
+FEATURE_FLAGS = ("Person=1", "Person=2", "Person[psor]=1", "Person[psor]=2", "Tense=Pres", "Mood=Ind", "Mood",
+                 "VerbForm", "VerbForm=Inf", "VerbForm=Part", "VerbForm=Ger")
+FEATURE_BITS = {flag: 1 << bit for bit, flag in enumerate(FEATURE_FLAGS)}
+
+# Id of the missing strings (ex: lemma of a word not lemmatized) and offset of the missing offsets
+MISSING = -1
+
+
+def upos_codes(tags: Iterable[str]) -> List[int]:
+    """
+    :param tags: UPOS tags (ex: ["ADV", "VERB"]), the unknown tags are ignored
+    :return: codes of the tags in the table
+    """
+    return [UPOS_CODES[tag] for tag in tags if tag in UPOS_CODES]
+
+
+@lru_cache(maxsize=4096)
+def feature_mask(feats: Optional[str]) -> int:
+    """
+    :param feats: features of a word in the Stanza format (ex: "Mood=Ind|Person=1"), or None
+    :return: bitmask of the FEATURE_FLAGS found in the features (cached, the features of a language are few)
+    """
+    if not feats:
+        return 0
+    return sum(bit for flag, bit in FEATURE_BITS.items() if flag in feats)
+
+
+class TokenTable:
+    """
+    Annotations of the lines of a VD as parallel arrays, see from_docs.
+    Lines, sentences and tokens are indexed in the order of the VD, the sentences and tokens of a line
+    and the words of a sentence are given by offsets arrays (line_sentences[i]:line_sentences[i + 1])
+    """
+
+    def __init__(self, texts: List[str], strings: List[str], columns: Dict[str, np.ndarray]):
+        """
+        :param texts: text of each line
+        :param strings: vocabulary of the table, the ids of the columns are indices in it
+        :param columns: arrays of the table (see from_docs)
+        """
+        self.texts = texts
+        self.strings = strings
+        # ids of the strings, built on first use
+        self._ids = None
+        # lines
+        self.line_sentences = columns["line_sentences"]
+        # sentences
+        self.sentence_line = columns["sentence_line"]
+        self.sentence_start = columns["sentence_start"]
+        self.sentence_end = columns["sentence_end"]
+        self.sentence_tokens = columns["sentence_tokens"]
+        self.sentence_words = columns["sentence_words"]
+        # tokens
+        self.token_start = columns["token_start"]
+        self.token_end = columns["token_end"]
+        self.token_text = columns["token_text"]
+        # words
+        self.line = columns["line"]
+        self.sentence = columns["sentence"]
+        self.index = columns["index"]
+        self.token = columns["token"]
+        self.start = columns["start"]
+        self.end = columns["end"]
+        self.text = columns["text"]
+        self.lemma = columns["lemma"]
+        self.upos = columns["upos"]
+        self.feats = columns["feats"]
+        self.feats_mask = columns["feats_mask"]
+        self.head = columns["head"]
+
+    @classmethod
+    def from_docs(cls, docs: Iterable[Any]) -> "TokenTable":
+        """
+        Convert annotated Stanza documents (one by line of the VD)
+        :param docs: Stanza documents, annotated with any processors (a line not tokenized has no sentence)
+        :return: table of the words of the documents
+        """
+        texts = []
+        strings = []
+        ids = {}
+        masks = {}
+
+        def intern(value: Optional[str]) -> int:
+            if value is None:
+                return MISSING
+            if value not in ids:
+                ids[value] = len(strings)
+                strings.append(value)
+            return ids[value]
+
+        columns = {name: [] for name in ("line_sentences", "sentence_line", "sentence_start", "sentence_end",
+                                         "sentence_tokens", "sentence_words", "token_start", "token_end",
+                                         "token_text", "line", "sentence", "index", "token", "start", "end",
+                                         "text", "lemma", "upos", "feats", "feats_mask", "head")}
+        words = {name: columns[name].append for name in ("line", "sentence", "index", "token", "start", "end",
+                                                          "text", "lemma", "upos", "feats", "feats_mask", "head")}
+        num_sentences = 0
+        num_tokens = 0
+        num_words = 0
+        for i_line, doc in enumerate(docs):
+            texts.append(doc.text)
+            columns["line_sentences"].append(num_sentences)
+            for sentence in doc.sentences:
+                columns["sentence_line"].append(i_line)
+                columns["sentence_tokens"].append(num_tokens)
+                columns["sentence_words"].append(num_words)
+                start = sentence.tokens[0].start_char if sentence.tokens else None
+                end = sentence.tokens[-1].end_char if sentence.tokens else None
+                columns["sentence_start"].append(MISSING if start is None else start)
+                columns["sentence_end"].append(MISSING if end is None else end)
+                for token in sentence.tokens:
+                    columns["token_start"].append(MISSING if token.start_char is None else token.start_char)
+                    columns["token_end"].append(MISSING if token.end_char is None else token.end_char)
+                    columns["token_text"].append(intern(token.text))
+                    for word in token.words:
+                        words["line"](i_line)
+                        words["sentence"](num_sentences)
+                        words["index"](word.id - 1)
+                        words["token"](num_tokens)
+                        words["start"](MISSING if word.start_char is None else word.start_char)
+                        words["end"](MISSING if word.end_char is None else word.end_char)
+                        words["text"](intern(word.text))
+                        words["lemma"](intern(word.lemma))
+                        words["upos"](UPOS_CODES.get(word.upos, UPOS_CODES["X"]) if word.upos else NO_UPOS)
+                        words["feats"](intern(word.feats))
+                        if word.feats not in masks:
+                            masks[word.feats] = feature_mask(word.feats)
+                        words["feats_mask"](masks[word.feats])
+                        words["head"](MISSING if word.head is None else word.head)
+                        num_words += 1
+                    num_tokens += 1
+                num_sentences += 1
+        columns["line_sentences"].append(num_sentences)
+        columns["sentence_tokens"].append(num_tokens)
+        columns["sentence_words"].append(num_words)
+
+        types = {"upos": np.uint8, "feats_mask": np.uint32, "index": np.int16, "head": np.int16}
+        return cls(texts, strings, {name: np.array(values, dtype=types.get(name, np.int32))
+                                    for name, values in columns.items()})
+
+    def __len__(self) -> int:
+        """
+        Number of lines
+        """
+        return len(self.texts)
+
+    @property
+    def num_words(self) -> int:
+        return len(self.line)
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_start)
+
+    def string(self, string_id: int) -> Optional[str]:
+        """
+        String of an id of the table (None for MISSING)
+        """
+        return None if string_id == MISSING else self.strings[string_id]
+
+    def line_sentence_range(self, line: int) -> range:
+        """
+        Sentences of a line
+        """
+        return range(self.line_sentences[line], self.line_sentences[line + 1])
+
+    def sentence_word_range(self, sentence: int) -> range:
+        """
+        Words of a sentence, in order
+        """
+        return range(self.sentence_words[sentence], self.sentence_words[sentence + 1])
+
+    def sentence_token_range(self, sentence: int) -> range:
+        """
+        Tokens of a sentence, in order
+        """
+        return range(self.sentence_tokens[sentence], self.sentence_tokens[sentence + 1])
+
+    def line_word_range(self, line: int) -> range:
+        """
+        Words of a line, in order
+        """
+        return range(self.sentence_words[self.line_sentences[line]], self.sentence_words[self.line_sentences[line + 1]])
+
+    def sentence_text(self, sentence: int) -> Optional[str]:
+        """
+        Text of a sentence, from its first token to its last one (as the text of a Stanza sentence)
+        """
+        start, end = int(self.sentence_start[sentence]), int(self.sentence_end[sentence])
+        if start == MISSING or end == MISSING or self.texts[self.sentence_line[sentence]] is None:
+            return None
+        return self.texts[self.sentence_line[sentence]][start:end]
+
+    def string_id(self, value: str) -> int:
+        """
+        Id of a string in the table (MISSING if it is not in it)
+        """
+        if self._ids is None:
+            self._ids = {string: string_id for string_id, string in enumerate(self.strings)}
+        return self._ids.get(value, MISSING)
+
+    def upos_tag(self, row: int) -> Optional[str]:
+        """
+        UPOS tag of a word (None if it has no pos-tag)
+        """
+        code = int(self.upos[row])
+        return None if code == NO_UPOS else UPOS[code]
+
+    def has_feature(self, flag: str, rows=slice(None)) -> np.ndarray:
+        """
+        :param flag: one of the FEATURE_FLAGS
+        :param rows: index or indices of words, all the words by default
+        :return: True where the features of the words contain the flag
+        """
+        return (self.feats_mask[rows] & FEATURE_BITS[flag]) != 0
+
+    def offset(self, values: np.ndarray, row: int) -> Optional[int]:
+        """
+        Char offset of a column of offsets as int (None if missing)
+        """
+        value = int(values[row])
+        return None if value == MISSING else value
@@ -0,0 +1,308 @@
+# -*- coding:Utf-8 -*-
+"""
+Prebuilt lexicon artifacts.
+Lemmatizing a lexicon with Stanza takes much longer than matching it, so a lexicon can be lemmatized offline
+into a binary artifact: the lemmatized terms as sequences of ids of lemmas, the vocabulary of the lemmas and
+the trie of the sequences (the automaton of the matching), as flat arrays.
+An artifact is only a cache of the lemmatization: when the matcher of the lexicon is built, the arrays are read
+from the file (memory mapped, then closed) and the nodes of the trie are copied into the trie of the matcher
+(see find_voc.matcher.LemmaMatcher.add_trie). The terms are neither lemmatized with Stanza nor split and looked
+up again, but loading an artifact is still linear in the size of the lexicon and the matcher takes the same memory
+as one built from the terms.
+An artifact holds the version of the Stanza models which lemmatized it, it is not used with other models
+(the lexicon is then lemmatized again, see load_lemma_matcher).
+An artifact is named after the id of its lexicon (sha256 of the lexicon file, see engine.lexicons) and its language
+
+Usage: python -m find_voc.artifact fichier_tests/voc_cinema.csv fichier_tests/voc_offensant.csv --lang FR EN
+    --output lexicons
+(without files, the lexicons of the config are built, without output, in the lexicon_artifact_dir of the config)
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from find_voc import find_voc
+from find_voc.matcher import LemmaMatcher
+
+# Format of the files: magic, version of the format, size of the JSON header, header, arrays aligned on 8 bytes
+ARTIFACT_MAGIC = b"VDQLEX"
+ARTIFACT_FORMAT_VERSION = 1
+ARTIFACT_EXTENSION = ".lexbin"
+_PREFIX = struct.Struct("<6sHQ")
+_ALIGNMENT = 8
+
+# Arrays of an artifact and their type
+ARTIFACT_ARRAYS = {
+    # vocabulary of the lemmas: UTF-8 bytes of the lemmas one after another and offsets of each lemma
+    "strings": np.uint8, "string_offsets": np.int64,
+    # lemmatized terms: ids of their lemmas one after another and offsets of each term
+    "term_lemmas": np.int32, "term_offsets": np.int64,
+    # trie of the terms: edges of each node (node_edges[n]:node_edges[n + 1], sorted by id of lemma),
+    # lemma and target node of each edge, term ending on each node (-1 if none), the root is the node 0
+    "node_edges": np.int64, "edge_lemmas": np.int32, "edge_targets": np.int32, "node_terms": np.int32,
+}
+
+
+def artifact_path(directory: str, lexicon_id: str, lang: str) -> str:
+    """
+    Path of the artifact of a lexicon in a directory
+    :param lexicon_id: id of the lexicon (sha256 of its file)
+    :param lang: FR or EN
+    """
+    return os.path.join(directory, "%s.%s%s" % (lexicon_id, lang, ARTIFACT_EXTENSION))
+
+
+def build_trie(sequences: List[List[int]]) -> Dict[str, np.ndarray]:
+    """
+    Trie of sequences of ids, as flat arrays (see ARTIFACT_ARRAYS)
+    :param sequences: ids of the lemmas of each term
+    :return: node_edges, edge_lemmas, edge_targets and node_terms arrays
+    """
+    children = [{}]
+    node_terms = [-1]
+    for term, sequence in enumerate(sequences):
+        node = 0
+        for lemma in sequence:
+            if lemma not in children[node]:
+                children[node][lemma] = len(children)
+                children.append({})
+                node_terms.append(-1)
+            node = children[node][lemma]
+        # the first one of the duplicated terms
+        if node_terms[node] == -1:
+            node_terms[node] = term
+
+    edges = [sorted(node_children.items()) for node_children in children]
+    return {"node_edges": np.cumsum([0] + [len(node_edges) for node_edges in edges]).astype(np.int64),
+            "edge_lemmas": np.array([lemma for node_edges in edges for lemma, _ in node_edges], dtype=np.int32),
+            "edge_targets": np.array([target for node_edges in edges for _, target in node_edges], dtype=np.int32),
+            "node_terms": np.array(node_terms, dtype=np.int32)}
+
+
+def write_artifact(path: str, lemmatized_terms: List[str], lexicon_id: str, lang: str, model_version: str) -> None:
+    """
+    Write the artifact of a lemmatized lexicon
+    :param path: file of the artifact
+    :param lemmatized_terms: terms of the lexicon, as their lemmas separated by spaces (see find_voc.lemmatize_lexicon)
+    :param lexicon_id: id of the lexicon
+    :param lang: FR or EN
+    :param model_version: version of the Stanza models which lemmatized the terms
+    """
+    ids = {}
+    sequences = []
+    for term in lemmatized_terms:
+        sequences.append([ids.setdefault(lemma, len(ids)) for lemma in term.split(" ")])
+    encoded = [lemma.encode("utf-8") for lemma in ids]
+
+    arrays = {"strings": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+              "string_offsets": np.cumsum([0] + [len(lemma) for lemma in encoded]).astype(np.int64),
+              "term_lemmas": np.array([lemma for sequence in sequences for lemma in sequence], dtype=np.int32),
+              "term_offsets": np.cumsum([0] + [len(sequence) for sequence in sequences]).astype(np.int64)}
+    arrays.update(build_trie(sequences))
+
+    layout = {}
+    offset = 0
+    for name, dtype in ARTIFACT_ARRAYS.items():
+        layout[name] = [offset, len(arrays[name])]
+        offset += -(-arrays[name].astype(dtype).nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps({"lexicon_id": lexicon_id, "lang": lang, "stanza": model_version,
+                         "num_terms": len(sequences), "arrays": layout}).encode("utf-8")
+    header += b" " * (-(_PREFIX.size + len(header)) % _ALIGNMENT)
+
+    # write then rename, so that an artifact is never read half written
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(file_descriptor, "wb") as artifact_file:
+        artifact_file.write(_PREFIX.pack(ARTIFACT_MAGIC, ARTIFACT_FORMAT_VERSION, len(header)))
+        artifact_file.write(header)
+        for name, dtype in ARTIFACT_ARRAYS.items():
+            data = arrays[name].astype(dtype).tobytes()
+            artifact_file.write(data + b"\0" * (-len(data) % _ALIGNMENT))
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+
+
+class LexiconArtifact:
+    """
+    Artifact of a lemmatized lexicon, memory mapped (see write_artifact)
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: file of the artifact
+        :raise ValueError: if the file is not an artifact of this version of the format
+        """
+        with open(path, "rb") as artifact_file:
+            self._buffer = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < _PREFIX.size:
+            raise ValueError("%s is not a lexicon artifact" % path)
+        magic, version, header_size = _PREFIX.unpack_from(self._buffer)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_FORMAT_VERSION:
+            raise ValueError("%s is not a lexicon artifact of version %s" % (path, ARTIFACT_FORMAT_VERSION))
+        self.header = json.loads(self._buffer[_PREFIX.size:_PREFIX.size + header_size])
+        self.lexicon_id = self.header["lexicon_id"]
+        self.lang = self.header["lang"]
+        self.model_version = self.header["stanza"]
+
+        # the arrays are views of the mapped file
+        start = _PREFIX.size + header_size
+        self.arrays = {name: np.frombuffer(self._buffer, dtype=dtype, count=self.header["arrays"][name][1],
+                                           offset=start + self.header["arrays"][name][0])
+                       for name, dtype in ARTIFACT_ARRAYS.items()}
+
+    def __len__(self) -> int:
+        """
+        Number of terms
+        """
+        return self.header["num_terms"]
+
+    def vocabulary(self) -> List[str]:
+        """
+        Lemmas of the terms, the id of a lemma is its index
+        """
+        strings = self.arrays["strings"].tobytes()
+        offsets = self.arrays["string_offsets"].tolist()
+        return [strings[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def terms(self) -> List[str]:
+        """
+        Lemmatized terms, their lemmas separated by spaces (as find_voc.lemmatize_lexicon gives them)
+        """
+        vocabulary = self.vocabulary()
+        lemmas = self.arrays["term_lemmas"].tolist()
+        offsets = self.arrays["term_offsets"].tolist()
+        return [" ".join(vocabulary[lemma] for lemma in lemmas[offsets[i]:offsets[i + 1]]) for i in range(len(self))]
+
+    def lookup(self, lemmas: List[int]) -> int:
+        """
+        Term of a sequence of lemmas, walking the trie
+        :param lemmas: ids of lemmas
+        :return: index of the term, -1 if the sequence is not a term
+        """
+        edges, edge_lemmas = self.arrays["node_edges"], self.arrays["edge_lemmas"]
+        node = 0
+        for lemma in lemmas:
+            first, last = int(edges[node]), int(edges[node + 1])
+            k = first + int(np.searchsorted(edge_lemmas[first:last], lemma))
+            if k == last or edge_lemmas[k] != lemma:
+                return -1
+            node = int(self.arrays["edge_targets"][k])
+        return int(self.arrays["node_terms"][node])
+
+    def lemma_matcher(self, label: str = None) -> LemmaMatcher:
+        """
+        Matcher of the lexicon, built from the trie of the artifact (the arrays are copied, the matcher
+        does not depend on the file)
+        :param label: label of the lexicon in the matcher
+        """
+        matcher = LemmaMatcher()
+        matcher.add_trie(label, self.vocabulary(), self.arrays["node_edges"].tolist(),
+                         self.arrays["edge_lemmas"].tolist(), self.arrays["edge_targets"].tolist(),
+                         self.arrays["node_terms"].tolist(), self.terms())
+        return matcher
+
+    def close(self) -> None:
+        # the views of the arrays must be released before the mapping
+        self.arrays = {}
+        self._buffer.close()
+
+
+def load_lemma_matcher(path: str, lexicon_id: str, lang: str, model_version: str) -> Optional[LemmaMatcher]:
+    """
+    Matcher of a lemmatized lexicon from its artifact
+    :param path: file of the artifact
+    :param lexicon_id: id of the lexicon
+    :param lang: FR or EN
+    :param model_version: version of the Stanza models lemmatizing the VDs
+    :return: matcher of the lemmatized terms (see LexiconArtifact.lemma_matcher),
+        None if there is no artifact or if it was built from another lexicon or with other models
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        artifact = LexiconArtifact(path)
+    except ValueError as error:
+        print("WARNING lexicon artifact ignored: %s" % error)
+        return None
+
+    try:
+        if (artifact.lexicon_id, artifact.lang) != (lexicon_id, lang):
+            print("WARNING lexicon artifact %s ignored: built from another lexicon" % path)
+            return None
+        if artifact.model_version != model_version:
+            print("WARNING lexicon artifact %s ignored: built with the Stanza models %s, not %s"
+                  % (path, artifact.model_version, model_version))
+            return None
+        matcher = artifact.lemma_matcher()
+    finally:
+        artifact.close()
+
+    return matcher
+
+
+def build_artifacts(paths: List[str], langs: List[str], output: str = None, config_path: str = None) -> List[str]:
+    """
+    Lemmatize lexicon files with the Stanza models of the engine and write their artifacts
+    :param paths: TSV files of the lexicons, those of the config if empty
+    :param langs: languages of the artifacts (FR, EN), a lexicon without the column of a language is skipped
+    :param output: directory of the artifacts, the lexicon_artifact_dir of the config if None
+    :param config_path: config file of the engine
+    :return: paths of the artifacts written
+    :raise ValueError: if there is no directory of artifacts
+    """
+    from functools import partial
+    from engine.engine import STANZA_MODEL_VERSION, Engine, plan_processors
+
+    engine = Engine(config_path)
+    output = output or engine.param_conf["lexicon_artifact_dir"]
+    if output is None:
+        engine.close()
+        raise ValueError("No directory of artifacts: give --output or lexicon_artifact_dir in the config")
+    paths = paths or [engine.param_conf["voc_cinema"], engine.param_conf["voc_offensant"]]
+    written = []
+    for path in paths:
+        with open(path, "rb") as lexicon_file:
+            lexicon_id = hashlib.sha256(lexicon_file.read()).hexdigest()
+        for lang in langs:
+            try:
+                lexicon = find_voc.load_lexicon(lang, path_lex_current=path)
+            except ValueError as error:
+                print("--- %s skipped for %s: %s" % (path, lang, error))
+                continue
+            # the terms are lemmatized as by the registry of the engine
+            lemmatized_terms = find_voc.lemmatize_lexicon(
+                partial(engine.annotate, lang, plan_processors({"cinema"}, True)), lexicon)
+            written.append(artifact_path(output, lexicon_id, lang))
+            write_artifact(written[-1], lemmatized_terms, lexicon_id, lang, STANZA_MODEL_VERSION)
+            print("--- %s (%s, %s terms) -> %s" % (path, lang, len(lemmatized_terms), written[-1]))
+    engine.close()
+
+    return written
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the artifacts of lemmatized lexicons")
+    parser.add_argument("lexicons", nargs="*", help="TSV files of the lexicons, those of the config by default")
+    parser.add_argument("--lang", nargs="+", default=["FR", "EN"], help="languages of the artifacts")
+    parser.add_argument("--output",
+                        help="directory of the artifacts, the lexicon_artifact_dir of the config by default")
+    parser.add_argument("--config", help="config file of the tool")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> List[str]:
+    args = parse_args(argv)
+    return build_artifacts(args.lexicons, [lang.upper() for lang in args.lang], args.output, args.config)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
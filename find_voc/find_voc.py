@@ -1,17 +1,27 @@
 # -*- coding:Utf-8 -*-
 
+from typing import Union
+
 import pandas as pd
 from stanza import Document, Pipeline
 
 from flashtext import KeywordProcessor
 import numpy as np
 
+from engine.token_table import TokenTable
+from find_voc.matcher import LemmaMatcher, LexiconMatcher
+
 """
 Check use of cinematographic vocabulary in a text.
 thanks to a cinematographic lexicon
 Lemmatization of the text to check and the word in the lexicon
 """
 
+# Stanza annotations needed by the detection on the lemmatized text (also used to lemmatize the lexicon)
+REQUIRED_PROCESSORS = {"tokenize", "mwt", "pos", "lemma"}
+# Stanza annotations needed by the detection on the raw text
+REQUIRED_PROCESSORS_RAW = {"tokenize"}
+
 
 def load_lexicon(lang: str, path_lex_current: str=None, voc_current_df:pd.DataFrame=None) -> list:
     """
@@ -59,12 +69,26 @@ def lemmatize_lexicon(processor, lexicon):
     return [" ".join(w.lemma for s in doc.sentences for w in s.words) for doc in documents]
 
 
+def lemma_matcher(index) -> LemmaMatcher:
+    """
+    Matcher over the lemmas of the words of a lemmatized lexicon
+    :param index: flashtext index of the lemmatized terms (see build_keyword_processor) or LemmaMatcher
+    :return: LemmaMatcher of the terms, the index itself if it is a LemmaMatcher
+    """
+    if isinstance(index, LemmaMatcher):
+        return index
+    matcher = LemmaMatcher()
+    matcher.add_keyword_processor(None, index)
+    return matcher
+
+
 def extract_keywords_lemmas(
-        index: KeywordProcessor, doc: Document
+        index, doc: Document
 ) -> list:
     """
     Extracts keywords from a document, matching words lemmas instead of words.
-    The returned offsets are relative to the document text.
+    The terms are matched on the sequence of the lemmas of the words (see find_voc.matcher.LemmaMatcher),
+    the returned offsets are those of the tokens of the first and last words, relative to the document text.
 
     Important: the index must be built with the lemmas of the words/phrases.
 
@@ -72,8 +96,8 @@ def extract_keywords_lemmas(
     ----------
     doc : Document
         Document to extract keywords from.
-    index : KeywordProcessor
-        Index to use for keyword extraction.
+    index : KeywordProcessor or LemmaMatcher
+        Index of a lexicon to use for keyword extraction (see lemma_matcher).
 
     Returns
     -------
@@ -84,27 +108,51 @@ def extract_keywords_lemmas(
     if not doc.text or (len(doc.sentences) == 0):
         return []
 
+    matcher = lemma_matcher(index)
     words = [w for sentence in doc.sentences for w in sentence.words]
-    lemmas = [w.lemma for w in words]
 
-    # Lemmatize document:
-    lemma_text = " ".join(lemmas)
+    for _, _, i_start, i_end, *_ in matcher.match(matcher.lemma_ids([w.lemma for w in words]).tolist()):
+        # Retrieve text offset from the tokens (the words of a multi-word token have no offsets):
+        text_start_offset = words[i_start].parent.start_char
+        text_end_offset = words[i_end - 1].parent.end_char
 
-    # Compute lemma start and end offsets in the lemmatized document:
-    lemma_start_offsets = np.cumsum(np.array([0] + [len(lemma) + 1 for lemma in lemmas[:-1]]))
-    lemma_end_offsets = lemma_start_offsets + np.array([len(lemma) for lemma in lemmas])
+        yield doc.text[text_start_offset:text_end_offset], text_start_offset, text_end_offset
 
-    # Extract keywords in lemmatized text
-    for _, start, end in index.extract_keywords(lemma_text, span_info=True):
-        # Retrieve start and end lemmas indices
-        i_start = np.searchsorted(lemma_start_offsets - 1, start) - 1
-        i_end = np.searchsorted(lemma_end_offsets, end)
 
-        # Retrieve text offset from lemmas:
-        text_start_offset = words[i_start].start_char
-        text_end_offset = words[i_end].end_char
+def _table_lemma_ids(matcher: LemmaMatcher, table: TokenTable) -> np.ndarray:
+    """
+    Ids in a matcher of the lemmas of a token table, computed once by table
+    :return: id of each string of the table (see LemmaMatcher.lemma_ids, the strings which are not lemmas
+        are unknown), followed by the id of the MISSING (-1) lemmas
+    """
+    lemmas = set(table.lemma.tolist())
+    return matcher.lemma_ids([string if string_id in lemmas else None for string_id, string in enumerate(table.strings)]
+                             + [None])
 
-        yield doc.text[text_start_offset:text_end_offset], text_start_offset, text_end_offset
+
+def _lemma_matches_table(matcher: LemmaMatcher, table: TokenTable, line: int, lemma_ids: np.ndarray) -> list:
+    """
+    Matches of lemmatized lexicons over the lemmas of the words of a line of the token table
+    :param matcher: matcher of the lemmatized lexicons
+    :param lemma_ids: ids in the matcher of the strings of the table (see _table_lemma_ids)
+    :return: (label, text, offset_start, offset_end) tuples, followed by the distance for an approximate matcher
+    (see find_voc.fuzzy)
+    """
+    rows = table.line_word_range(line)
+    text = table.texts[line]
+    if not text or len(rows) == 0:
+        return []
+
+    matches = []
+    for label, _, i_start, i_end, *distance in matcher.match(lemma_ids[table.lemma[rows.start:rows.stop]].tolist()):
+        # Retrieve text offset from the tokens of the first and last words:
+        text_start_offset = table.offset(table.token_start, table.token[rows[i_start]])
+        text_end_offset = table.offset(table.token_end, table.token[rows[i_end - 1]])
+
+        matches.append((label, text[text_start_offset:text_end_offset], text_start_offset, text_end_offset,
+                        *distance))
+
+    return matches
 
 
 def _detect_lexicon(docs: list, apply_matching_on_lemmatized_text: bool,
@@ -120,6 +168,8 @@ def _detect_lexicon(docs: list, apply_matching_on_lemmatized_text: bool,
 
     # For each document
     results = {}
+    if apply_matching_on_lemmatized_text:
+        lexicons = lemma_matcher(lexicons)
 
     for i_vd, document in enumerate(docs):
         output = []
@@ -150,20 +200,16 @@ def _detect_lexicon(docs: list, apply_matching_on_lemmatized_text: bool,
     return results
 
 
-def check_lexique(docs: list, processor: Pipeline,
-                  lang: str, apply_matching_on_lemmatized_text: bool,
-                  path_lex: str = None, voc_df:pd.DataFrame=None) -> dict:
+def build_keyword_processor(processor: Pipeline, lang: str, apply_matching_on_lemmatized_text: bool,
+                            path_lex: str = None, voc_df: pd.DataFrame = None) -> KeywordProcessor:
     """
-    Find cinematographic vocabulary in a text
-    using Lemmatization or optionally using the raw text
-    :param docs: docs already processed by Stanza
-    :param processor: Pipeline of Stanza
+    Load a lexicon and index it with flashtext
+    :param processor: Pipeline of Stanza used to lemmatize the lexicon
     :param lang: FR or EN are supported
-    :param apply_matching_on_lemmatized_text:way to detect the lexicon:lemmatized text(True)
+    :param apply_matching_on_lemmatized_text: index the lemmatized lexicon (True) or the raw lexicon (False)
     :param path_lex: path to the lexicon
     :param voc_df: panda DataFrame of the lexicon
-    or raw (False)
-    :return:
+    :return: flashtext index of the lexicon
     """
 
     # load the lexicon
@@ -171,9 +217,7 @@ def check_lexique(docs: list, processor: Pipeline,
         lex_voc = load_lexicon(lang, path_lex_current=path_lex)
     else:
         lex_voc = load_lexicon(lang, voc_current_df=voc_df)
-    
 
-    # detect the lexicon in the text
     # option1 : use lemmatization of lexique and vds to detect find_voc
     if apply_matching_on_lemmatized_text:
 
@@ -181,12 +225,8 @@ def check_lexique(docs: list, processor: Pipeline,
         lexicon_lemmatized = lemmatize_lexicon(processor, lex_voc)
 
         # initialisation of flashtext with lemmatized lexicon
-        lexicons_lemmatized_tofind = KeywordProcessor()
-        lexicons_lemmatized_tofind.add_keywords_from_list(lexicon_lemmatized)
-
-        # detect occurrences of the lexicon in the vd text
-        outputs = _detect_lexicon(docs, apply_matching_on_lemmatized_text=True,
-                                  lexicons=lexicons_lemmatized_tofind)
+        lexicons_tofind = KeywordProcessor()
+        lexicons_tofind.add_keywords_from_list(lexicon_lemmatized)
 
     # option2 : use raw text
     # TODO : remove this option if finally not needed
@@ -195,8 +235,63 @@ def check_lexique(docs: list, processor: Pipeline,
         lexicons_tofind = KeywordProcessor()
         lexicons_tofind.add_keywords_from_list(lex_voc)
 
-        # detect occurrences of the lexicon in the vd text
-        outputs = _detect_lexicon(docs, apply_matching_on_lemmatized_text=False,
-                                  lexicons=lexicons_tofind)
+    return lexicons_tofind
+
+
+def check_lexique(docs: list, processor: Pipeline,
+                  lang: str, apply_matching_on_lemmatized_text: bool,
+                  path_lex: str = None, voc_df:pd.DataFrame=None,
+                  keyword_processor: KeywordProcessor = None) -> dict:
+    """
+    Find cinematographic vocabulary in a text
+    using Lemmatization or optionally using the raw text
+    :param docs: docs already processed by Stanza
+    :param processor: Pipeline of Stanza
+    :param lang: FR or EN are supported
+    :param apply_matching_on_lemmatized_text:way to detect the lexicon:lemmatized text(True)
+    or raw (False)
+    :param path_lex: path to the lexicon
+    :param voc_df: panda DataFrame of the lexicon
+    :param keyword_processor: lexicon already indexed by build_keyword_processor, built from the lexicon if None
+    :return:
+    """
+
+    if keyword_processor is None:
+        keyword_processor = build_keyword_processor(processor, lang, apply_matching_on_lemmatized_text,
+                                                    path_lex=path_lex, voc_df=voc_df)
+
+    # detect occurrences of the lexicon in the vd text
+    outputs = _detect_lexicon(docs, apply_matching_on_lemmatized_text=apply_matching_on_lemmatized_text,
+                              lexicons=keyword_processor)
 
     return outputs
+
+
+def check_lexicons_table(table: TokenTable, matcher: Union[LexiconMatcher, LemmaMatcher],
+                         apply_matching_on_lemmatized_text: bool) -> dict:
+    """
+    check_lexique of several lexicons at once over the token table of the VD (see engine.token_table),
+    each line is scanned once (see find_voc.matcher)
+    :param table: token table of the lines of the VD
+    :param matcher: labeled lexicons, LemmaMatcher of the lemmatized lexicons if apply_matching_on_lemmatized_text
+    :param apply_matching_on_lemmatized_text: way to detect the lexicons: lemmatized text (True) or raw (False)
+    :return: dict of results by id of vd line, by label of lexicon, the tokens of an approximate matcher
+    (see find_voc.fuzzy) also give their distance
+    """
+    results = {label: {} for label in matcher.labels}
+    if apply_matching_on_lemmatized_text:
+        lemma_ids = _table_lemma_ids(matcher, table)
+    for i_vd, text in enumerate(table.texts):
+        for label in results:
+            results[label][i_vd] = []
+        if apply_matching_on_lemmatized_text:
+            matches = _lemma_matches_table(matcher, table, i_vd, lemma_ids)
+        else:
+            matches = matcher.extract_keywords(text, span_info=True)
+        for (label, keyword, offset_start, offset_end, *distance) in matches:
+            token = {"text": keyword, "offset_start": offset_start, "offset_end": offset_end}
+            if distance:
+                token["distance"] = distance[0]
+            results[label][i_vd].append({"token": token})
+
+    return results
@@ -0,0 +1,191 @@
+# -*- coding:Utf-8 -*-
+"""
+Approximate matching of the lemmatized lexicons (typos, variant spellings, missing accents).
+The lemmas of the terms are compared without case and accents (fold) and with a bounded edit distance
+(Damerau-Levenshtein, a transposition of 2 adjacent characters is 1 edit). The candidates of a lemma of the VD are
+found with a symmetric deletion index (as SymSpell): the lemmas of the lexicon are indexed by all the strings
+obtained by deleting up to max distance characters, a lemma of the VD is looked up by its own deletions, so a lookup
+does not depend on the size of the lexicon. A lemma of the lexicon accepts 1 edit by CHARACTERS_BY_EDIT characters
+(ex: 1 edit for "caméra" and "travelling", 2 for "contre-plongée", none for "plan" or "filme" which only match
+without accents), the edits of the lemmas of a term are added and bounded by the max distance
+"""
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from find_voc.matcher import _TERMS, LemmaMatcher
+
+# Number of characters of a lemma of a lexicon by accepted edit (shorter lemmas have too many close words)
+CHARACTERS_BY_EDIT = 6
+# Ligatures folded into their letters (they have no decomposition)
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae"})
+# Candidates of a lemma in no term
+_NO_CANDIDATES = {}
+
+
+def fold(text: str) -> str:
+    """
+    Text in lower case without accents (ex: "Caméra" -> "camera", "cœur" -> "coeur")
+    """
+    decomposed = unicodedata.normalize("NFD", text.lower().translate(_LIGATURES))
+    return "".join(character for character in decomposed if not unicodedata.combining(character))
+
+
+def allowed_distance(word: str, max_distance: int) -> int:
+    """
+    Number of edits accepted for a lemma of a lexicon
+    :param word: folded lemma
+    :param max_distance: max number of edits
+    """
+    return min(max_distance, len(word) // CHARACTERS_BY_EDIT)
+
+
+def deletions(word: str, max_distance: int) -> Set[str]:
+    """
+    Strings obtained by deleting up to max_distance characters of a word, the word included
+    """
+    result = {word}
+    level = {word}
+    for _ in range(max_distance):
+        level = {variant[:i] + variant[i + 1:] for variant in level for i in range(len(variant))}
+        result |= level
+    return result
+
+
+def edit_distance(first: str, second: str, max_distance: int) -> int:
+    """
+    Damerau-Levenshtein distance (optimal string alignment) of 2 words, bounded
+    :return: distance, max_distance + 1 if it is greater than max_distance
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    before_previous = None
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (first[i - 1] != second[j - 1]))
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        # the distance is at least the min of the row
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class DeletionIndex:
+    """
+    Symmetric deletion index of the lemmas of lexicons, see the module documentation
+    """
+
+    def __init__(self, max_distance: int):
+        """
+        :param max_distance: max number of edits between a lemma and the lemmas found
+        """
+        self.max_distance = max_distance
+        # folded lemma and number of edits accepted by id of lemma
+        self._words = {}
+        self._allowed = {}
+        # ids of the lemmas by deletion of their folded lemma
+        self._deletions = defaultdict(list)
+
+    def add(self, word_id: int, word: str) -> None:
+        """
+        Index a lemma
+        :param word_id: id of the lemma, given back by lookup
+        :param word: lemma
+        """
+        folded = fold(word)
+        self._words[word_id] = folded
+        self._allowed[word_id] = allowed_distance(folded, self.max_distance)
+        for deletion in deletions(folded, self._allowed[word_id]):
+            self._deletions[deletion].append(word_id)
+
+    def lookup(self, word: str) -> Dict[int, int]:
+        """
+        Lemmas close to a word
+        :return: distance to the word by id of lemma, for the lemmas within their accepted number of edits
+        """
+        folded = fold(word)
+        found = {}
+        for deletion in deletions(folded, self.max_distance):
+            for word_id in self._deletions.get(deletion, ()):
+                if word_id not in found:
+                    found[word_id] = edit_distance(folded, self._words[word_id], self._allowed[word_id])
+        return {word_id: distance for word_id, distance in found.items() if distance <= self._allowed[word_id]}
+
+
+class ApproximateLemmaMatcher(LemmaMatcher):
+    """
+    LemmaMatcher accepting edits in the lemmas of the terms, see the module documentation.
+    A word may be several lemmas of the terms (its candidates), the longest term of a lexicon starting at a word
+    is kept, with the smallest distance. The hits give their distance (0 for a term found as is or without accents)
+    """
+
+    def __init__(self, max_distance: int):
+        """
+        :param max_distance: max number of edits of a hit
+        """
+        super().__init__()
+        self.max_distance = max_distance
+        self._index = DeletionIndex(max_distance)
+
+    def _lemma_id(self, lemma: str) -> int:
+        # the new lemmas are indexed by their deletions
+        new = lemma not in self._ids
+        lemma_id = super()._lemma_id(lemma)
+        if new:
+            self._index.add(lemma_id, lemma)
+        return lemma_id
+
+    def lemma_ids(self, lemmas: Iterable[str]) -> np.ndarray:
+        """
+        Candidates of lemmas in the matcher, a lemma is looked up once
+        :param lemmas: lemmas (or None for a missing lemma), ex: the vocabulary of a token table
+        :return: distance by id of lemma of the terms for each lemma (object array of dictionaries)
+        """
+        found = {None: _NO_CANDIDATES}
+        lemmas = list(lemmas)
+        candidates = np.empty(len(lemmas), dtype=object)
+        for i, lemma in enumerate(lemmas):
+            if lemma not in found:
+                found[lemma] = self._index.lookup(lemma) or _NO_CANDIDATES
+            candidates[i] = found[lemma]
+        return candidates
+
+    def match(self, lemmas: Sequence[Dict[int, int]]) -> List[Tuple[str, str, int, int, int]]:
+        """
+        Hits of the lexicons in a sequence of words
+        :param lemmas: candidates of the lemmas of the words (see lemma_ids)
+        :return: (label, clean name, first word, end word (excluded), distance) of the hits by first word
+        """
+        hits = []
+        # next word scanned by each lexicon, after its last hit
+        resume = {}
+        length = len(lemmas)
+        for start in range(length):
+            if not lemmas[start]:
+                continue
+            # longest term of each lexicon starting at the word, with the smallest distance
+            longest = {}
+            # nodes of the trie reached with their distance
+            states = [(self._trie, 0)]
+            position = start
+            while states and position < length:
+                states = [(node[lemma_id], distance + lemma_distance) for node, distance in states
+                          for lemma_id, lemma_distance in lemmas[position].items()
+                          if lemma_id in node and distance + lemma_distance <= self.max_distance]
+                position += 1
+                for node, distance in states:
+                    for label, clean_name in node.get(_TERMS, {}).items():
+                        if label not in longest or longest[label][1] < position or distance < longest[label][2]:
+                            longest[label] = (clean_name, position, distance)
+            for label, (clean_name, end, distance) in longest.items():
+                if start >= resume.get(label, 0):
+                    hits.append((label, clean_name, start, end, distance))
+                    resume[label] = end
+        return hits
@@ -0,0 +1,288 @@
+# -*- coding:Utf-8 -*-
+"""
+Matcher of several labeled lexicons in a single pass.
+The terms of all the lexicons (cinema, offensive, personal lexicons) are in one character trie whose nodes give
+the lexicons ending there, a line is scanned once whatever the number of lexicons.
+The hits of each lexicon are those flashtext would give with the lexicon alone (see find_voc.build_keyword_processor):
+longest term starting at a word, scan resumed after it, words delimited by the characters which are not ASCII letters,
+digits or "_", case ignored. The lexicons are scanned together: the trie is walked once from each start of word
+and each lexicon takes its longest term of the walk.
+The lemmatized lexicons are matched on the words rather than on the characters (LemmaMatcher): the terms are
+sequences of ids of lemmas in a trie, walked over the ids of the lemmas of the words of a line, the hits are
+spans of words (a term matches whole lemmas, never a part of a lemma)
+"""
+import heapq
+import string
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from flashtext import KeywordProcessor
+import numpy as np
+
+# Characters of the words, the other ones end a term (as in flashtext)
+WORD_CHARACTERS = frozenset(string.digits + string.ascii_letters + "_")
+# Key of the terms ending on a node of the trie: clean name of the term by label of lexicon
+_TERMS = "_terms_"
+# Id of the lemmas which are in no term (and of the missing lemmas)
+UNKNOWN_LEMMA = -1
+
+
+class LexiconMatcher:
+    """
+    Trie of the terms of labeled lexicons, see the module documentation
+    """
+
+    def __init__(self):
+        self._trie = {}
+        # labels of the lexicons, in the order they were added
+        self.labels = []
+
+    def add_keyword(self, label: str, keyword: str, clean_name: str = None) -> None:
+        """
+        Add a term to a lexicon
+        :param label: label of the lexicon (ex: cinema)
+        :param keyword: term
+        :param clean_name: name given back for the term in its hits, the term if None
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        node = self._trie
+        for character in keyword.lower():
+            node = node.setdefault(character, {})
+        node.setdefault(_TERMS, {})[label] = clean_name if clean_name else keyword
+
+    def add_keywords(self, label: str, keywords: Iterable[str]) -> None:
+        """
+        Add terms to a lexicon, a lexicon without terms is kept (its hits are empty)
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        for keyword in keywords:
+            self.add_keyword(label, keyword)
+
+    def add_keyword_processor(self, label: str, keyword_processor: KeywordProcessor) -> None:
+        """
+        Add the terms of a flashtext index (see find_voc.build_keyword_processor) as a lexicon
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        for keyword, clean_name in keyword_processor.get_all_keywords().items():
+            self.add_keyword(label, keyword, clean_name)
+
+    def _walk(self, text: str, start: int) -> Dict[str, Tuple[str, int]]:
+        """
+        Longest term of each lexicon starting at a position, the term must be followed by the end of the text
+        or by a character which is not a word character
+        :return: clean name and end of the term by label
+        """
+        longest = {}
+        node = self._trie
+        position = start
+        length = len(text)
+        while True:
+            if _TERMS in node and (position == length or text[position] not in WORD_CHARACTERS):
+                for label, clean_name in node[_TERMS].items():
+                    longest[label] = (clean_name, position)
+            if position == length or text[position] not in node:
+                return longest
+            node = node[text[position]]
+            position += 1
+
+    def extract_keywords(self, sentence: str, span_info: bool = False) -> list:
+        """
+        Hits of the lexicons in a text, in the format of flashtext with the label of the lexicon first
+        :param sentence: text to scan
+        :param span_info: give the offsets of the hits
+        :return: (label, clean name, start, end) of the hits by start (or (label, clean name) without span_info)
+        """
+        if not sentence or not self.labels:
+            return []
+        text = sentence.lower()
+        length = len(text)
+
+        hits = []
+        # next start of the scan of the lexicons, the lexicons at the same position are walked together and
+        # move together while none of them has a term: a line costs the same whatever the number of lexicons
+        waiting = {0: [list(self.labels)]}
+        starts = [0]
+
+        def resume(position: int, labels: List[str]) -> None:
+            if position not in waiting:
+                waiting[position] = []
+                heapq.heappush(starts, position)
+            waiting[position].append(labels)
+
+        while starts:
+            start = heapq.heappop(starts)
+            groups = waiting.pop(start)
+            labels = groups[0] if len(groups) == 1 else [label for group in groups for label in group]
+            if start >= length:
+                continue
+            longest = self._walk(text, start)
+            # a lexicon without term here resumes after the end of the word
+            word_end = start
+            while word_end < length and text[word_end] in WORD_CHARACTERS:
+                word_end += 1
+            if not longest:
+                resume(word_end + 1, labels)
+                continue
+
+            others = []
+            for label in labels:
+                if label in longest:
+                    clean_name, end = longest[label]
+                    hits.append((label, clean_name, start, end))
+                    resume(end + 1, [label])
+                else:
+                    others.append(label)
+            if others:
+                resume(word_end + 1, others)
+
+        if span_info:
+            return hits
+        return [(label, clean_name) for label, clean_name, _, _ in hits]
+
+
+class LemmaMatcher:
+    """
+    Trie of the lemmatized terms of labeled lexicons over ids of lemmas, see the module documentation.
+    The hits of a lexicon are those of flashtext over the lemmas of the words: longest term starting at a word,
+    scan resumed after it, case ignored
+    """
+
+    def __init__(self):
+        # ids of the lemmas of the terms (lower case), the edges of the trie are ids
+        self._ids = {}
+        self._trie = {}
+        # labels of the lexicons, in the order they were added
+        self.labels = []
+
+    def add_term(self, label: str, lemmas: Sequence[str], clean_name: str = None) -> None:
+        """
+        Add a term to a lexicon
+        :param label: label of the lexicon (ex: cinema)
+        :param lemmas: lemmas of the words of the term
+        :param clean_name: name given back for the term in its hits, its lemmas separated by spaces if None
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        node = self._trie
+        for lemma in lemmas:
+            node = node.setdefault(self._lemma_id(lemma.lower()), {})
+        node.setdefault(_TERMS, {})[label] = clean_name if clean_name else " ".join(lemmas)
+
+    def _lemma_id(self, lemma: str) -> int:
+        # id of a lemma of the terms, given to the new lemmas in order
+        if lemma not in self._ids:
+            self._ids[lemma] = len(self._ids)
+        return self._ids[lemma]
+
+    def add_terms(self, label: str, terms: Iterable[str]) -> None:
+        """
+        Add lemmatized terms to a lexicon, a lexicon without terms is kept (its hits are empty)
+        :param terms: terms as their lemmas separated by spaces (see find_voc.lemmatize_lexicon)
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        for term in terms:
+            self.add_term(label, term.split(" "), term)
+
+    def add_keyword_processor(self, label: str, keyword_processor: KeywordProcessor) -> None:
+        """
+        Add the terms of a flashtext index of lemmatized terms (see find_voc.build_keyword_processor) as a lexicon
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        for keyword, clean_name in keyword_processor.get_all_keywords().items():
+            self.add_term(label, keyword.split(" "), clean_name)
+
+    def add_matcher(self, label: str, matcher: "LemmaMatcher", source_label: str = None) -> None:
+        """
+        Add the terms of a lexicon of another matcher (ex: the matcher of a single lexicon, see terms) as a lexicon
+        :param source_label: label of the lexicon in the other matcher
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        for lemmas, clean_name in matcher.terms(source_label):
+            self.add_term(label, lemmas, clean_name)
+
+    def add_trie(self, label: str, vocabulary: Sequence[str], node_edges: Sequence[int], edge_lemmas: Sequence[int],
+                 edge_targets: Sequence[int], node_terms: Sequence[int], clean_names: Sequence[str]) -> None:
+        """
+        Add a lexicon given as a flat trie of ids of lemmas (see find_voc.artifact), the nodes of the trie are
+        merged into those of the matcher without going through the terms
+        :param vocabulary: lemmas of the trie, the id of a lemma is its index
+        :param node_edges: edges of each node (node_edges[n]:node_edges[n + 1]), the root is the node 0
+        :param edge_lemmas: id of the lemma of each edge
+        :param edge_targets: node reached by each edge
+        :param node_terms: term ending on each node (-1 if none)
+        :param clean_names: name of each term
+        """
+        if label not in self.labels:
+            self.labels.append(label)
+        ids = [self._lemma_id(lemma.lower()) for lemma in vocabulary]
+        stack = [(0, self._trie)]
+        while stack:
+            node_id, node = stack.pop()
+            if node_terms[node_id] != -1:
+                node.setdefault(_TERMS, {})[label] = clean_names[node_terms[node_id]]
+            for edge in range(node_edges[node_id], node_edges[node_id + 1]):
+                stack.append((edge_targets[edge], node.setdefault(ids[edge_lemmas[edge]], {})))
+
+    def terms(self, label: str = None) -> List[Tuple[Tuple[str, ...], str]]:
+        """
+        Terms of a lexicon
+        :param label: label of the lexicon
+        :return: lemmas and clean name of each term
+        """
+        lemmas = {lemma_id: lemma for lemma, lemma_id in self._ids.items()}
+        found = []
+        stack = [(self._trie, ())]
+        while stack:
+            node, path = stack.pop()
+            for key, child in node.items():
+                if key == _TERMS:
+                    if label in child:
+                        found.append((path, child[label]))
+                else:
+                    stack.append((child, path + (lemmas[key],)))
+        return found
+
+    def lemma_ids(self, lemmas: Iterable[str]) -> np.ndarray:
+        """
+        Ids of lemmas in the matcher
+        :param lemmas: lemmas (or None for a missing lemma), ex: the vocabulary of a token table
+        :return: id of each lemma, UNKNOWN_LEMMA if it is in no term
+        """
+        ids = self._ids
+        return np.array([UNKNOWN_LEMMA if lemma is None else ids.get(lemma.lower(), UNKNOWN_LEMMA)
+                         for lemma in lemmas], dtype=np.int32)
+
+    def match(self, lemmas: Sequence[int]) -> List[Tuple[str, str, int, int]]:
+        """
+        Hits of the lexicons in a sequence of words
+        :param lemmas: ids of the lemmas of the words (see lemma_ids)
+        :return: (label, clean name, first word, end word (excluded)) of the hits by first word
+        """
+        hits = []
+        # next word scanned by each lexicon, after its last hit
+        resume = {}
+        trie = self._trie
+        length = len(lemmas)
+        for start, lemma in enumerate(lemmas):
+            if lemma not in trie:
+                continue
+            # longest term of each lexicon starting at the word
+            longest = {}
+            node = trie
+            position = start
+            while position < length and lemmas[position] in node:
+                node = node[lemmas[position]]
+                position += 1
+                if _TERMS in node:
+                    for label, clean_name in node[_TERMS].items():
+                        longest[label] = (clean_name, position)
+            for label, (clean_name, end) in longest.items():
+                if start >= resume.get(label, 0):
+                    hits.append((label, clean_name, start, end))
+                    resume[label] = end
+        return hits
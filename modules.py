@@ -3,9 +3,16 @@ Script that contains the code related for all checks that need to be performed
 to make sure video descriptions (VDs) comply with quality requirements
 """
 
+import os
 from typing import Any, Dict, List
 from configparser import ConfigParser
 
+import numpy as np
+
+from engine.token_table import TokenTable
+
+# Stanza annotations needed by the length feature (sentences and words)
+LENGTH_REQUIRED_PROCESSORS = {"tokenize", "mwt"}
 
 def check_length(docs: dict, max_length: int) -> dict:
     """
@@ -43,21 +50,48 @@ def check_length(docs: dict, max_length: int) -> dict:
     return results
 
 
+def check_length_table(table: TokenTable, max_length: int) -> dict:
+    """
+    check_length over the token table of the VD (see engine.token_table)
+    """
+    num_words = np.diff(table.sentence_words).tolist()
+    lengths = (table.sentence_end - table.sentence_start).tolist()
+    results = {}
+    for i in range(len(table)):
+        offset = 0
+        results_vd = []
+        for j, sentence in enumerate(table.line_sentence_range(i)):
+            results_vd.append(
+                {
+                    "id": j,
+                    "offset": {"start": offset, "end": offset + lengths[sentence]},
+                    "num_words": num_words[sentence],
+                    "warning": int(num_words[sentence] > max_length),
+                }
+            )
+            offset += lengths[sentence] + 1
+
+        results[i] = results_vd
+
+    return results
+
+
 def record_outputs(docs: list, results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Record the results of the checks performed on all VDs
 
     Args:
-        docs: List of vds contained in a VD
+        docs: List of vds contained in a VD (Stanza documents or their TokenTable)
         results: Dictionary Key " document" and List of results by VD
     """
+    texts = docs.texts if isinstance(docs, TokenTable) else [doc.text for doc in docs]
     out_json = {"documents": []}
-    for i, doc in enumerate(docs):
+    for i, text in enumerate(texts):
 
         # Record global information
         out_json_en_cours = {
             "id": i,
-            "text": docs[i].text,
+            "text": text,
             "features": {}}
 
         # add the results of the checks(feature) performed on each vds
@@ -89,6 +123,39 @@ def load_config(file_config: str) -> dict:
     dic_param['span_aste_model_path_fr'] =config.get("span_aste", "pre_trained_path_fr")
     dic_param['lang_detection_pretrained_model'] = config.get("input", "lang_detection_pretrained_model")
     dic_param['lang_detection_max_num_chars'] = int(config.get("input", "lang_detection_max_num_chars"))
+    dic_param['preload_languages'] = [lang.strip().upper()
+                                      for lang in config.get("engine", "preload_languages", fallback="").split(",")
+                                      if lang.strip()]
+    dic_param['executor'] = config.get("engine", "executor", fallback="thread")
+    dic_param['stanza_offline'] = config.getboolean("engine", "stanza_offline", fallback=False)
+    dic_param['max_sessions'] = config.getint("engine", "max_sessions", fallback=100)
+    dic_param['session_ttl'] = config.getfloat("engine", "session_ttl", fallback=3600)
+    dic_param['profile_interval'] = config.getfloat("engine", "profile_interval", fallback=0.005)
+    dic_param['profile_dir'] = config.get("engine", "profile_dir", fallback="") or None
+    dic_param['log_sample_rate'] = config.getfloat("engine", "log_sample_rate", fallback=0.1)
+    dic_param['job_workers'] = config.getint("engine", "job_workers", fallback=2)
+    dic_param['job_queue_size'] = config.getint("engine", "job_queue_size", fallback=20)
+    dic_param['job_ttl'] = config.getfloat("engine", "job_ttl", fallback=3600)
+    dic_param['stream_chunk_size'] = config.getint("engine", "stream_chunk_size", fallback=200)
+    dic_param['annotation_cache_size'] = config.getint("engine", "annotation_cache_size", fallback=10000)
+    dic_param['annotation_cache_dir'] = config.get("engine", "annotation_cache_dir", fallback="") or None
+    dic_param['lexicon_registry_size'] = config.getint("engine", "lexicon_registry_size", fallback=100)
+    dic_param['lexicon_cache_size'] = config.getint("engine", "lexicon_cache_size", fallback=32)
+    # a relative directory of artifacts is relative to the config file
+    lexicon_artifact_dir = config.get("engine", "lexicon_artifact_dir", fallback="")
+    dic_param['lexicon_artifact_dir'] = os.path.join(os.path.dirname(os.path.abspath(file_config)),
+                                                     lexicon_artifact_dir) if lexicon_artifact_dir else None
+    dic_param['lexicon_max_distance'] = config.getint("engine", "lexicon_max_distance", fallback=0)
+    dic_param['result_cache'] = config.get("engine", "result_cache", fallback="memory")
+    dic_param['result_cache_size'] = config.getint("engine", "result_cache_size", fallback=1000)
+    result_cache_ttl = config.get("engine", "result_cache_ttl", fallback="")
+    dic_param['result_cache_ttl'] = float(result_cache_ttl) if result_cache_ttl else None
+    dic_param['result_cache_dir'] = config.get("engine", "result_cache_dir", fallback="") or None
+    dic_param['result_cache_url'] = config.get("engine", "result_cache_url", fallback="") or None
+    emotion_timeout = config.get("engine", "emotion_timeout", fallback="")
+    dic_param['emotion_timeout'] = float(emotion_timeout) if emotion_timeout else None
+    max_workers = config.get("engine", "max_workers", fallback="")
+    dic_param['max_workers'] = int(max_workers) if max_workers else None
 
 
     return dic_param
@@ -3,6 +3,21 @@
 Flag non-third-person pronouns
 """
 
+import numpy as np
+
+from engine.token_table import MISSING, TokenTable, UPOS_CODES
+
+# Stanza annotations needed by the detection (pos-tags, features and lemmas of the words)
+REQUIRED_PROCESSORS = {"tokenize", "mwt", "pos", "lemma"}
+
+# French special cases (mistakes of Stanza, see detect_non_third_person) as rules on the words:
+# lemma of the word, the word must begin its sentence, text the sentence must contain
+SEQUENCE_RULES = (
+    # "donne-moi" is lemmatized as a single word
+    ("donne-moi", False, "-moi"),
+    # "Tu" of "Tu peux + infinitive" is lemmatized as "de le" at the beginning of the sentence
+    ("de", True, "Tu"),
+)
 
 
 def detect_non_third_person(documents) -> dict:
@@ -63,3 +78,51 @@ def detect_non_third_person(documents) -> dict:
 
 
     return outputs
+
+
+def detect_non_third_person_table(table: TokenTable) -> dict:
+    """
+    detect_non_third_person over the token table of the VD (see engine.token_table)
+    The flags of all the words of the VD are computed at once with the arrays of the table:
+    pos-tags and bitmasks of the features, then the SEQUENCE_RULES of the French special cases
+    :param table: token table of the lines of the VD
+    :return dictionary containing detected non-third-person pronouns for each document (vd_lines).
+    """
+    flagged = non_third_person_mask(table)
+    rows = np.flatnonzero(flagged)
+    tokens = table.token[rows]
+    texts = [table.strings[text] for text in table.token_text[tokens].tolist()]
+    starts = table.token_start[tokens].tolist()
+    ends = table.token_end[tokens].tolist()
+
+    outputs = {i_doc: [] for i_doc in range(len(table))}
+    for line, text, start, end in zip(table.line[rows].tolist(), texts, starts, ends):
+        outputs[line].append({"token": {"text": text, "offset_start": None if start == MISSING else start,
+                                        "offset_end": None if end == MISSING else end}})
+
+    return outputs
+
+
+def non_third_person_mask(table: TokenTable) -> np.ndarray:
+    """
+    Words of the token table which are not at the third person
+    :param table: token table of the lines of the VD
+    :return: boolean array, True for the words to flag
+    """
+    flagged = (table.upos == UPOS_CODES["PRON"]) & (table.has_feature("Person=1") | table.has_feature("Person=2"))
+    flagged |= (table.upos == UPOS_CODES["DET"]) & (table.has_feature("Person[psor]=1")
+                                                    | table.has_feature("Person[psor]=2"))
+
+    for lemma, first_word, sentence_text in SEQUENCE_RULES:
+        lemma_id = table.string_id(lemma)
+        if lemma_id == MISSING:
+            continue
+        candidates = table.lemma == lemma_id
+        if first_word:
+            candidates &= table.index == 0
+        candidates &= ~flagged
+        # the text of the sentence is only checked for the few candidates
+        for row in np.flatnonzero(candidates).tolist():
+            flagged[row] = sentence_text in table.sentence_text(table.sentence[row])
+
+    return flagged
@@ -5,6 +5,16 @@ Two moods possibles : regular and strict
 Strict mode : flag on periphrastic verbs like "be going to + V" (future),
 "venir de + V" (past), "aller + V" (future)
 """
+import bisect
+
+from engine.token_table import FEATURE_BITS, MISSING, NO_UPOS, TokenTable, UPOS, UPOS_CODES, feature_mask
+
+# Stanza annotations needed by the detection (verbal expressions are built with the dependency heads)
+REQUIRED_PROCESSORS = {"tokenize", "mwt", "pos", "lemma", "depparse"}
+
+# Codes and feature bits tested by match_verbal_expressions
+_VERB, _AUX, _ADP = UPOS_CODES["VERB"], UPOS_CODES["AUX"], UPOS_CODES["ADP"]
+_VERB_FORM, _INFINITIVE = FEATURE_BITS["VerbForm"], FEATURE_BITS["VerbForm=Inf"]
 
 
 def detect_non_present_tense(
@@ -38,67 +48,12 @@ def detect_non_present_tense(
             express_verb_sentence = create_verbal_expression(sentence)
 
             for i, expression in enumerate(express_verb_sentence):
-                is_not_present = False
                 # on fait une liste de pos et une liste de feats
                 lemma = [word.lemma for word in expression]
                 feats = [w.feats if w.feats else "" for w in expression]
                 pos = [w.upos for w in expression]
 
-                # First case : auxiliary verb at the beginning of the expression
-                if pos[0] == "AUX":
-
-                    # Tense is not present
-                    if "Tense=Pres" not in feats[0]:
-
-                        # This is not an infinitive
-                        # (this condition should be here and not in the previous condition)
-                        if "VerbForm=Inf" not in feats[0]:
-                            is_not_present = True
-
-                    # Tense is not in indicative mood
-                    elif "Mood=Ind" not in feats[0]:
-                        is_not_present = True
-
-                    # Case like perfect tense (there is a verb after the auxiliary)
-                    elif lemma[0] == "avoir" or lemma[0] == "have" and len(expression) > 1:
-                        is_not_present = True
-
-                    # Case :  "est allé" ou "is going"
-                    elif (lemma[0] == "être" or lemma[0] == "be") and len(expression) > 1:
-                        if lemma[1] == "aller":
-                            is_not_present = True
-                        # "is going" alone is ok
-                        # "is going to + V" is flagged
-                        elif len(expression) > 3:
-                            if lemma[1] == "go" and lemma[2] == "to" and "VerbForm=Inf" in feats[3]:
-                                is_not_present = True
-
-                # Second case : verb at the beginning of the expression:
-                elif pos[0] == "VERB":
-
-                    # Tense is not present, not an infinitive,
-                    # not a perfect tense used alone
-                    # not a gerondive ( like " Watching the movie, Paul is sitting on the couch")
-                    if "Tense=Pres" not in feats[0] and \
-                            "VerbForm=Inf" not in feats[0] and \
-                            "VerbForm=Part" not in feats[0] and \
-                            "VerbForm=Ger" not in feats[0]:
-
-                        # for the perfect tense used alone
-                        # ex : He flicks it shut - SHUT = VERB should not be flagged
-                        # distinctive sign is = Mood is absent
-                        if "Mood" in feats[0]:
-                            is_not_present = True
-
-                    # Strict mode (periphrastic tense) :  "venir de"
-                    elif lemma[0] == "venir" and len(expression) > 1 and strict_mode:
-                        is_not_present = True
-
-                    # Strict mode (periphrastic tense): "aller"
-                    elif lemma[0] == "aller" and len(expression) > 1 and strict_mode:
-                        is_not_present = True
-
-                if is_not_present:
+                if is_not_present_expression(lemma, feats, pos, strict_mode):
 
                     # Tokens of same verbal expression  are recorded with the same "ref_token"
                     for word in expression:
@@ -122,6 +77,74 @@ def detect_non_present_tense(
     return outputs
 
 
+def is_not_present_expression(lemma: list, feats: list, pos: list, strict_mode: bool) -> bool:
+    """
+    Check if a verbal expression is in a tense other than present indicative mood
+    :param lemma: lemmas of the words of the expression
+    :param feats: features of the words ("" if none)
+    :param pos: pos-tags of the words
+    :param strict_mode: flag the periphrastic verbs
+    :return: True if the expression is not in the present tense
+    """
+    is_not_present = False
+
+    # First case : auxiliary verb at the beginning of the expression
+    if pos[0] == "AUX":
+
+        # Tense is not present
+        if "Tense=Pres" not in feats[0]:
+
+            # This is not an infinitive
+            # (this condition should be here and not in the previous condition)
+            if "VerbForm=Inf" not in feats[0]:
+                is_not_present = True
+
+        # Tense is not in indicative mood
+        elif "Mood=Ind" not in feats[0]:
+            is_not_present = True
+
+        # Case like perfect tense (there is a verb after the auxiliary)
+        elif lemma[0] == "avoir" or lemma[0] == "have" and len(lemma) > 1:
+            is_not_present = True
+
+        # Case :  "est allé" ou "is going"
+        elif (lemma[0] == "être" or lemma[0] == "be") and len(lemma) > 1:
+            if lemma[1] == "aller":
+                is_not_present = True
+            # "is going" alone is ok
+            # "is going to + V" is flagged
+            elif len(lemma) > 3:
+                if lemma[1] == "go" and lemma[2] == "to" and "VerbForm=Inf" in feats[3]:
+                    is_not_present = True
+
+    # Second case : verb at the beginning of the expression:
+    elif pos[0] == "VERB":
+
+        # Tense is not present, not an infinitive,
+        # not a perfect tense used alone
+        # not a gerondive ( like " Watching the movie, Paul is sitting on the couch")
+        if "Tense=Pres" not in feats[0] and \
+                "VerbForm=Inf" not in feats[0] and \
+                "VerbForm=Part" not in feats[0] and \
+                "VerbForm=Ger" not in feats[0]:
+
+            # for the perfect tense used alone
+            # ex : He flicks it shut - SHUT = VERB should not be flagged
+            # distinctive sign is = Mood is absent
+            if "Mood" in feats[0]:
+                is_not_present = True
+
+        # Strict mode (periphrastic tense) :  "venir de"
+        elif lemma[0] == "venir" and len(lemma) > 1 and strict_mode:
+            is_not_present = True
+
+        # Strict mode (periphrastic tense): "aller"
+        elif lemma[0] == "aller" and len(lemma) > 1 and strict_mode:
+            is_not_present = True
+
+    return is_not_present
+
+
 def create_verbal_expression(sentence) -> list:
     """
     Creates a list of verbal expressions in a sentence.
@@ -133,170 +156,172 @@ def create_verbal_expression(sentence) -> list:
     :param sentence: Stanza Sentence
     :return: list of verbal expressions
     """
+    words = sentence.words
+    expressions = match_verbal_expressions([UPOS_CODES.get(word.upos, NO_UPOS) for word in words],
+                                           [word.lemma for word in words],
+                                           [feature_mask(word.feats) for word in words],
+                                           [word.head if word.head is not None else MISSING for word in words])
+
+    return [[words[k] for k in expression] for expression in expressions]
 
-    express_verb_sentence = []
-    for i in range(len(sentence.words)):
-        word = sentence.words[i]
+
+def match_verbal_expressions(upos: list, lemmas: list, masks: list, heads: list) -> list:
+    """
+    Verbal expressions of a sentence (see create_verbal_expression), in a single pass over its words.
+    The children of each head are indexed first, so an auxiliary is joined to the verbs sharing its head
+    without scanning the rest of the sentence. An expression whose words are all in a larger one
+    (its span is inside the span of the larger one) is dropped,
+    two side by side expressions which share a same word are fused
+    :param upos: UPOS codes of the words (see engine.token_table)
+    :param lemmas: lemmas of the words
+    :param masks: bitmasks of the features of the words (see engine.token_table.feature_mask)
+    :param heads: heads of the words (id of the head, 0 for the root)
+    :return: list of verbal expressions (positions of the words in the sentence, in order)
+    """
+    num_words = len(upos)
+    starts = [i for i, code in enumerate(upos) if code == _VERB or code == _AUX]
+    if not starts:
+        return []
+
+    # children with a verb form of each head (id of the head, 0 for the root), in order of the sentence
+    children = {}
+    for k, mask in enumerate(masks):
+        if mask & _VERB_FORM:
+            children.setdefault(heads[k], []).append(k)
+    # the search of an auxiliary stops at the first preposition after it
+    # if it does not : "être capable de manger" ---> "être manger"
+    prepositions = [k for k, code in enumerate(upos) if code == _ADP]
+
+    candidates = []
+    for i in starts:
+        verbal_expression = [i]
 
         # CASE 1 : VERBE is the beginning of the expression
-        if word.upos == "VERB":
-            verbal_expression = [word]
-
-            # VENIR DE + V.inf
-            if word.lemma == "venir" and sentence.words[i + 1].lemma == "de":
-                verbal_expression.append(sentence.words[i + 1])
-
-                tete_prep = i + 1
-                search_span = sentence.words[i + 2:]
-                for w in search_span:
-                    if w.feats and "VerbForm=Inf" in w.feats and w.head == tete_prep:
-                        verbal_expression.append(w)
+        if upos[i] == _VERB:
+
+            # VENIR DE + V.inf (the infinitive depends on "venir")
+            if lemmas[i] == "venir" and i + 1 < num_words and lemmas[i + 1] == "de":
+                verbal_expression.append(i + 1)
+                for k in children.get(i + 1, ()):
+                    if k > i + 1 and masks[k] & _INFINITIVE:
+                        verbal_expression.append(k)
                         break
 
             # ALLER + V.inf
-            elif word.lemma == "aller":
-                if sentence.words[i + 1].feats and "VerbForm=Inf" in sentence.words[i + 1].feats:
-                    verbal_expression.append(sentence.words[i + 1])
-
-            # Check :if there is a similar expression, we choose the longest one
-            express_verb_sentence = keep_longest(verbal_expression,
-                                                 express_verb_sentence)
+            elif lemmas[i] == "aller" and i + 1 < num_words and masks[i + 1] & _INFINITIVE:
+                verbal_expression.append(i + 1)
 
         # CASE 2 : AUXILIAIRE is the beginning of the expression
-
-        elif word.upos == "AUX":
-            tete = word.head
-            verbal_expression = [word]
-
-            search_start = min(i + 1, len(sentence.words))
-            search_span = sentence.words[search_start:]
-
-            for j, w in enumerate(search_span):
-
-                # If there is a preposition, we stop the search
-                # if we do not : "être capable de manger" ---> "être manger"
-                if w.upos == "ADP":
+        else:
+            tete = heads[i]
+            p = bisect.bisect_right(prepositions, i)
+            stop = prepositions[p] if p < len(prepositions) else num_words
+
+            # we concatenate all the verbs with the same head, and the head itself
+            # (if/as the auxiliary is not the head of the expression)
+            # ex : Paul is watching the movie : head is "watching" and not "is"
+            head_position = tete - 1 if i < tete - 1 < stop and masks[tete - 1] & _VERB_FORM else None
+            for k in children.get(tete, ()):
+                if k >= stop:
                     break
+                if k <= i:
+                    continue
+                if head_position is not None and head_position < k:
+                    verbal_expression.append(head_position)
+                    head_position = None
+
+                # Special case : "is going to + verbe"
+                # the "to" is required only if there is a verb after it
+                if lemmas[verbal_expression[-1]] == "go" and k - 1 > verbal_expression[-1] and lemmas[k - 1] == "to":
+                    verbal_expression.append(k - 1)
+
+                verbal_expression.append(k)
+            if head_position is not None:
+                verbal_expression.append(head_position)
+
+        candidates.append(verbal_expression)
+
+    # Check : if an expression is in a larger one, we keep the larger one.
+    # The candidates start on different words, so only a longer one can contain another one,
+    # and it contains its first word
+    containing = {}
+    for c, verbal_expression in enumerate(candidates):
+        if len(verbal_expression) > 1:
+            for k in verbal_expression:
+                containing.setdefault(k, []).append(c)
 
-                # we concatenate all the verbs with the same head
-                if w.feats and "VerbForm" in w.feats and w.head == tete:
-
-                    # Special case : "is going to + verbe"
-                    # the "to" is required only if there is a verb after it
-                    if verbal_expression[-1].lemma == "go" and search_span[j - 1].lemma == "to":
-                        verbal_expression.append(search_span[j - 1])
-
-                    verbal_expression.append(w)
-
-                # we concatenate also the head
-                # (if/as the auxiliary is not the head of the expression)
-                # ex : Paul is watching the movie : head is "watching" and not "is"
-                elif w.feats and "VerbForm" in w.feats and w.id == tete:
-                    verbal_expression.append(w)
-
-            # Check :if there is a similar expression, we choose the longest one
-            if len(verbal_expression) >= 1:
-                express_verb_sentence = keep_longest(verbal_expression,
-                                                     express_verb_sentence)
+    express_verb_sentence = []
+    for c, verbal_expression in enumerate(candidates):
+        start, end = verbal_expression[0], verbal_expression[-1]
+        for other in containing.get(start, ()):
+            larger = candidates[other]
+            if len(larger) > len(verbal_expression) and larger[0] <= start and end <= larger[-1] \
+                    and set(verbal_expression).issubset(larger):
+                break
+        else:
+            express_verb_sentence.append(verbal_expression)
 
     # Special final check :
     # if there is two side by side expressions which share a same word, we fuse them
     # ex :  être aller / aller manger = être aller manger
-    new_express_verb_sentence = fuse_side_by_side(express_verb_sentence)
+    new_express_verb_sentence = []
+    for verbal_expression in express_verb_sentence:
+        if new_express_verb_sentence and new_express_verb_sentence[-1][-1] == verbal_expression[0]:
+            new_express_verb_sentence[-1] = new_express_verb_sentence[-1] + verbal_expression[1:]
+        else:
+            new_express_verb_sentence.append(verbal_expression)
 
     return new_express_verb_sentence
 
 
-def fuse_side_by_side(express_verb_sentence: list) -> list:
+def detect_non_present_tense_table(table: TokenTable, strict_mode: bool) -> dict:
     """
-    In a list if there are two side by side expressions
-    with a same shared word ( the end for one and the beginning for the next)
-    we fuse them
-    :param express_verb_sentence: liste des expressions verbales
-    :return: liste des expressions verbales
+    detect_non_present_tense over the token table of the VD (see engine.token_table)
+    :param table: token table of the lines of the VD
+    :param strict_mode: If True, adds flag on periphrastic verbs like "be going to + V", "venir de + V", "aller + V"
+    :return: detected non-present tense words for each document (vd lines)
     """
+    # columns of the table as lists, the vocabulary ends with None for the missing strings
+    vocabulary = table.strings + [None]
+    upos = table.upos.tolist()
+    lemmas = [vocabulary[lemma] for lemma in table.lemma.tolist()]
+    masks = table.feats_mask.tolist()
+    heads = table.head.tolist()
+    sentence_words = table.sentence_words.tolist()
+    feats = [vocabulary[feats] or "" for feats in table.feats.tolist()]
+    word_tokens = table.token.tolist()
 
-    new_express_verb_sentence = []
-
-    # more than a verbal expression in the list
-    if len(express_verb_sentence) > 1:
-        new_express = []
-        for express_ver in express_verb_sentence:
-
-            # first occurrence of the expression
-            if new_express == []:
-                new_express = express_ver
-
-            # for the next occurrences
-            else:
-
-                # if this is the same id of the last item in new_express
-                if new_express[-1].id == express_ver[0].id:
-                    # we jump the current word
-                    express_ver.pop(0)
-
-                    # and we concatenate the rest of the expression
-                    for element in express_ver:
-                        new_express.append(element)
-
-                # else this is a new expression, we record the old one
-                else:
-                    new_express_verb_sentence.append(new_express)
-                    new_express = [element for element in express_ver]
-
-        # Add the last verbal expression
-        new_express_verb_sentence.append(new_express)
-
-    else:
-        new_express_verb_sentence = express_verb_sentence
-
-    return new_express_verb_sentence
-
+    outputs = {}
+    for i_doc in range(len(table)):
+        non_present_tense = []
 
-def keep_longest(new_expression: list, express_verb_sentence: list) -> list:
-    """
-    Check if the expression is already in the list and choose the longest one
-    :param new_expression:verbal expression to analyze (list of words)
-    :param express_verb_sentence:list of verbal expressions
-    :return:  express_verb_sentence : cleaned list of verbal expressions
-    """
+        for j, sentence in enumerate(table.line_sentence_range(i_doc)):
+            start, end = sentence_words[sentence], sentence_words[sentence + 1]
+            expressions = match_verbal_expressions(upos[start:end], lemmas[start:end], masks[start:end],
+                                                   heads[start:end])
+            for i, expression in enumerate(expressions):
+                rows = [start + k for k in expression]
+                pos = [UPOS[upos[row]] if upos[row] != NO_UPOS else None for row in rows]
+
+                if is_not_present_expression([lemmas[row] for row in rows], [feats[row] for row in rows], pos,
+                                             strict_mode):
+                    for row in rows:
+                        token = word_tokens[row]
+                        non_present_tense.append(
+                            {
+                                "token": {
+                                    "text": table.strings[table.token_text[token]],
+                                    "offset_start": table.offset(table.token_start, token),
+                                    "offset_end": table.offset(table.token_end, token),
+                                    "ref_token": (j, i)  # number of verbal expression
+                                }
+                            }
+                        )
 
-    flag = False
-    if new_expression:
+                    outputs[i_doc] = non_present_tense
 
-        if not express_verb_sentence:
-            express_verb_sentence.append(new_expression)
+        if i_doc not in outputs:
+            outputs[i_doc] = []
 
-        else:
+    return outputs
 
-            for expression in express_verb_sentence:
-                expression_string = " ".join([w.text for w in expression])
-                new_expression_string = " ".join([w.text for w in new_expression])
-
-                # CASE 1:  new expression is the same as the recorded one
-                # we do nothing (we keep the recorded one)
-                if expression_string == new_expression_string:
-
-                    # (same offset)
-                    if expression[0].start_char == new_expression[0].start_char and \
-                            expression[-1].end_char == new_expression[-1].end_char:
-                        flag = True
-
-                # CASE 2 : new expression is smaller than the recorded one
-                # we do nothing (we keep the recorded one)
-                elif new_expression_string in expression_string:
-                    flag = True
-
-                # CASE 3  : new expression is bigger
-                # we remove the old one and we add the new one
-                elif expression_string in new_expression_string:
-                    express_verb_sentence.remove(expression)
-                    express_verb_sentence.append(new_expression)
-                    flag = True
-
-            # CASE 4 : no recorded expression, this is an entirely new one
-            # we add it to the list
-            if not flag:
-                express_verb_sentence.append(new_expression)
-
-    return express_verb_sentence
@@ -5,7 +5,7 @@ and call the main script
 import os
 from configparser import ConfigParser
 from tests import check_config
-from run import main
+from engine.engine import get_engine
 
 import json
 
@@ -55,10 +55,10 @@ if __name__ == '__main__':
     # window_duplication: int, postag_repetition: list, lemmatizing: bool, strict_mode: bool,
     # max_coref_length: int, with_emotion: bool)
 
-    out_json = main(text, param['max_length'],
-                    param['seuil_duplication'], param['window_duplication'],
-                    param['postag_duplication'], param['lemmatized_cinema'], param['strict_mode_tense'],
-                    param['max_coref_length'], param['with_emotion'])
+    out_json = get_engine().analyze(text, param['max_length'],
+                                    param['seuil_duplication'], param['window_duplication'],
+                                    param['postag_duplication'], param['lemmatized_cinema'],
+                                    param['strict_mode_tense'], param['max_coref_length'], param['with_emotion'])
 
     # Print du fichier de sortie
     with open(param['output_file'], "w", encoding="utf-8") as output_json:
@@ -0,0 +1,75 @@
+"""
+Unit tests for the cache of line annotations
+"""
+
+import tempfile
+import unittest
+
+from stanza import Document
+
+from engine.annotation_cache import AnnotationCache, annotate_with_cache
+
+
+class CountingProcessor:
+    """Annotates each line as a single word and counts the lines it receives"""
+
+    def __init__(self):
+        self.lines = []
+
+    def __call__(self, docs):
+        self.lines.extend(doc.text for doc in docs)
+        return [Document([[{"id": 1, "text": doc.text, "lemma": doc.text.lower(), "upos": "NOUN",
+                            "start_char": 0, "end_char": len(doc.text)}]], text=doc.text) for doc in docs]
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def annotate(self, cache, processor, lines):
+        docs = [Document([], text=line) for line in lines]
+        return annotate_with_cache(cache, processor, docs, "FR", "tokenize,lemma", "1.0")
+
+    def test_repeated_lines(self):
+        """
+        Test that the lines repeated in a VD or already seen are annotated once
+        """
+        cache = AnnotationCache(max_size=10)
+        processor = CountingProcessor()
+
+        docs = self.annotate(cache, processor, ["Il sourit.", "Elle part.", "Il sourit."])
+        self.assertEqual(processor.lines, ["Il sourit.", "Elle part."])
+        self.assertEqual([doc.sentences[0].words[0].lemma for doc in docs], ["il sourit.", "elle part.", "il sourit."])
+
+        self.annotate(cache, processor, ["Elle part."])
+        self.assertEqual(len(processor.lines), 2)
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used lines are evicted from the memory
+        """
+        cache = AnnotationCache(max_size=2)
+        processor = CountingProcessor()
+
+        self.annotate(cache, processor, ["a", "b", "c"])
+        self.assertEqual(cache.stats()["size"], 2)
+        self.annotate(cache, processor, ["a"])
+        self.assertEqual(processor.lines, ["a", "b", "c", "a"])
+
+    def test_disk(self):
+        """
+        Test that the annotations on disk are shared by the caches using the same directory
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            processor = CountingProcessor()
+            self.annotate(AnnotationCache(max_size=10, directory=directory), processor, ["Il sourit."])
+
+            cache = AnnotationCache(max_size=10, directory=directory)
+            docs = self.annotate(cache, processor, ["Il sourit."])
+            self.assertEqual(len(processor.lines), 1)
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertEqual(docs[0].sentences[0].tokens[0].end_char, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
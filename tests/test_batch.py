@@ -0,0 +1,138 @@
+"""
+Unit tests for the analysis of a catalog of VD files from the command line
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from batch import JsonlWriter, Manifest, ParquetWriter, analyze_file, collect_files, run_batch
+
+
+class EchoEngine:
+    """Engine giving back the number of lines of the VD"""
+
+    def analyze(self, text, **parameters):
+        if not text:
+            raise ValueError("empty VD")
+        return {"lines": len(text.split("\n"))}
+
+
+def init_echo_worker(config_path):
+    """Worker without models"""
+
+
+def analyze_echo(path, parameters, engine=None, columnar=False):
+    """Analysis of a file by the EchoEngine, in a worker"""
+    return analyze_file(path, parameters, EchoEngine(), columnar)
+
+
+def analyze_or_crash(path, parameters, engine=None, columnar=False):
+    """Analysis of a file by the EchoEngine, the worker dies on the files named crash"""
+    if "crash" in os.path.basename(path):
+        os._exit(1)
+    return analyze_echo(path, parameters, engine, columnar)
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_collect_files(self):
+        """
+        Test that the files are found in the directories, globs and paths without duplicates
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "films"))
+            for name in ("a.txt", "b.tsv", "notes.md", os.path.join("films", "c.txt")):
+                with open(os.path.join(directory, name), "w", encoding="utf-8") as vd_file:
+                    vd_file.write("Une ligne")
+            paths = collect_files([directory, os.path.join(directory, "*.txt"), os.path.join(directory, "notes.md")])
+            self.assertEqual([os.path.relpath(path, directory) for path in paths],
+                             ["a.txt", "b.tsv", os.path.join("films", "c.txt"), "notes.md"])
+
+    def test_manifest(self):
+        """
+        Test that a new run skips the files done (and unchanged) and retries the files which failed
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, text in (("ok.txt", "Une ligne\nUne autre"), ("empty.txt", "")):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w", encoding="utf-8") as vd_file:
+                    vd_file.write(text)
+
+            manifest = Manifest(os.path.join(directory, "manifest.jsonl"))
+            records = [analyze_file(path, {}, EchoEngine()) for path in paths]
+            self.assertEqual(records[0]["output"], {"lines": 2})
+            self.assertEqual(records[1]["status"], "error")
+            self.assertIn("empty VD", records[1]["error"])
+            for path, record in zip(paths, records):
+                manifest.add(path, record["status"], record["signature"])
+            manifest.close()
+
+            manifest = Manifest(os.path.join(directory, "manifest.jsonl"))
+            self.assertTrue(manifest.is_done(paths[0]))
+            self.assertFalse(manifest.is_done(paths[1]))
+            self.assertTrue(manifest.is_done(paths[1], retry_failed=False))
+            with open(paths[0], "a", encoding="utf-8") as vd_file:
+                vd_file.write("\nChangée")
+            self.assertFalse(manifest.is_done(paths[0]))
+            manifest.close()
+
+    def test_checkpoint(self):
+        """
+        Test that a file is in the manifest only once its record is written in a part
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name in ("a.txt", "b.txt", "c.txt"):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w", encoding="utf-8") as vd_file:
+                    vd_file.write("Une ligne")
+            manifest = Manifest(os.path.join(directory, "manifest.jsonl"))
+            # number of files in the manifest when each record is written
+            checkpointed = []
+
+            class Writer(ParquetWriter):
+                def write(self, record):
+                    checkpointed.append(len(manifest.records))
+                    return super().write(record)
+
+            writer = Writer(os.path.join(directory, "results"), rows_by_part=2)
+            with mock.patch("batch._init_worker", init_echo_worker), mock.patch("batch.analyze_file", analyze_echo):
+                counts = run_batch(paths, writer, manifest, {}, workers=2)
+            manifest.close()
+
+            self.assertEqual(counts, {"ok": 3, "error": 0})
+            self.assertEqual(checkpointed, [0, 0, 2])
+            self.assertEqual(len(os.listdir(writer.directory)), 2)
+            manifest = Manifest(manifest.path)
+            self.assertEqual(sorted(manifest.records), paths)
+            manifest.close()
+
+    def test_worker_death(self):
+        """
+        Test that a worker dying does not stop the run and only fails the file which killed it
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name in ("a.txt", "b.txt", "crash.txt", "d.txt", "e.txt"):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w", encoding="utf-8") as vd_file:
+                    vd_file.write("Une ligne")
+            manifest = Manifest(os.path.join(directory, "manifest.jsonl"))
+            writer = JsonlWriter(os.path.join(directory, "results.jsonl"))
+            with mock.patch("batch._init_worker", init_echo_worker), \
+                    mock.patch("batch.analyze_file", analyze_or_crash):
+                counts = run_batch(paths, writer, manifest, {}, workers=2)
+            writer.close()
+            manifest.close()
+
+            self.assertEqual(counts, {"ok": 4, "error": 1})
+            self.assertEqual({path: record["status"] for path, record in manifest.records.items()},
+                             {path: "error" if "crash" in path else "ok" for path in paths})
+
+
+if __name__ == '__main__':
+    unittest.main()
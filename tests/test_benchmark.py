@@ -0,0 +1,54 @@
+"""
+Unit tests for the generator of synthetic VDs and the statistics of the benchmarks
+"""
+
+import unittest
+
+from benchmark.benchmark import scaling_exponent, summarize
+from benchmark.detectors import compare_implementations
+from benchmark.generator import generate_vd, load_corpus
+from engine.engine import split_lines
+from tests.test_token_table import make_docs
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_generate_vd(self):
+        """
+        Test that the synthetic VDs have the requested number of lines of the corpus and are always the same
+        """
+        for lang in ("FR", "EN"):
+            corpus = set(load_corpus(lang))
+            for vd_format in ("txt", "tsv"):
+                text = generate_vd(lang, 120, vd_format)
+                self.assertEqual(text, generate_vd(lang, 120, vd_format))
+                self.assertNotEqual(text, generate_vd(lang, 120, vd_format, seed=1))
+                lines, clean_text = split_lines(text)
+                self.assertEqual(len(lines), 120)
+                self.assertTrue(set(clean_text.split("\n")) <= corpus)
+
+        with self.assertRaises(ValueError):
+            generate_vd("FR", 10, "srt")
+
+    def test_statistics(self):
+        """
+        Test the median, interquartile range and scaling exponent of the measures
+        """
+        self.assertEqual(summarize([3., 1., 2., 10., 4.]), {"median": 3., "iqr": 2.})
+        self.assertAlmostEqual(scaling_exponent([10, 100, 1000], [0.01, 0.1, 1.]), 1.)
+        self.assertAlmostEqual(scaling_exponent([10, 100, 1000], [0.01, 1., 100.]), 2.)
+
+    def test_compare_implementations(self):
+        """
+        Test that the detectors over the token table are compared with those over the Stanza documents
+        """
+        results = compare_implementations(make_docs(), ["person", "duplication"], repeat=2)
+        self.assertEqual(set(results), {"token_table", "person", "duplication"})
+        for feature in ("person", "duplication"):
+            self.assertTrue(results[feature]["identical"])
+            self.assertGreater(results[feature]["documents"], 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
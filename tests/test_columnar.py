@@ -0,0 +1,75 @@
+"""
+Unit tests for the compact columnar format of the outputs
+"""
+
+import json
+import os
+import unittest
+
+from engine.columnar import from_arrow, to_arrow, to_columnar, to_records
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+OUTPUT_EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "output.example.json")
+
+
+def load_example():
+    with open(OUTPUT_EXAMPLE, encoding="utf-8") as output_file:
+        output = json.load(output_file)
+    output["timings"] = {"annotation": 0.5}
+    # a line without the cinema feature and a feature computed for no line
+    del output["documents"][0]["features"]["cinema"]
+    for document in output["documents"]:
+        del document["features"]["emotions"]
+        # a personal lexicon, given after the lexicons of the config, matched approximately
+        document["features"]["jargon"] = [{"token": dict(result["token"], distance=1)}
+                                          for result in document["features"].get("cinema", [])]
+    return output
+
+
+def as_json(output):
+    return json.loads(json.dumps(output))
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_columnar(self):
+        """
+        Test that each feature is a table of parallel arrays and that the output is given back as is
+        """
+        output = load_example()
+        columnar = as_json(to_columnar(output))
+        self.assertEqual(columnar["format"], "columnar")
+        self.assertEqual(columnar["timings"], {"annotation": 0.5})
+        self.assertNotIn("emotions", columnar["features"])
+        self.assertEqual(columnar["missing"]["cinema"], [0])
+        coref = columnar["features"]["coref"]
+        self.assertEqual(set(coref), {"line_id", "start", "end", "text", "ref", "warning"})
+        self.assertEqual((coref["line_id"][0], coref["start"][0], coref["end"][0], coref["text"][0], coref["ref"][0]),
+                         (1, 32, 40, "actrices", 0))
+        self.assertEqual(len({len(values) for values in columnar["features"]["tense_notpresent"].values()}), 1)
+
+        # the distance column is only in the tables of the lexicons matched approximately
+        cinema = columnar["features"]["cinema"]
+        self.assertNotIn("distance", cinema)
+        self.assertEqual(columnar["features"]["jargon"], dict(cinema, distance=[1] * len(cinema["text"])))
+
+        self.assertEqual(as_json(to_records(columnar)), output)
+        features = list(to_records(columnar)["documents"][1]["features"])
+        self.assertEqual(features.index("jargon"), features.index("offensive") + 1)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow(self):
+        """
+        Test that the Arrow IPC stream gives back the output
+        """
+        output = load_example()
+        self.assertEqual(as_json(from_arrow(to_arrow(output))), output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Unit tests for the asynchronous analysis jobs
+"""
+
+import queue
+import threading
+import time
+import unittest
+
+from engine.jobs import JobQueue
+
+
+class SlowEngine:
+    """Analysis in steps reporting their progress, each step waits for the test to release it"""
+
+    def __init__(self):
+        self.step = threading.Semaphore(0)
+
+    def analyze(self, text, progress=None):
+        lines = text.split("\n")
+        progress("annotation", 0, len(lines))
+        for i in range(len(lines)):
+            self.step.acquire()
+            progress("annotation", i + 1, len(lines))
+        return {"documents": [{"id": i, "text": line, "features": {}} for i, line in enumerate(lines)]}
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def wait_state(self, job, states):
+        for _ in range(200):
+            if job.state in states:
+                return
+            time.sleep(0.01)
+        self.fail("The job is %s" % job.state)
+
+    def test_progress(self):
+        """
+        Test that a job reports its progress and gives its result once done
+        """
+        engine = SlowEngine()
+        jobs = JobQueue(engine, max_workers=1)
+        job = jobs.submit(text="a\nb")
+        self.wait_state(job, ("running",))
+
+        engine.step.release()
+        for _ in range(200):
+            if job.status()["stages"]["annotation"]["done"] == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(job.status()["stages"]["annotation"], {"done": 1, "total": 2})
+
+        engine.step.release()
+        self.wait_state(job, ("done",))
+        self.assertEqual(len(jobs.get(job.job_id).result["documents"]), 2)
+        jobs.close()
+
+    def test_cancel_and_queue(self):
+        """
+        Test that the queue is bounded and that queued and running jobs can be cancelled
+        """
+        engine = SlowEngine()
+        jobs = JobQueue(engine, max_workers=1, max_queued=1)
+        running = jobs.submit(text="a\nb")
+        self.wait_state(running, ("running",))
+        queued = jobs.submit(text="c")
+        with self.assertRaises(queue.Full):
+            jobs.submit(text="d")
+
+        jobs.cancel(queued.job_id)
+        self.assertEqual(queued.state, "cancelled")
+        jobs.cancel(running.job_id)
+        engine.step.release()
+        self.wait_state(running, ("cancelled",))
+        self.assertIsNone(running.result)
+        with self.assertRaises(KeyError):
+            jobs.get("unknown")
+        jobs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
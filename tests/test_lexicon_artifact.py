@@ -0,0 +1,79 @@
+"""
+Unit tests for the prebuilt artifacts of the lemmatized lexicons
+"""
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from flashtext import KeywordProcessor
+
+from engine.lexicons import LexiconRegistry
+from find_voc import artifact, find_voc
+from find_voc.fuzzy import ApproximateLemmaMatcher
+from tests.test_lexicons import Lemmatizer
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_artifact(self):
+        """
+        Test that an artifact gives back the lemmatized terms and that its trie finds them
+        """
+        terms = ["caméra", "gros plan", "plan", "gros plan", "plan séquence"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = artifact.artifact_path(directory, "abc", "FR")
+            artifact.write_artifact(path, terms, "abc", "FR", "1.0")
+            lexicon = artifact.LexiconArtifact(path)
+            self.assertEqual((lexicon.lexicon_id, lexicon.lang, lexicon.model_version), ("abc", "FR", "1.0"))
+            self.assertEqual(lexicon.terms(), terms)
+
+            ids = {lemma: i for i, lemma in enumerate(lexicon.vocabulary())}
+            self.assertEqual(lexicon.lookup([ids["gros"], ids["plan"]]), 1)
+            self.assertEqual(lexicon.lookup([ids["plan"], ids["séquence"]]), 4)
+            self.assertEqual(lexicon.lookup([ids["gros"]]), -1)
+            self.assertEqual(lexicon.lookup([ids["séquence"]]), -1)
+            lexicon.close()
+            keyword_processor = KeywordProcessor()
+            keyword_processor.add_keywords_from_list(terms)
+
+            # the matcher is built from the trie of the artifact, as from the lemmatized terms
+            matcher = artifact.load_lemma_matcher(path, "abc", "FR", "1.0")
+            self.assertEqual(sorted(matcher.terms()), sorted(find_voc.lemma_matcher(keyword_processor).terms()))
+            self.assertEqual(matcher.match(matcher.lemma_ids(["un", "gros", "plan", "séquence", "Caméra"]).tolist()),
+                             [(None, "gros plan", 1, 3), (None, "caméra", 4, 5)])
+            self.assertIsNone(artifact.load_lemma_matcher(path, "abc", "FR", "2.0"))
+            self.assertIsNone(artifact.load_lemma_matcher(path, "abc", "EN", "1.0"))
+            self.assertIsNone(artifact.load_lemma_matcher(os.path.join(directory, "none"), "abc", "FR", "1.0"))
+
+            # the trie is merged into a labeled matcher and indexed by the approximate matching
+            fuzzy_matcher = ApproximateLemmaMatcher(1)
+            fuzzy_matcher.add_matcher("cinema", matcher)
+            self.assertEqual(fuzzy_matcher.match(fuzzy_matcher.lemma_ids(["camra", "plan"]).tolist()),
+                             [("cinema", "caméra", 0, 1, 1), ("cinema", "plan", 1, 2, 0)])
+
+    def test_registry(self):
+        """
+        Test that the registry loads the matcher of a lexicon from its artifact
+        and lemmatizes the lexicon only if the artifact was built with other models
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            registry = LexiconRegistry(artifact_dir=directory, model_version="1.0")
+            lexicon_id = registry.register(pd.DataFrame({"TERM_EN": ["cameras", "close ups"]}))
+            artifact.write_artifact(artifact.artifact_path(directory, lexicon_id, "EN"), ["camera", "close up"],
+                                    lexicon_id, "EN", "1.0")
+            lemmatizer = Lemmatizer()
+            self.assertEqual(sorted(registry.matcher(lexicon_id, "EN", True, lemmatizer).terms()),
+                             [(("camera",), "camera"), (("close", "up"), "close up")])
+            self.assertEqual((lemmatizer.calls, registry.stats()["artifacts"]), (0, 1))
+
+            registry = LexiconRegistry(artifact_dir=directory, model_version="2.0")
+            registry.register(pd.DataFrame({"TERM_EN": ["cameras", "close ups"]}))
+            registry.matcher(lexicon_id, "EN", True, lemmatizer)
+            self.assertEqual((lemmatizer.calls, registry.stats()["artifacts"]), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
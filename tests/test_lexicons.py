@@ -0,0 +1,165 @@
+"""
+Unit tests for the registry of the lexicons and the cache of their matchers
+"""
+
+import io
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from flashtext import KeywordProcessor
+from stanza import Document
+
+from engine.lexicons import LEXICON_ID_ATTRIBUTE, LexiconRegistry
+from find_voc import fuzzy
+from find_voc.matcher import LemmaMatcher, LexiconMatcher
+
+
+class Lemmatizer:
+    """Stand-in of a Stanza pipeline: the lemma of a word is its text without a final "s", the calls are counted"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, docs):
+        self.calls += 1
+        return [Document([[{"id": i + 1, "text": word, "lemma": word.rstrip("s")}
+                           for i, word in enumerate(doc.text.split())]], text=doc.text) for doc in docs]
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_register(self):
+        """
+        Test that the id of a lexicon is the hash of its content, whatever the way it is registered
+        """
+        registry = LexiconRegistry(max_lexicons=2)
+        content = "TERM_EN\tTERM_FR\ncamera\tcaméra\nclose-ups\tgros plans\n"
+        lexicon_id = registry.register_content(content, "camera")
+        self.assertEqual(registry.register(pd.read_csv(io.StringIO(content), sep="\t")), lexicon_id)
+        self.assertEqual(registry.get(lexicon_id).attrs[LEXICON_ID_ATTRIBUTE], lexicon_id)
+        self.assertEqual(registry.lexicons(), [{"id": lexicon_id, "name": "camera"}])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "voc.csv")
+            with open(path, "w", encoding="utf-8") as lexicon_file:
+                lexicon_file.write("TERM_FR\nplan\n")
+            file_id = registry.register_file(path, "voc", pinned=True)
+            self.assertEqual(registry.register_file(path), file_id)
+            self.assertEqual(list(registry.get(file_id).TERM_FR), ["plan"])
+
+        # the least recently used lexicons are evicted, not the pinned ones
+        registry.register(pd.DataFrame({"FR": ["travelling"]}))
+        registry.register(pd.DataFrame({"FR": ["zoom"]}))
+        self.assertFalse(registry.contains(lexicon_id))
+        self.assertTrue(registry.contains(file_id))
+        self.assertRaises(KeyError, registry.get, lexicon_id)
+        self.assertRaises(ValueError, registry.register_content, "SOURCE\ncinema\n")
+
+    def test_matcher(self):
+        """
+        Test that a matcher is built once by lexicon, language and lemmatization option
+        """
+        registry = LexiconRegistry(max_matchers=2)
+        lemmatizer = Lemmatizer()
+        lexicon_id = registry.register(pd.DataFrame({"TERM_EN": ["cameras", "close ups"],
+                                                     "TERM_FR": ["caméra", "plan"]}))
+
+        matcher = registry.matcher(lexicon_id, "EN", True, lemmatizer)
+        self.assertEqual(sorted(matcher.terms()), [(("camera",), "camera"), (("close", "up"), "close up")])
+        self.assertIs(registry.matcher(lexicon_id, "EN", True, lemmatizer), matcher)
+        self.assertEqual(lemmatizer.calls, 1)
+        self.assertEqual(sorted(registry.matcher(lexicon_id, "EN", False, None).get_all_keywords()),
+                         ["cameras", "close ups"])
+        self.assertEqual(sorted(registry.matcher(lexicon_id, "FR", True, lemmatizer).terms()),
+                         [(("caméra",), "caméra"), (("plan",), "plan")])
+        self.assertEqual(registry.stats()["hits"], 1)
+        self.assertEqual(registry.stats()["size"], 2)
+
+        # the EN lemmatized matcher was evicted, it is built again
+        registry.matcher(lexicon_id, "EN", True, lemmatizer)
+        self.assertEqual(lemmatizer.calls, 3)
+        self.assertRaises(KeyError, registry.matcher, "unknown", "EN", True, lemmatizer)
+
+    def test_labeled_matcher(self):
+        """
+        Test that the lexicons scanned together give the hits of each lexicon scanned alone
+        """
+        lexicons = {"cinema": ["plan", "gros plan", "caméra", "film"], "jargon": ["gros", "plan large", "film_noir"],
+                    "empty": []}
+        matcher = LexiconMatcher()
+        processors = {}
+        for label, terms in lexicons.items():
+            matcher.add_keywords(label, terms)
+            processors[label] = KeywordProcessor()
+            processors[label].add_keywords_from_list(terms)
+        self.assertEqual(matcher.labels, ["cinema", "jargon", "empty"])
+
+        for text in ["Un gros plan large de la caméra.", "Gros plan, plan large", "film_noir film", "", "plan"]:
+            hits = matcher.extract_keywords(text, span_info=True)
+            for label, processor in processors.items():
+                self.assertEqual([hit[1:] for hit in hits if hit[0] == label],
+                                 processor.extract_keywords(text, span_info=True))
+        self.assertEqual(matcher.extract_keywords("un gros plan"), [("cinema", "gros plan"), ("jargon", "gros")])
+
+        # the lemmatized lexicons match whole lemmas, not the words inside a lemma
+        lemma_matcher = LemmaMatcher()
+        for label, terms in lexicons.items():
+            lemma_matcher.add_terms(label, terms)
+        lemmas = ["un", "gros", "plan", "large", "de", "le", "caméra", "plan-séquence", "film_noir"]
+        self.assertEqual(lemma_matcher.match(lemma_matcher.lemma_ids(lemmas).tolist()),
+                         [("jargon", "gros", 1, 2), ("cinema", "gros plan", 1, 3), ("jargon", "plan large", 2, 4),
+                          ("cinema", "caméra", 6, 7), ("jargon", "film_noir", 8, 9)])
+        self.assertEqual(lemma_matcher.match(lemma_matcher.lemma_ids(["plan", "large"]).tolist()),
+                         [("cinema", "plan", 0, 1), ("jargon", "plan large", 0, 2)])
+
+        # the labeled matcher is built from the matchers of the registry and cached
+        registry = LexiconRegistry()
+        lemmatizer = Lemmatizer()
+        ids = (("cinema", registry.register(pd.DataFrame({"TERM_EN": ["close ups"]}))),
+               ("jargon", registry.register(pd.DataFrame({"TERM_EN": ["ups", "cameras"]}))))
+        labeled_matcher = registry.labeled_matcher(ids, "EN", True, lemmatizer)
+        self.assertIs(registry.labeled_matcher(ids, "EN", True, lemmatizer), labeled_matcher)
+        self.assertEqual(lemmatizer.calls, 2)
+        self.assertEqual(labeled_matcher.match(labeled_matcher.lemma_ids(["Close", "up", "camera", None]).tolist()),
+                         [("cinema", "close up", 0, 2), ("jargon", "up", 1, 2), ("jargon", "camera", 2, 3)])
+        self.assertRaises(KeyError, registry.labeled_matcher, (("cinema", "unknown"),), "EN", True, lemmatizer)
+
+    def test_approximate_matcher(self):
+        """
+        Test that the approximate matching finds the terms with typos or without accents and gives their distance
+        """
+        self.assertEqual(fuzzy.fold("Caméra Cœur"), "camera coeur")
+        self.assertEqual(fuzzy.edit_distance("traveling", "travelling", 2), 1)
+        self.assertEqual(fuzzy.edit_distance("camera", "cmaera", 2), 1)
+        self.assertEqual(fuzzy.edit_distance("camera", "cinema", 1), 2)
+
+        matcher = fuzzy.ApproximateLemmaMatcher(2)
+        matcher.add_terms("cinema", ["caméra", "travelling", "plan", "champ contre-champ"])
+        matcher.add_terms("jargon", ["plan séquence"])
+        lemmas = ["le", "camera", "en", "traveling", "plat", "plan", "sequence", "champ", "contre-champs", None]
+        self.assertEqual(matcher.match(matcher.lemma_ids(lemmas).tolist()),
+                         [("cinema", "caméra", 1, 2, 0), ("cinema", "travelling", 3, 4, 1),
+                          ("cinema", "plan", 5, 6, 0), ("jargon", "plan séquence", 5, 7, 0),
+                          ("cinema", "champ contre-champ", 7, 9, 1)])
+        # the edits of the lemmas of a term are bounded by the max distance
+        matcher = fuzzy.ApproximateLemmaMatcher(1)
+        matcher.add_terms("cinema", ["champ contre-champ"])
+        self.assertEqual(matcher.match(matcher.lemma_ids(["champs", "contre-champs"]).tolist()), [])
+        self.assertEqual(matcher.match(matcher.lemma_ids(["champ", "contre-champs"]).tolist()),
+                         [("cinema", "champ contre-champ", 0, 2, 1)])
+
+        # the registry builds an approximate matcher for a max distance
+        registry = LexiconRegistry()
+        ids = (("cinema", registry.register(pd.DataFrame({"TERM_EN": ["cameras", "close ups"]}))),)
+        labeled_matcher = registry.labeled_matcher(ids, "EN", True, Lemmatizer(), max_distance=1)
+        self.assertIsInstance(labeled_matcher, fuzzy.ApproximateLemmaMatcher)
+        self.assertIsNot(registry.labeled_matcher(ids, "EN", True, Lemmatizer()), labeled_matcher)
+        self.assertEqual(labeled_matcher.match(labeled_matcher.lemma_ids(["kamera", "close", "up"]).tolist()),
+                         [("cinema", "camera", 0, 1, 1), ("cinema", "close up", 1, 3, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Unit tests for the metrics and the logs of the analyses
+"""
+
+import contextlib
+import io
+import json
+import unittest
+
+from prometheus_client import REGISTRY
+
+from engine import metrics
+from engine.engine import Engine
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_detector_durations(self):
+        """
+        Test that the duration of each detector is recorded under the name of its feature
+        """
+        def count(stage):
+            return REGISTRY.get_sample_value("vdqual_stage_duration_seconds_count", {"stage": stage}) or 0
+
+        engine = Engine()
+        engine.param_conf["executor"] = "sequential"
+        before = count("length"), count("person")
+        engine.run_detectors({"length": (len, ("abc",)), (0, "person"): (len, ("ab",))})
+        self.assertEqual((count("length"), count("person")), (before[0] + 1, before[1] + 1))
+
+    def test_sampled_logs(self):
+        """
+        Test that the requests are logged as JSON according to the sample rate, the errors always
+        """
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            metrics.log_request("predict", 0, num_lines=3)
+            metrics.log_request("predict", 0, error=True, status=400)
+            metrics.log_request("predict", 1, num_lines=2)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([record.get("status", record.get("num_lines")) for record in records], [400, 2])
+        self.assertTrue(records[0]["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
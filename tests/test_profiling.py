@@ -0,0 +1,48 @@
+"""
+Unit tests for the profiling of the analyses on demand
+"""
+
+import tempfile
+import time
+import unittest
+
+from engine.profiling import profile_call
+
+
+def busy_line(duration):
+    end = time.perf_counter() + duration
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def busy_vd():
+    return [busy_line(0.02) for _ in range(3)]
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_modes(self):
+        """
+        Test that each mode gives the collapsed stacks and the times of the profiled functions
+        """
+        for mode in ("deterministic", "sampling"):
+            with tempfile.TemporaryDirectory() as directory:
+                result, profile = profile_call(busy_vd, mode, interval=0.001, directory=directory)
+                self.assertEqual(len(result), 3)
+                functions = {function["function"].split("(")[-1][:-1]: function for function in profile["functions"]}
+                self.assertIn("busy_line", functions)
+                self.assertGreater(functions["busy_vd"]["cumulative_time"], 0.03)
+                self.assertTrue(any("busy_vd" in line and "busy_line" in line
+                                    for line in profile["collapsed"].splitlines()))
+                with open(profile["path"] + ".collapsed", encoding="utf-8") as collapsed_file:
+                    self.assertEqual(collapsed_file.read().strip(), profile["collapsed"])
+
+        with self.assertRaises(ValueError):
+            profile_call(busy_vd, "tracing")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+Unit tests for the performance regression gate
+"""
+
+import unittest
+
+from benchmark.regression import compare, parse_tolerances
+
+
+def results(stages):
+    return {"environment": {}, "scenarios": [{"lang": "FR", "format": "txt", "num_lines": 100, "stages": stages}]}
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_compare(self):
+        """
+        Test that only the stages slower than the tolerance plus the noise of the measures are regressions
+        """
+        baseline = results({"annotation": {"median": 1., "iqr": 0.1, "peak_memory": 10 * 2 ** 20},
+                            "person": {"median": 0.1, "iqr": 0.001},
+                            "length": {"median": 0.01, "iqr": 0.}})
+        current = results({"annotation": {"median": 1.3, "iqr": 0.1, "peak_memory": 20 * 2 ** 20},
+                           "person": {"median": 0.2, "iqr": 0.001},
+                           "coref": {"median": 0.5, "iqr": 0.}})
+        statuses = {(comparison["stage"], comparison["metric"]): comparison["status"]
+                    for comparison in compare(baseline, current)}
+        self.assertEqual(statuses, {("annotation", "latency"): "ok", ("annotation", "peak_memory"): "regression",
+                                    ("person", "latency"): "regression", ("coref", "latency"): "new",
+                                    ("length", "latency"): "missing"})
+
+        statuses = {(comparison["stage"], comparison["metric"]): comparison["status"]
+                    for comparison in compare(baseline, current, {"latency": 0.1, "person.latency": 2.})}
+        self.assertEqual(statuses[("annotation", "latency")], "regression")
+        self.assertEqual(statuses[("person", "latency")], "ok")
+        self.assertEqual(statuses[("annotation", "peak_memory")], "regression")
+
+        statuses = {comparison["stage"]: comparison["status"] for comparison in compare(current, baseline)}
+        self.assertEqual(statuses["person"], "improvement")
+
+    def test_parse_tolerances(self):
+        """
+        Test the tolerances given on the command line
+        """
+        self.assertEqual(parse_tolerances(["latency=0.3", "annotation.peak_memory=0.5"]),
+                         {"latency": 0.3, "annotation.peak_memory": 0.5})
+        with self.assertRaises(ValueError):
+            parse_tolerances(["speed=0.1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
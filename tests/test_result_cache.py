@@ -0,0 +1,102 @@
+"""
+Unit tests for the cache of the results of the analyses
+"""
+
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from engine.engine import Engine
+from engine.result_cache import DiskBackend, MemoryBackend, RedisBackend, ResultCache
+
+
+class LocalRedis:
+    """Stand-in of a Redis client keeping the values in a dictionary"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expiry = self.values.get(key, (None, None))
+        return None if expiry is not None and expiry < time.time() else value
+
+    def set(self, key, value, ex=None):
+        self.values[key] = (value, time.time() + ex if ex else None)
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def setUp(self):
+        self.parameters = {"text": "Il sourit.\nElle part.", "max_length": 15, "seuil_duplication": 2,
+                           "window_duplication": 5, "postag_repetition": ["VERB", "ADJ"], "lemmatizing": True,
+                           "strict_mode": True, "max_coref_length": 3, "with_emotion": False}
+
+    def test_key(self):
+        """
+        Test that the key depends only on the text, the parameters of the enabled features and the lexicons
+        """
+        engine = Engine()
+        key = engine.result_key(**self.parameters)
+        self.assertEqual(key, engine.result_key(**dict(self.parameters, text="Il sourit.\r\nElle part.",
+                                                       postag_repetition=["ADJ", "VERB"])))
+        self.assertNotEqual(key, engine.result_key(**dict(self.parameters, max_length=16)))
+
+        features = ["length", "cinema"]
+        key = engine.result_key(**dict(self.parameters, features=features))
+        self.assertEqual(key, engine.result_key(**dict(self.parameters, features=features, max_coref_length=4)))
+        lexicon = pd.DataFrame({"FR": ["plan"]})
+        self.assertNotEqual(key, engine.result_key(**dict(self.parameters, features=features,
+                                                          voc_cinema_df=lexicon)))
+
+    def test_backends(self):
+        """
+        Test that the results are given back by each backend until they expire
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (MemoryBackend(10), DiskBackend(directory, 10), RedisBackend(LocalRedis())):
+                cache = ResultCache(backend, ttl=60)
+                cache.put("a" * 64, {"documents": []})
+                self.assertEqual(cache.get("a" * 64), {"documents": []})
+                self.assertTrue(cache.contains("a" * 64))
+                self.assertIsNone(cache.get("b" * 64))
+                self.assertEqual(cache.stats()["hits"], 1)
+
+                backend.set("c" * 64, b"{}", ttl=-1)
+                self.assertIsNone(cache.get("c" * 64))
+
+    def test_types(self):
+        """
+        Test that a result taken from the cache has the types of the output of the analysis
+        """
+        result = {"documents": [{"id": 0, "text": "Il a mangé.", "features": {"tense_notpresent": [
+            {"token": {"text": "a", "offset_start": 3, "offset_end": 4, "ref_token": (0, 0)}}]}}]}
+        cache = ResultCache(MemoryBackend(10))
+        cache.put("a" * 64, result)
+        self.assertEqual(cache.get("a" * 64), result)
+        self.assertIsInstance(cache.get("a" * 64)["documents"][0]["features"]["tense_notpresent"][0]["token"]
+                              ["ref_token"], tuple)
+
+    def test_eviction(self):
+        """
+        Test that the oldest results are evicted beyond the max size
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (MemoryBackend(2), DiskBackend(directory, 2)):
+                for key in ("a", "b", "c"):
+                    backend.set(key * 64, b"{}")
+                    time.sleep(0.01)
+                self.assertIsNone(backend.get("a" * 64))
+                self.assertEqual(backend.get("c" * 64), b"{}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,13 +2,34 @@
 Unit tests for the main script
 """
 
+import threading
+import time
 import unittest
+from unittest import mock
 from run import main
+from modules import check_length_table
+from engine import metrics
+from engine.engine import Engine, get_engine, plan_processors, select_features
+from engine.result_cache import MemoryBackend, ResultCache
+from engine.session import AnalysisSession
+from engine.stream import analyze_stream, _continue_chains
 from configparser import ConfigParser
 from tests import check_config
 import requests
 
 
+def number_chains(documents):
+    """
+    Number the coreference chains of the documents in order of first appearance (the chains are the same whatever
+    their ids)
+    """
+    chain_ids = {}
+    for document in documents:
+        for token in document["features"].get("coref", []):
+            token["token"]["ref_id_chain"] = chain_ids.setdefault(token["token"]["ref_id_chain"], len(chain_ids))
+    return documents
+
+
 class Test(unittest.TestCase):
     """Unit tests"""
 
@@ -76,6 +97,289 @@ class Test(unittest.TestCase):
         self.assertTrue(out)
         self.assertEqual(len(out["documents"]), 3)
 
+    def test_engine_reuses_models(self):
+        """
+        Test that the models are loaded once and shared by the successive analyses
+        """
+        engine = get_engine()
+        main(self.text, 15, 2, 2, ["VERB", "ADJ", "ADV"], True, True, 3, False)
+        processor = engine.get_stanza_pipeline("EN")
+        coref_model = engine.get_coref_model("EN")
+
+        out = main(self.text, 15, 2, 2, ["VERB", "ADJ", "ADV"], True, True, 3, False)
+        self.assertEqual(len(out["documents"]), 3)
+        self.assertIs(get_engine(), engine)
+        self.assertIs(engine.get_stanza_pipeline("EN"), processor)
+        self.assertIs(engine.get_coref_model("EN"), coref_model)
+
+    def test_selected_features(self):
+        """
+        Test that only the enabled features are computed, with the minimal annotations
+        """
+        self.assertEqual(plan_processors({"length"}, True), "tokenize,mwt")
+        self.assertEqual(plan_processors({"cinema"}, False), "tokenize")
+        self.assertEqual(plan_processors({"emotions"}, True), "")
+        self.assertEqual(plan_processors(select_features(None, False), True), "tokenize,mwt,pos,lemma,depparse")
+        with self.assertRaises(ValueError):
+            select_features(["length", "spelling"])
+
+        out = main(self.text_cinema_fr, 15, 2, 5, ["VERB", "ADJ", "ADV"], True, True, 3, True,
+                   features=["length", "cinema"])
+        self.assertEqual(set(out["documents"][1]["features"]), {"length", "cinema"})
+        self.assertEqual(len(out["documents"][1]["features"]["cinema"]), 3)
+
+    def test_executors(self):
+        """
+        Test that the detectors give the same results whatever the executor running them
+        """
+        outputs = {}
+        for executor in ("sequential", "thread"):
+            engine = Engine()
+            engine.param_conf["executor"] = executor
+            outputs[executor] = engine.analyze(self.file_present_fr, 15, 2, 5, ["VERB", "ADJ", "ADV"],
+                                               True, True, 3, False, with_timings=True)
+            engine.close()
+            self.assertIn("annotation", outputs[executor].pop("timings"))
+        self.assertEqual(outputs["sequential"], outputs["thread"])
+
+    def test_session(self):
+        """
+        Test that the results of a session after edits are those of an analysis of the edited VD
+        """
+        features = ["length", "duplication", "cinema", "tense_notpresent", "person"]
+        lines = self.file_present_fr.split("\n")
+        session = AnalysisSession(get_engine(), self.file_present_fr, 15, 2, 1, ["VERB", "ADJ", "ADV"],
+                                  True, True, 3, False, features=features)
+
+        changes = session.edit([{"action": "replace", "line": 1, "text": "Il allait manger."},
+                                {"action": "delete", "line": 3},
+                                {"action": "insert", "line": 0, "text": "Zoom sur une feuille."}])
+        lines[1] = "Il allait manger."
+        del lines[3]
+        lines.insert(0, "Zoom sur une feuille.")
+        self.assertEqual(changes["num_lines"], len(lines))
+        self.assertIn(0, [document["id"] for document in changes["documents"]])
+
+        out = main("\n".join(lines), 15, 2, 1, ["VERB", "ADJ", "ADV"], True, True, 3, False, features=features)
+        documents = session.output()["documents"]
+        # the ids of the lemmas are kept between the edits, they are those of the complete analysis renumbered
+        lemma_ids = {}
+        for document, expected in zip(documents, out["documents"]):
+            for repetitions, expected_repetitions in zip(document["features"].get("duplication", []),
+                                                         expected["features"].get("duplication", [])):
+                for repetition, expected_repetition in zip(repetitions, expected_repetitions):
+                    self.assertEqual(lemma_ids.setdefault(repetition["token"].pop("id_lemma"),
+                                                          expected_repetition["token"]["id_lemma"]),
+                                     expected_repetition["token"].pop("id_lemma"))
+        self.assertEqual(len(set(lemma_ids.values())), len(lemma_ids))
+        self.assertEqual(documents, out["documents"])
+
+    def test_session_edits(self):
+        """
+        Test that the line breaks of a session are normalized as in an analysis and that invalid edits are refused
+        """
+        text = self.file_present_fr.replace("\n", "\r\n")
+        session = AnalysisSession(get_engine(), text, 15, 2, 1, ["VERB", "ADJ", "ADV"], True, True, 3, False,
+                                  features=["length"])
+        out = main(text, 15, 2, 1, ["VERB", "ADJ", "ADV"], True, True, 3, False, features=["length"])
+        self.assertEqual(session.output()["documents"], out["documents"])
+
+        session.edit([{"action": "replace", "line": 0, "text": "Il mange.\r\nIl dort."}])
+        self.assertEqual(session.lines[0], "Il mange. Il dort.")
+        for edits in (["x"], {"action": "delete", "line": 0}, [{"action": "move", "line": 0}]):
+            with self.assertRaises(ValueError):
+                session.edit(edits)
+
+    def test_session_chains(self):
+        """
+        Test that the coreference chains computed again after an edit keep their ids and the numbers of their mentions
+        """
+        lines = self.file_present_fr.split("\n")
+        session = AnalysisSession(get_engine(), self.file_present_fr, 15, 2, 1, ["VERB", "ADJ", "ADV"],
+                                  True, True, 3, False, features=["coref"], coref_context=len(lines))
+        documents = session.output()["documents"]
+        session.edit([{"action": "replace", "line": len(lines) // 2, "text": lines[len(lines) // 2]}])
+        self.assertEqual(session.output()["documents"], documents)
+
+        out = main(self.file_present_fr, 15, 2, 1, ["VERB", "ADJ", "ADV"], True, True, 3, False, features=["coref"])
+        self.assertEqual(number_chains(documents), number_chains(out["documents"]))
+
+    def test_batch(self):
+        """
+        Test that the results of a batch are those of the analysis of each VD
+        """
+        engine = get_engine()
+        parameters = {"max_length": 15, "seuil_duplication": 2, "window_duplication": 5,
+                      "postag_repetition": ["VERB", "ADJ", "ADV"], "lemmatizing": True, "strict_mode": True,
+                      "max_coref_length": 3, "with_emotion": False}
+        texts = [self.file_present_fr, self.text_cinema_fr, self.file_person_en]
+        outputs = engine.analyze_batch([{"text": text} for text in texts] + [{"text": self.text_es}],
+                                       **parameters)
+
+        self.assertEqual(outputs[:3], [engine.analyze(text, **parameters) for text in texts])
+        self.assertIn("error", outputs[3])
+
+    def test_batch_errors(self):
+        """
+        Test that a detector failing on a VD of a batch only fails this VD
+        """
+        def check_length(table, max_length):
+            if table.texts[0] == self.text_cinema_fr.split("\n")[0]:
+                raise RuntimeError("length failed")
+            return check_length_table(table, max_length)
+
+        engine = get_engine()
+        parameters = {"max_length": 15, "seuil_duplication": 2, "window_duplication": 5,
+                      "postag_repetition": ["VERB", "ADJ", "ADV"], "lemmatizing": True, "strict_mode": True,
+                      "max_coref_length": 3, "with_emotion": False, "features": ["length", "person"]}
+        texts = [self.file_present_fr, self.text_cinema_fr, self.file_person_en]
+        with mock.patch("engine.engine.check_length_table", check_length):
+            outputs = engine.analyze_batch([{"text": text} for text in texts], **parameters)
+
+        self.assertEqual(outputs[1], {"error": "length: RuntimeError: length failed"})
+        self.assertEqual([outputs[0], outputs[2]], [engine.analyze(text, use_cache=False, **parameters)
+                                                    for text in (texts[0], texts[2])])
+
+    def test_emotion_dispatch(self):
+        """
+        Test that the emotions are asked while the VD is annotated, that a service answering after the timeout
+        gives no emotions (and no cached result) and that the request of a cancelled analysis is still observed
+        """
+        engine = get_engine()
+        parameters = {"max_length": 15, "seuil_duplication": 2, "window_duplication": 1,
+                      "postag_repetition": ["VERB", "ADJ", "ADV"], "lemmatizing": True, "strict_mode": True,
+                      "max_coref_length": 3, "with_emotion": True, "features": ["person", "emotions"]}
+        started, answer = threading.Event(), threading.Event()
+
+        def slow_emotions(lines, lang, timeout=None):
+            started.set()
+            if not answer.wait(5):
+                raise requests.Timeout("no answer")
+            return {0: [{"token": {"text": "triste", "offset_start": 0, "offset_end": 6, "type": "state",
+                                   "warning": 1}}]}
+
+        annotate = engine.annotate
+        overlaps = []
+
+        def annotate_during_request(*args):
+            # the request of the emotions is running while the lines are annotated
+            overlaps.append(started.wait(5))
+            answer.set()
+            return annotate(*args)
+
+        with mock.patch("engine.engine.request_emotions", slow_emotions), \
+                mock.patch.object(engine, "annotate", annotate_during_request):
+            out = engine.analyze(self.file_present_fr, use_cache=False, **parameters)
+        self.assertEqual(overlaps, [True])
+        self.assertEqual(out["documents"][0]["features"]["emotions"][0]["token"]["text"], "triste")
+
+        started.clear()
+        answer.clear()
+        with mock.patch("engine.engine.request_emotions", slow_emotions), \
+                mock.patch.dict(engine.param_conf, {"emotion_timeout": 0.2}), \
+                mock.patch.object(engine, "result_cache", ResultCache(MemoryBackend(10))):
+            out = engine.analyze(self.file_present_fr, **parameters)
+            answer.set()
+            self.assertFalse(any(document["features"].get("emotions") for document in out["documents"]))
+            self.assertFalse(engine.result_cache.contains(engine.result_key(self.file_present_fr, **parameters)))
+
+        class Cancelled(Exception):
+            pass
+
+        def cancel(stage, done, total):
+            if stage == "annotation" and done:
+                started.wait(5)
+                raise Cancelled()
+
+        def failing_emotions(lines, lang, timeout=None):
+            started.set()
+            answer.wait(5)
+            raise RuntimeError("service down")
+
+        def errors():
+            return metrics.REGISTRY.get_sample_value("vdqual_errors_total",
+                                                     {"source": "emotions", "kind": "RuntimeError"}) or 0
+
+        started.clear()
+        answer.clear()
+        before = errors()
+        with mock.patch("engine.engine.request_emotions", failing_emotions):
+            with self.assertRaises(Cancelled):
+                engine.analyze(self.file_present_fr, use_cache=False, progress=cancel, **parameters)
+            answer.set()
+            for _ in range(50):
+                if errors() > before:
+                    break
+                time.sleep(0.1)
+        self.assertEqual(errors(), before + 1)
+
+    def test_stream(self):
+        """
+        Test that the lines given by chunks are those of the analysis of the whole VD
+        """
+        features = ["length", "duplication", "cinema", "tense_notpresent", "person", "coref"]
+        parameters = {"max_length": 15, "seuil_duplication": 2, "window_duplication": 1,
+                      "postag_repetition": ["VERB", "ADJ", "ADV"], "lemmatizing": True, "strict_mode": True,
+                      "max_coref_length": 3, "with_emotion": False, "features": features}
+        out = get_engine().analyze(self.file_present_fr, **parameters)
+
+        # the coreference of a chunk is computed with all the lines before it, the chains are continued. The first
+        # mention of a chain is only missing when the other mentions of the chain are in the next chunks
+        mentions = {(document["id"], token["token"]["offset_start"]): token["token"]
+                    for document in out["documents"] for token in document["features"]["coref"]}
+        for chunk_size in (1, 2, 100):
+            documents = list(analyze_stream(get_engine(), self.file_present_fr, chunk_size=chunk_size,
+                                            coref_context=len(out["documents"]), **parameters))
+            streamed = {(document["id"], token["token"]["offset_start"]): token["token"]
+                        for document in documents for token in document["features"].pop("coref")}
+            self.assertEqual(documents, [dict(document, features={feature: value for feature, value in
+                                                                  document["features"].items() if feature != "coref"})
+                                         for document in out["documents"]])
+            # a chain of the stream is a chain of the complete analysis
+            chain_ids = {}
+            for key, token in streamed.items():
+                self.assertEqual(dict(token, ref_id_chain=None), dict(mentions[key], ref_id_chain=None))
+                self.assertEqual(chain_ids.setdefault(token["ref_id_chain"], mentions[key]["ref_id_chain"]),
+                                 mentions[key]["ref_id_chain"])
+            self.assertEqual(len(set(chain_ids.values())), len(chain_ids))
+            for (line, offset_start), token in mentions.items():
+                if (line, offset_start) not in streamed:
+                    chunk_end = (line // chunk_size + 1) * chunk_size
+                    self.assertEqual([other for other_key, other in mentions.items() if other_key[0] < chunk_end
+                                      and other["ref_id_chain"] == token["ref_id_chain"]], [token])
+        self.assertEqual(set(streamed), set(mentions))
+
+        with self.assertRaises(ValueError):
+            analyze_stream(get_engine(), "", **parameters)
+
+    def test_stream_chains(self):
+        """
+        Test that a coreference chain continued in the next chunk keeps its id, its count of mentions and is split
+        at its first mention
+        """
+        def token(text, offset_start, chain, mention):
+            return {"token": {"text": text, "offset_start": offset_start, "offset_end": offset_start + len(text),
+                              "ref_id_chain": chain, "warning": 0, "mention": mention}}
+
+        chain_ids = {}
+        output, next_chain_id = _continue_chains({0: [token("Marie", 0, 0, 0), token("elle", 10, 0, 1),
+                                                      token("Paul", 20, 1, 0)]}, 0, 0, 1, chain_ids, 0, 2)
+        self.assertEqual([token["token"]["ref_id_chain"] for token in output[0]], [0, 0])
+        self.assertNotIn("mention", output[0][0]["token"])
+        self.assertEqual(next_chain_id, 1)
+
+        # the chunk starts at line 1, line 0 is the context where Paul had no other mention,
+        # the last Marie starts a chain without other mention
+        output, next_chain_id = _continue_chains({0: [token("Marie", 0, 5, 0), token("elle", 10, 5, 1),
+                                                      token("Paul", 20, 6, 0)],
+                                                  1: [token("elle", 0, 5, 2), token("Marie", 10, 5, 3),
+                                                      token("elle", 20, 5, 4), token("il", 30, 6, 1),
+                                                      token("Marie", 40, 5, 5)]},
+                                                 0, 1, 2, chain_ids, next_chain_id, 2)
+        self.assertEqual([(token["token"]["offset_start"], token["token"]["ref_id_chain"], token["token"]["warning"])
+                          for token in output[0]], [(0, 0, 1), (10, 1, 0), (20, 1, 0), (30, 2, 0)])
+        self.assertEqual(next_chain_id, 3)
+
     def test_duplication(self):
         """
         Test for duplication
@@ -157,7 +461,8 @@ class Test(unittest.TestCase):
         Test for a text in malformed TSV format
         """
         with self.assertRaises(ValueError):
-            # out_en = main(self.file_person_en_tsv_malformed, "EN", 15, 2, 5, ["VERB", "ADJ", "ADV"], True, True, 3, False)
+            # out_en = main(self.file_person_en_tsv_malformed, "EN", 15, 2, 5, ["VERB", "ADJ", "ADV"], True, True, 3,
+            #               False)
             out_en = main(self.file_person_en_tsv_malformed, 15, 2, 5, ["VERB", "ADJ", "ADV"], True, True, 3, False)
 
     def test_coref(self):
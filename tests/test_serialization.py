@@ -0,0 +1,44 @@
+"""
+Unit tests for the serialization and the compression of the JSON responses
+"""
+
+import gzip
+import json
+import unittest
+
+import numpy as np
+
+from engine.serialization import ENCODINGS, compress, dumps
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_dumps(self):
+        """
+        Test that the outputs are serialized as compact UTF-8 JSON, with their integer keys and numpy numbers
+        """
+        output = {"documents": [{"id": 0, "text": "Elle entre dans la pièce.",
+                                 "features": {"emotions": {0: [np.float32(0.5)]}, "person": [{"values": {1}}]}}]}
+        self.assertEqual(json.loads(dumps(output)),
+                         {"documents": [{"id": 0, "text": "Elle entre dans la pièce.",
+                                         "features": {"emotions": {"0": [0.5]}, "person": [{"values": [1]}]}}]})
+        self.assertIn("pièce".encode("utf-8"), dumps(output))
+
+    def test_compress(self):
+        """
+        Test that the compressed bodies give back the JSON
+        """
+        body = dumps({"documents": [{"id": i, "text": "Il regarde la caméra."} for i in range(100)]})
+        self.assertEqual(gzip.decompress(compress(body, "gzip")), body)
+        self.assertLess(len(compress(body, "gzip")), len(body))
+        if "zstd" in ENCODINGS:
+            import zstandard
+            self.assertEqual(zstandard.ZstdDecompressor().decompress(compress(body, "zstd")), body)
+        self.assertEqual(compress(body, None), body)
+        with self.assertRaises(ValueError):
+            compress(body, "br")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+"""
+Unit tests for the token table of the annotated lines and the detectors working on it
+"""
+
+import pickle
+import unittest
+
+from flashtext import KeywordProcessor
+from stanza import Document
+
+from modules import check_length, check_length_table, record_outputs
+from coref.coref import _sentence_tokens
+from duplication import duplication
+from engine.token_table import FEATURE_BITS, MISSING, TokenTable, UPOS_CODES
+from find_voc import find_voc
+from find_voc.matcher import LemmaMatcher, LexiconMatcher
+from person import person
+from tense_notpresent import tense_notpresent
+
+
+def make_doc(text, sentences):
+    """
+    Annotated Stanza document of a line, the words of the sentences are (text, lemma, upos, feats, head) tuples,
+    a token of several words is a tuple (text, words)
+    """
+    annotations = []
+    position = 0
+    for sentence in sentences:
+        entries = []
+        for token in sentence:
+            words = token[1] if isinstance(token[1], list) else [token]
+            token_text = token[0]
+            start = text.index(token_text, position)
+            position = start + len(token_text)
+            first_id = len([entry for entry in entries if isinstance(entry["id"], int)]) + 1
+            if len(words) > 1:
+                entries.append({"id": (first_id, first_id + len(words) - 1), "text": token_text,
+                                "start_char": start, "end_char": position})
+            for k, (word_text, lemma, upos, feats, head) in enumerate(words):
+                entry = {"id": first_id + k, "text": word_text, "lemma": lemma, "upos": upos, "head": head,
+                         "deprel": "dep"}
+                if feats:
+                    entry["feats"] = feats
+                if len(words) == 1:
+                    entry["start_char"], entry["end_char"] = start, position
+                entries.append(entry)
+        annotations.append(entries)
+    return Document(annotations, text=text)
+
+
+def make_docs():
+    return [
+        make_doc("Tu regardes le film. Il mange du pain.", [
+            [("Tu", "tu", "PRON", "Number=Sing|Person=2|PronType=Prs", 2),
+             ("regardes", "regarder", "VERB", "Mood=Ind|Number=Sing|Person=2|Tense=Pres|VerbForm=Fin", 0),
+             ("le", "le", "DET", "Definite=Def", 4), ("film", "film", "NOUN", "Gender=Masc", 2),
+             (".", ".", "PUNCT", None, 2)],
+            [("Il", "il", "PRON", "Person=3|PronType=Prs", 2),
+             ("mange", "manger", "VERB", "Mood=Ind|Person=3|Tense=Pres|VerbForm=Fin", 0),
+             ("du", [("de", "de", "ADP", None, 5), ("le", "le", "DET", "Definite=Def", 5)], None, None, None),
+             ("pain", "pain", "NOUN", None, 2), (".", ".", "PUNCT", None, 2)]]),
+        make_doc("Il a mangé vite.", [
+            [("Il", "il", "PRON", "Person=3", 3), ("a", "avoir", "AUX", "Mood=Ind|Tense=Pres|VerbForm=Fin", 3),
+             ("mangé", "manger", "VERB", "Tense=Past|VerbForm=Part", 0), ("vite", "vite", "ADV", None, 3),
+             (".", ".", "PUNCT", None, 3)]]),
+        make_doc("", []),
+        make_doc("Elle vient de manger vite avec mon chien.", [
+            [("Elle", "il", "PRON", "Person=3", 2), ("vient", "venir", "VERB", "Mood=Ind|Tense=Pres|VerbForm=Fin", 0),
+             ("de", "de", "ADP", None, 4), ("manger", "manger", "VERB", "VerbForm=Inf", 2),
+             ("vite", "vite", "ADV", None, 4), ("avec", "avec", "ADP", None, 8),
+             ("mon", "mon", "DET", "Number[psor]=Sing|Person[psor]=1", 8), ("chien", "chien", "NOUN", None, 4),
+             (".", ".", "PUNCT", None, 2)]]),
+    ]
+
+
+class Test(unittest.TestCase):
+    """Unit tests"""
+
+    def test_from_docs(self):
+        """
+        Test that the words of the documents are rows of the table with their line, sentence, token and annotations
+        """
+        table = TokenTable.from_docs(make_docs())
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.num_words, 25)
+        self.assertEqual(table.num_tokens, 24)
+        self.assertEqual(table.line_sentences.tolist(), [0, 2, 3, 3, 4])
+        self.assertEqual(table.sentence_text(1), "Il mange du pain.")
+
+        # "du" is a token of two words sharing its offsets
+        rows = [row for row in table.sentence_word_range(1) if table.token_text[table.token[row]]
+                == table.string_id("du")]
+        self.assertEqual([table.string(table.lemma[row]) for row in rows], ["de", "le"])
+        self.assertEqual([table.index[row] for row in rows], [2, 3])
+        self.assertEqual([table.start[row] for row in rows], [MISSING, MISSING])
+        self.assertEqual(table.token_start[table.token[rows[0]]], 30)
+        self.assertEqual(table.upos[rows[0]], UPOS_CODES["ADP"])
+        self.assertEqual(table.head[rows[0]], 5)
+
+        row = table.line_word_range(0)[0]
+        self.assertTrue(table.has_feature("Person=2", row))
+        self.assertFalse(table.has_feature("Person=1", row))
+        self.assertEqual(table.feats_mask[table.line_word_range(0)[1]] & FEATURE_BITS["Mood"], FEATURE_BITS["Mood"])
+        self.assertEqual(table.string(table.feats[table.line_word_range(0)[4]]), None)
+        self.assertEqual(table.string_id("unknown"), MISSING)
+
+    def test_detectors(self):
+        """
+        Test that the detectors give the same results on the table as on the Stanza documents
+        """
+        docs = make_docs()
+        table = pickle.loads(pickle.dumps(TokenTable.from_docs(docs)))
+
+        self.assertEqual(check_length_table(table, 5), check_length(docs, 5))
+        self.assertEqual(person.detect_non_third_person_table(table), person.detect_non_third_person(docs))
+        self.assertEqual(person.detect_non_third_person_table(table)[3],
+                         [{"token": {"text": "mon", "offset_start": 31, "offset_end": 34}}])
+        for strict_mode in (True, False):
+            self.assertEqual(tense_notpresent.detect_non_present_tense_table(table, strict_mode),
+                             tense_notpresent.detect_non_present_tense(docs, strict_mode))
+        self.assertEqual(len(tense_notpresent.detect_non_present_tense_table(table, True)[3]), 3)
+        for span in (0, 1, 2):
+            dic_lemme, dic_lemme_table = {}, {}
+            self.assertEqual(duplication.check_duplication_table(table, 2, span, ["ADV", "VERB"], dic_lemme_table),
+                             duplication.check_duplication(docs, 2, span, ["ADV", "VERB"], dic_lemme))
+            self.assertEqual(dic_lemme_table, dic_lemme)
+
+        keyword_processor = KeywordProcessor()
+        keyword_processor.add_keywords_from_list(["film", "manger", "de le pain"])
+        other_processor = KeywordProcessor()
+        other_processor.add_keywords_from_list(["pain", "le pain"])
+        for lemmatizing in (True, False):
+            matcher = LemmaMatcher() if lemmatizing else LexiconMatcher()
+            matcher.add_keyword_processor("cinema", keyword_processor)
+            self.assertEqual(find_voc.check_lexicons_table(table, matcher, lemmatizing),
+                             {"cinema": find_voc.check_lexique(docs, None, "FR", lemmatizing,
+                                                               keyword_processor=keyword_processor)})
+            if lemmatizing:
+                # a term starting in a multi-word token ("du" = "de le") has the offsets of the token
+                self.assertEqual(find_voc.check_lexicons_table(table, matcher, True)["cinema"][0][2],
+                                 {"token": {"text": "du pain", "offset_start": 30, "offset_end": 37}})
+            matcher.add_keyword_processor("jargon", other_processor)
+            self.assertEqual(find_voc.check_lexicons_table(table, matcher, lemmatizing),
+                             {label: find_voc.check_lexique(docs, None, "FR", lemmatizing, keyword_processor=processor)
+                              for label, processor in (("cinema", keyword_processor), ("jargon", other_processor))})
+        self.assertEqual(_sentence_tokens(table), _sentence_tokens(docs))
+        self.assertEqual(record_outputs(table, {}), record_outputs(docs, {}))
+
+    def test_person_rules(self):
+        """
+        Test the French special cases of the person detection on the table
+        """
+        docs = [make_doc("Donne-moi le film. Tu peux partir. Il part de là.", [
+            [("Donne-moi", "donne-moi", "VERB", "Mood=Imp|VerbForm=Fin", 0), ("le", "le", "DET", None, 3),
+             ("film", "film", "NOUN", None, 1), (".", ".", "PUNCT", None, 1)],
+            [("Tu", "de", "ADP", None, 2), ("peux", "pouvoir", "VERB", "Mood=Ind|Tense=Pres|VerbForm=Fin", 0),
+             ("partir", "partir", "VERB", "VerbForm=Inf", 2), (".", ".", "PUNCT", None, 2)],
+            [("Il", "il", "PRON", "Person=3", 2), ("part", "partir", "VERB", "Mood=Ind|Tense=Pres", 0),
+             ("de", "de", "ADP", None, 4), ("là", "là", "ADV", None, 2), (".", ".", "PUNCT", None, 2)]])]
+        output = person.detect_non_third_person_table(TokenTable.from_docs(docs))
+        self.assertEqual(output, person.detect_non_third_person(docs))
+        self.assertEqual([token["token"]["text"] for token in output[0]], ["Donne-moi", "Tu"])
+
+        table = TokenTable.from_docs(make_docs())
+        self.assertEqual(person.non_third_person_mask(table).sum(), 2)
+
+    def test_verbal_expressions(self):
+        """
+        Test the verbal expressions of the tense detection: a verb whose text is in another verb is kept,
+        the auxiliaries are joined to their head, a sentence can end with "venir"
+        """
+        docs = [make_doc("Je crois qu'il croise Paul. Il a été vu. Elle vient", [
+            [("Je", "je", "PRON", "Person=1", 2), ("crois", "croire", "VERB", "Mood=Ind|Tense=Pres|VerbForm=Fin", 0),
+             ("qu'", "que", "SCONJ", None, 5), ("il", "il", "PRON", "Person=3", 5),
+             ("croise", "croiser", "VERB", "Mood=Ind|Tense=Pres|VerbForm=Fin", 2), ("Paul", "Paul", "PROPN", None, 5),
+             (".", ".", "PUNCT", None, 2)],
+            [("Il", "il", "PRON", "Person=3", 4), ("a", "avoir", "AUX", "Mood=Ind|Tense=Pres|VerbForm=Fin", 4),
+             ("été", "être", "AUX", "Tense=Past|VerbForm=Part", 4),
+             ("vu", "voir", "VERB", "Tense=Past|VerbForm=Part", 0),
+             (".", ".", "PUNCT", None, 4)],
+            [("Elle", "il", "PRON", "Person=3", 2),
+             ("vient", "venir", "VERB", "Mood=Ind|Tense=Pres|VerbForm=Fin", 0)]])]
+        table = TokenTable.from_docs(docs)
+        expressions = []
+        for sentence in range(3):
+            words = slice(table.sentence_word_range(sentence).start, table.sentence_word_range(sentence).stop)
+            expressions.append(tense_notpresent.match_verbal_expressions(
+                table.upos[words].tolist(), [table.string(lemma) for lemma in table.lemma[words].tolist()],
+                table.feats_mask[words].tolist(), table.head[words].tolist()))
+        self.assertEqual(expressions, [[[1], [4]], [[1, 2, 3]], [[1]]])
+        self.assertEqual([[[word.text for word in expression]
+                           for expression in tense_notpresent.create_verbal_expression(sentence)]
+                          for sentence in docs[0].sentences],
+                         [[["crois"], ["croise"]], [["a", "été", "vu"]], [["vient"]]])
+
+        for strict_mode in (True, False):
+            output = tense_notpresent.detect_non_present_tense_table(table, strict_mode)
+            self.assertEqual(output, tense_notpresent.detect_non_present_tense(docs, strict_mode))
+            self.assertEqual([(token["token"]["text"], token["token"]["ref_token"]) for token in output[0]],
+                             [("a", (1, 0)), ("été", (1, 0)), ("vu", (1, 0))])
+
+
+if __name__ == "__main__":
+    unittest.main()